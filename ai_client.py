@@ -0,0 +1,160 @@
+"""Shared OpenAI client with connection pooling, timeouts, retries and limits.
+
+One ``OpenAIGateway`` per process is the "openai" ``providers.AIProvider``. Its
+client keeps HTTP connections alive between requests instead of reconnecting
+for each one, and every call has an explicit timeout. Rate limits, timeouts
+and server errors are retried with jittered exponential backoff, waiting as
+long as a ``Retry-After`` header asks when there is one. A semaphore per model
+caps how many requests are in flight at once, so concurrent sessions queue
+locally instead of drawing 429s from the API.
+"""
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import openai
+
+from providers import AIProvider
+
+CONNECT_TIMEOUT_SECONDS = 10
+CHAT_TIMEOUT_SECONDS = 120
+TRANSCRIBE_TIMEOUT_SECONDS = 300
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# Longest Retry-After honoured before giving up on the request
+RETRY_AFTER_MAX_SECONDS = 120.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+MAX_IN_FLIGHT_PER_MODEL = 4
+
+
+def retry_after_seconds(error):
+    """Delay requested by an API error's Retry-After headers, or None"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    value = headers.get('retry-after-ms')
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(error):
+    """Whether an API error is worth retrying"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def backoff_seconds(attempt, error=None):
+    """Delay before retry number attempt (0-based)
+
+    A Retry-After from the server wins; otherwise "full jitter" exponential
+    backoff, so clients that failed together do not retry together.
+    """
+    requested = retry_after_seconds(error) if error is not None else None
+    if requested is not None:
+        return requested
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+class OpenAIGateway(AIProvider):
+    """Process-wide OpenAI client: pooled, time-limited, retried, rate limited"""
+
+    def __init__(self, api_key, max_in_flight_per_model=MAX_IN_FLIGHT_PER_MODEL, max_attempts=MAX_ATTEMPTS):
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            # Retries are done here, where they can respect the model limit
+            max_retries=0,
+            # Chat calls use this default; per-call timeouts must keep the connect limit
+            timeout=openai.Timeout(CHAT_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            http_client=openai.DefaultHttpxClient(limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            )),
+        )
+        self.max_in_flight_per_model = max_in_flight_per_model
+        self.max_attempts = max_attempts
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _slot(self, model):
+        """Hold one of the model's in-flight slots for the duration of the block"""
+        with self._lock:
+            semaphore = self._semaphores.get(model)
+            if semaphore is None:
+                semaphore = self._semaphores[model] = threading.BoundedSemaphore(self.max_in_flight_per_model)
+        with semaphore:
+            yield
+
+    def _with_retries(self, call, before_retry=None):
+        """Run call(), retrying transient failures with backoff"""
+        for attempt in range(self.max_attempts):
+            try:
+                return call()
+            except Exception as error:
+                if attempt + 1 >= self.max_attempts or not is_retryable(error):
+                    raise
+                delay = backoff_seconds(attempt, error)
+                if delay > RETRY_AFTER_MAX_SECONDS:
+                    raise
+                time.sleep(delay)
+                if before_retry is not None:
+                    before_retry()
+
+    def chat(self, **request):
+        """Create a chat completion"""
+        with self._slot(request.get('model')):
+            return self._with_retries(
+                lambda: self.client.chat.completions.create(**request)
+            )
+
+    def chat_stream(self, **request):
+        """Create a streamed chat completion and yield its chunks
+
+        Only opening the stream is retried: once chunks have been handed out,
+        a failure is raised rather than replaying text the caller has shown.
+        The model's slot is held until the stream is exhausted or closed.
+        """
+        with self._slot(request.get('model')):
+            stream = self._with_retries(
+                lambda: self.client.chat.completions.create(stream=True, **request)
+            )
+            yield from stream
+
+    def transcribe(self, file, **params):
+        """Transcribe an audio file object, rewinding it before each retry"""
+        with self._slot(params.get('model')):
+            return self._with_retries(
+                lambda: self.client.audio.transcriptions.create(
+                    file=file, timeout=openai.Timeout(TRANSCRIBE_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+                    **params
+                ),
+                before_retry=lambda: file.seek(0),
+            )
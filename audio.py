@@ -0,0 +1,348 @@
+"""Audio helpers for VetScribe transcription.
+
+Recorders produce 44.1 kHz (often stereo) 16-bit WAV, several times more data
+than speech recognition needs. ``preprocess_wav()`` downmixes to mono, resamples
+to 16 kHz and shortens long silent stretches found by frame-energy voice
+activity detection before anything is uploaded.
+
+Whisper takes one upload of at most 25 MB per request, which an hour-long
+consultation exceeds. ``transcribe_chunked()`` splits WAV recordings into
+segments, cutting at the quietest point near each segment boundary so words are
+not split. It transcribes the segments concurrently on a bounded thread pool
+and joins the text back in recording order, so wall-clock time follows the
+slowest segment instead of the whole recording. Formats the ``wave`` module
+cannot read (MP3, M4A, ...) are sent whole.
+
+``transcribe_source()`` is the single entry point: it accepts a recorder
+array, raw bytes or an uploaded file, keeps everything in memory (uploads are
+named ``BytesIO`` buffers, never temp files) and times each stage. Given a
+``cache.DiskCache`` it returns transcripts of audio it has seen before, keyed
+on the audio content, the pipeline settings and the model parameters.
+"""
+import io
+import mmap
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from cache import content_hash
+
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+CHUNK_TARGET_SECONDS = 120  # Preferred segment length
+CHUNK_SEARCH_SECONDS = 15  # How far back from the target to look for a pause
+SILENCE_FRAME_SECONDS = 0.03  # Energy window used to find pauses
+TRANSCRIBE_WORKERS = 4  # Segments uploaded at once
+
+TARGET_RATE = 16000  # Whisper resamples to 16 kHz internally anyway
+VAD_FLOOR_DB = -50.0  # Frames quieter than this (dBFS) are always silence
+VAD_NOISE_MARGIN_DB = 8.0  # ... and so are frames this close to the noise floor,
+VAD_SPEECH_MARGIN_DB = 20.0  # ... unless within this of the loud (speech) level
+MIN_SILENCE_SECONDS = 1.0  # Shorter pauses are kept as they are
+KEEP_SILENCE_SECONDS = 0.3  # Silence left on each side of a shortened pause
+
+WAV_HEADER_PROBE = 64 * 1024  # Bytes searched for the header chunks
+
+# Settings that change what is uploaded, and so belong in transcript cache keys
+PIPELINE_PARAMS = {
+    'target_rate': TARGET_RATE,
+    'vad': [VAD_FLOOR_DB, VAD_NOISE_MARGIN_DB, VAD_SPEECH_MARGIN_DB, MIN_SILENCE_SECONDS, KEEP_SILENCE_SECONDS],
+    'chunking': [CHUNK_TARGET_SECONDS, CHUNK_SEARCH_SECONDS, SILENCE_FRAME_SECONDS],
+}
+
+# numpy sample types for the WAV sample widths we can split
+_SAMPLE_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def read_wav(wav_data):
+    """Decode WAV data into a (frames, channels) sample array and the frame rate
+
+    ``wav_data`` may be bytes or any buffer, such as an mmap of a spooled
+    recording; the samples are a read-only view of it, not a copy. Raises
+    ``wave.Error`` for data that is not PCM WAV in a supported width.
+    """
+    header = io.BytesIO(bytes(memoryview(wav_data)[:WAV_HEADER_PROBE]))
+    with wave.open(header, 'rb') as wav:
+        width = wav.getsampwidth()
+        if width not in _SAMPLE_TYPES:
+            raise wave.Error(f"Unsupported sample width: {width * 8} bits")
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        # wave stops right after the data chunk header
+        offset = header.tell()
+        frames = wav.getnframes()
+    # Recorders that stream the file may leave a wrong length in the header
+    frames = min(frames, (len(wav_data) - offset) // (width * channels))
+    samples = np.frombuffer(wav_data, dtype=_SAMPLE_TYPES[width], count=frames * channels, offset=offset)
+    return samples.reshape(-1, channels), rate
+
+
+def write_wav(samples, rate):
+    """Encode a (frames, channels) sample array as WAV bytes"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(samples.dtype.itemsize)
+        wav.setframerate(rate)
+        wav.writeframes(np.ascontiguousarray(samples).tobytes())
+    return buffer.getvalue()
+
+
+def wav_duration(wav_data):
+    """Length of WAV audio in seconds, or None if it cannot be read"""
+    try:
+        samples, rate = read_wav(wav_data)
+        return len(samples) / rate
+    except (wave.Error, EOFError, ValueError):
+        return None
+
+
+def to_mono_float(samples):
+    """Downmix a (frames, channels) sample array to mono float32 in [-1, 1]"""
+    mono = samples.astype(np.float32)
+    if samples.dtype == np.uint8:
+        mono -= 128.0
+    mono = mono.mean(axis=1)
+    return mono / float(2 ** (8 * samples.dtype.itemsize - 1))
+
+
+def frame_energy(mono, rate, frame_seconds=SILENCE_FRAME_SECONDS):
+    """RMS energy of consecutive fixed-length frames, plus the frame length in samples"""
+    frame_len = max(1, int(rate * frame_seconds))
+    usable = len(mono) // frame_len * frame_len
+    frames = mono[:usable].reshape(-1, frame_len)
+    return np.sqrt((frames ** 2).mean(axis=1)), frame_len
+
+
+def resample(mono, rate, target_rate=TARGET_RATE):
+    """Resample mono float audio by linear interpolation
+
+    A moving average over one output sample period is applied first as a
+    cheap low-pass filter against aliasing when downsampling.
+    """
+    if rate == target_rate or len(mono) == 0:
+        return mono
+    if rate > target_rate:
+        width = int(round(rate / target_rate))
+        if width > 1:
+            mono = np.convolve(mono, np.full(width, 1.0 / width, dtype=np.float32), mode='same')
+    out_len = int(len(mono) * target_rate / rate)
+    positions = np.arange(out_len, dtype=np.float64) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(mono)), mono).astype(np.float32)
+
+
+def trim_silence(mono, rate):
+    """Shorten silent stretches longer than MIN_SILENCE_SECONDS
+
+    A frame counts as silence when its energy is below VAD_FLOOR_DB, or within
+    VAD_NOISE_MARGIN_DB of the recording's noise floor (its 10th percentile
+    frame energy) and more than VAD_SPEECH_MARGIN_DB below its speech level
+    (90th percentile), so audio without pauses is left alone. Each long pause keeps KEEP_SILENCE_SECONDS on either side so
+    words are not run together. Returns the trimmed audio.
+    """
+    energy, frame_len = frame_energy(mono, rate)
+    if len(energy) == 0:
+        return mono
+    energy_db = 20 * np.log10(np.maximum(energy, 1e-10))
+    noise_db, speech_db = np.percentile(energy_db, [10, 90])
+    threshold = max(VAD_FLOOR_DB, min(noise_db + VAD_NOISE_MARGIN_DB, speech_db - VAD_SPEECH_MARGIN_DB))
+    silent = energy_db < threshold
+
+    min_frames = int(MIN_SILENCE_SECONDS * rate) // frame_len
+    keep_frames = int(KEEP_SILENCE_SECONDS * rate) // frame_len
+    keep = np.ones(len(mono), dtype=bool)
+
+    # Start/end frame of every run of silent frames
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        if end - start >= min_frames:
+            keep[(start + keep_frames) * frame_len:(end - keep_frames) * frame_len] = False
+    return mono[keep]
+
+
+def preprocess_wav(wav_bytes):
+    """Prepare WAV audio for upload: mono, 16 kHz, 16-bit, long silences shortened
+
+    Returns the new WAV bytes and a stats dict (input/output bytes and
+    seconds). Audio that is not a readable WAV is returned unchanged with
+    stats of None.
+    """
+    try:
+        samples, rate = read_wav(wav_bytes)
+    except (wave.Error, EOFError, ValueError):
+        return wav_bytes, None
+
+    # Convert in 10 second blocks so an hour of 44.1 kHz stereo is never
+    # held as full-rate floats
+    block = rate * 10
+    mono = np.concatenate([np.zeros(0, dtype=np.float32)] + [
+        resample(to_mono_float(samples[i:i + block]), rate) for i in range(0, len(samples), block)
+    ])
+    mono = trim_silence(mono, TARGET_RATE)
+    pcm = (np.clip(mono, -1.0, 1.0) * 32767).astype(np.int16).reshape(-1, 1)
+    processed = write_wav(pcm, TARGET_RATE)
+    if len(processed) >= len(wav_bytes):
+        # Already compact - nothing to gain
+        processed = wav_bytes
+    return processed, {
+        'input_bytes': len(wav_bytes),
+        'output_bytes': len(processed),
+        'input_seconds': len(samples) / rate,
+        'output_seconds': len(pcm) / TARGET_RATE if processed is not wav_bytes else len(samples) / rate,
+    }
+
+
+def split_at_silence(samples, rate, target_seconds=CHUNK_TARGET_SECONDS,
+                     search_seconds=CHUNK_SEARCH_SECONDS, max_bytes=WHISPER_MAX_UPLOAD_BYTES):
+    """Split samples into segments of about ``target_seconds``, cutting at pauses
+
+    Each cut is placed at the quietest frame in the ``search_seconds`` before
+    the target length. Segments never exceed ``max_bytes`` once encoded.
+    """
+    bytes_per_frame = samples.shape[1] * samples.dtype.itemsize
+    # Leave room for the WAV header
+    max_frames = min(int(target_seconds * rate), (max_bytes - 1024) // bytes_per_frame)
+    if len(samples) <= max_frames:
+        return [samples]
+
+    energy, frame_len = frame_energy(to_mono_float(samples), rate)
+    search_frames = max(1, int(search_seconds * rate) // frame_len)
+
+    segments = []
+    start = 0
+    while len(samples) - start > max_frames:
+        # Energy frames lying inside [end - search, end) of this segment
+        end_frame = (start + max_frames) // frame_len
+        window = energy[max(start // frame_len + 1, end_frame - search_frames):end_frame]
+        if len(window):
+            quietest = end_frame - len(window) + int(np.argmin(window))
+            cut = quietest * frame_len + frame_len // 2
+        else:
+            cut = start + max_frames
+        segments.append(samples[start:cut])
+        start = cut
+    segments.append(samples[start:])
+    return segments
+
+
+def transcribe_chunked(audio_bytes, transcribe_segment, filename="recording.wav",
+                       max_workers=TRANSCRIBE_WORKERS, on_progress=None):
+    """Transcribe a recording segment by segment and join the text in order
+
+    ``transcribe_segment(audio_file)`` transcribes one upload, given as a
+    named in-memory buffer, and returns its text. ``on_progress(done, total)`` is called from the calling thread as
+    segments finish, so it may update Streamlit elements. Errors from any
+    segment propagate.
+    """
+    try:
+        samples, rate = read_wav(audio_bytes)
+    except (wave.Error, EOFError, ValueError):
+        # Not a WAV we can split - send it as a single upload
+        text = str(transcribe_segment(named_buffer(audio_bytes, filename)))
+        if on_progress:
+            on_progress(1, 1)
+        return text
+
+    segments = split_at_silence(samples, rate)
+    if len(segments) == 1:
+        uploads = [(filename, audio_bytes)]
+    else:
+        stem = filename.rsplit('.', 1)[0]
+        uploads = [(f"{stem}_{i + 1:03d}.wav", write_wav(seg, rate)) for i, seg in enumerate(segments)]
+
+    texts = [None] * len(uploads)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uploads))) as pool:
+        futures = {
+            pool.submit(transcribe_segment, named_buffer(data, name)): i
+            for i, (name, data) in enumerate(uploads)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            texts[futures[future]] = str(future.result()).strip()
+            if on_progress:
+                on_progress(done, len(uploads))
+    return " ".join(text for text in texts if text)
+
+
+def audio_source_bytes(source):
+    """Raw bytes of a recorder array, bytes-like object or uploaded file
+
+    Buffers such as an mmap of a spooled recording are returned as they are,
+    so large recordings are never copied into memory at once.
+    """
+    if isinstance(source, np.ndarray):
+        return source.tobytes()
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return source
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return source.read()
+    raise TypeError(f"Unsupported audio source: {type(source).__name__}")
+
+
+def named_buffer(data, filename):
+    """In-memory file the OpenAI client can upload, named so it knows the format"""
+    buffer = io.BytesIO(data)
+    buffer.name = filename
+    return buffer
+
+
+def transcribe_source(source, transcribe_segment, filename=None, on_progress=None,
+                      cache=None, model_params=None, audio_hash=None):
+    """Ingest, pre-process and transcribe audio from any supported source
+
+    Returns the text and a stats dict with input/output bytes, input/output
+    seconds when the audio was a WAV we could process, the number of segments,
+    whether the transcript came from ``cache`` and per-stage ``timings`` in
+    seconds (ingest, cache, preprocess, transcribe). ``model_params`` describe
+    what ``transcribe_segment`` sends to the API and are part of the cache key.
+    ``audio_hash`` is the source's ``content_hash()`` when the caller already
+    has it, so the audio is not hashed again.
+    """
+    timings = {}
+    started = time.perf_counter()
+    audio_bytes = audio_source_bytes(source)
+    filename = filename or getattr(source, 'name', None) or "recording.wav"
+    timings['ingest'] = time.perf_counter() - started
+
+    cache_key = None
+    if cache is not None:
+        started = time.perf_counter()
+        cache_key = cache.make_key(audio=audio_hash or content_hash(audio_bytes), pipeline=PIPELINE_PARAMS,
+                                   model=model_params or {})
+        cached = cache.get(cache_key)
+        timings['cache'] = time.perf_counter() - started
+        if cached is not None:
+            if on_progress:
+                on_progress(1, 1)
+            return cached['text'], {**cached['stats'], 'cached': True, 'timings': timings}
+
+    started = time.perf_counter()
+    processed, prep_stats = preprocess_wav(audio_bytes)
+    timings['preprocess'] = time.perf_counter() - started
+
+    segments = []
+    def count_progress(done, total):
+        segments[:] = [total]
+        if on_progress:
+            on_progress(done, total)
+
+    started = time.perf_counter()
+    text = transcribe_chunked(processed, transcribe_segment, filename=filename, on_progress=count_progress)
+    timings['transcribe'] = time.perf_counter() - started
+
+    stats = {
+        'input_bytes': len(audio_bytes),
+        'output_bytes': len(processed),
+        'segments': segments[0] if segments else 1,
+        'cached': False,
+        'timings': timings,
+    }
+    if prep_stats:
+        stats['input_seconds'] = prep_stats['input_seconds']
+        stats['output_seconds'] = prep_stats['output_seconds']
+    if cache_key is not None:
+        cache.set(cache_key, {'text': text, 'stats': {k: v for k, v in stats.items() if k != 'timings'}})
+    return text, stats
@@ -0,0 +1,140 @@
+"""On-disk caches for results of expensive API calls.
+
+Each entry is a small JSON file named by the SHA-256 of its key, so lookups
+need no index and several processes can share a directory. Writes go through a
+temp file and ``os.replace``, so readers never see partial entries. Reads
+refresh the file's modification time, and once the directory grows past
+``max_bytes`` the least recently used entries are deleted. Entries older than
+an optional ``ttl_seconds`` count as misses. Hits and misses are counted per
+process for display.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+HASH_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def content_hash(data):
+    """SHA-256 hex digest of bytes or any buffer, hashed in blocks"""
+    view = memoryview(data).cast('B')
+    digest = hashlib.sha256()
+    for start in range(0, len(view), HASH_BLOCK_BYTES):
+        digest.update(view[start:start + HASH_BLOCK_BYTES])
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Size-bounded LRU cache of JSON values in a directory"""
+
+    def __init__(self, directory, max_bytes, ttl_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = self._scan_size()
+
+    @staticmethod
+    def make_key(**parts):
+        """Stable key for a set of named parts (strings, numbers, lists, dicts)"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _scan_size(self):
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    total += entry.stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def get(self, key):
+        """Return the cached value, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if not isinstance(entry, dict) or 'value' not in entry:
+                raise ValueError("not a cache entry")
+            if self.ttl_seconds is not None and time.time() - entry['created'] > self.ttl_seconds:
+                os.unlink(path)
+                raise ValueError("expired")
+            os.utime(path)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return entry['value']
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Hit/miss counters for this process and the approximate size on disk"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes': self._size}
+
+    def set(self, key, value):
+        """Store a value, evicting least recently used entries if over budget"""
+        path = self._path(key)
+        data = json.dumps({'created': time.time(), 'value': value}).encode('utf-8')
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            # An overwritten entry's bytes leave the cache
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete the oldest entries until the cache is back under 90% of budget"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    def clear(self):
+        """Delete every entry"""
+        with self._lock:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+            self._size = 0
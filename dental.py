@@ -0,0 +1,201 @@
+"""Dental chart data and its Streamlit rendering and analysis.
+
+Charts are built from the findings extracted from COHAT notes: a dict of
+Triadan tooth number to condition key, e.g. ``{"108": "calculus_moderate"}``.
+A chart is drawn as a single HTML fragment, memoized per species and
+findings, with the styles and legend built once at import. Appointments store
+charts in the compact coded form from ``dental_codes``.
+"""
+from functools import lru_cache
+
+import streamlit as st
+
+from dental_codes import DENTAL_CONDITIONS, teeth_layout_for, encode_chart, decode_findings
+
+
+def generate_dental_chart_data(species, findings_dict):
+    """Generate comprehensive dental chart data"""
+    return {
+        'teeth_layout': teeth_layout_for(species),
+        'conditions': DENTAL_CONDITIONS,
+        'findings': findings_dict,
+        'species': species
+    }
+
+
+def stored_dental_chart(chart_data):
+    """Compact form of chart data for saving with the appointment (see dental_codes)"""
+    return encode_chart(chart_data['species'], chart_data['findings'])
+
+
+def load_dental_chart(stored):
+    """Chart data rebuilt from an appointment's stored chart"""
+    return generate_dental_chart_data(stored.get('species', 'dog'), decode_findings(stored))
+
+
+# CSS for dental chart styling; the chart is one HTML fragment, so markup has
+# no indentation or blank lines that markdown would read as code
+CHART_CSS = (
+    "<style>"
+    ".tooth-normal { background-color: #e5e7eb; border: 2px solid #9ca3af; "
+    "width: 35px; height: 45px; margin: 2px; display: inline-block; "
+    "text-align: center; line-height: 45px; font-size: 10px; font-weight: bold; "
+    "border-radius: 8px 8px 4px 4px; position: relative; }"
+    ".tooth-finding { border: 3px solid #dc2626 !important; box-shadow: 0 0 8px rgba(220, 38, 38, 0.5); }"
+    ".tooth-label { font-size: 8px; color: #374151; }"
+    ".jaw-section { background: #f9fafb; padding: 15px; margin: 10px 0; border-radius: 8px; border: 1px solid #e5e7eb; }"
+    ".jaw-sides { display: flex; gap: 1rem; }"
+    ".jaw-sides > div { flex: 1; }"
+    ".chart-legend { display: grid; grid-template-columns: repeat(4, 1fr); gap: 0 1rem; }"
+    ".legend-item { display: flex; align-items: center; margin: 5px 0; }"
+    ".legend-swatch { width: 20px; height: 20px; border: 1px solid #ccc; margin-right: 8px; border-radius: 3px; }"
+    "</style>"
+)
+
+CHART_LEGEND_HTML = (
+    "<h3>Chart Legend</h3><div class=\"chart-legend\">"
+    + "".join(
+        f'<div class="legend-item"><div class="legend-swatch" style="background-color: {condition["color"]};"></div>'
+        f'<span style="font-size: 12px;">{condition["label"]}</span></div>'
+        for condition in DENTAL_CONDITIONS.values()
+    )
+    + "</div>"
+)
+
+
+def tooth_row_html(teeth, findings, reverse=False):
+    """HTML for a row of teeth"""
+    if reverse:
+        teeth = reversed(teeth)
+    parts = []
+    for tooth in teeth:
+        condition = findings.get(tooth, 'normal')
+        condition_data = DENTAL_CONDITIONS.get(condition, DENTAL_CONDITIONS['normal'])
+        finding_class = " tooth-finding" if condition != 'normal' else ""
+        parts.append(
+            f'<div class="tooth-normal{finding_class}" '
+            f'style="background-color: {condition_data["color"]}; color: {"white" if condition == "missing" else "black"};" '
+            f'title="Tooth {tooth}: {condition_data["label"]}">{tooth[-2:]}</div>'
+        )
+    return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def _chart_html(species, findings):
+    teeth_layout = teeth_layout_for(species)
+    findings = dict(findings)
+    jaws = []
+    for title, left, right in (("UPPER JAW (Maxilla)", 'upper_left', 'upper_right'),
+                               ("LOWER JAW (Mandible)", 'lower_left', 'lower_right')):
+        jaws.append(
+            f'<div class="jaw-section"><strong>{title}</strong><div class="jaw-sides">'
+            f'<div><em>Left Side</em><br>{tooth_row_html(teeth_layout[left], findings, reverse=True)}</div>'
+            f'<div><em>Right Side</em><br>{tooth_row_html(teeth_layout[right], findings)}</div>'
+            f'</div></div>'
+        )
+    return CHART_CSS + "".join(jaws) + CHART_LEGEND_HTML
+
+
+def dental_chart_html(species, findings):
+    """The whole chart (styles, both jaws and legend) as one HTML fragment
+    
+    Memoized on the species and findings, so reruns of an unchanged chart
+    reuse the markup.
+    """
+    return _chart_html(species.lower(), tuple(sorted((str(tooth), str(condition)) for tooth, condition in findings.items())))
+
+
+def render_dental_chart(chart_data):
+    """Render interactive dental chart in Streamlit"""
+    
+    st.markdown("### 🦷 AI-Generated Dental Chart")
+    
+    findings = chart_data['findings']
+    species = chart_data['species']
+    
+    # Chart header
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.markdown(f"**{species.title()} Dental Chart**")
+    with col2:
+        if st.button("📊 Generate Analysis", key="dental_analysis"):
+            analyze_dental_findings(findings, DENTAL_CONDITIONS)
+    
+    st.markdown(dental_chart_html(species, findings), unsafe_allow_html=True)
+
+
+def analyze_dental_findings(findings, conditions):
+    """Generate AI analysis of dental findings"""
+    if not findings:
+        st.info("No dental findings detected in the examination notes.")
+        return
+    
+    # Count findings by severity
+    severity_counts = {}
+    problem_teeth = []
+    
+    for tooth, condition in findings.items():
+        if condition != 'normal':
+            severity = conditions[condition]['priority']
+            severity_counts[severity] = severity_counts.get(severity, 0) + 1
+            problem_teeth.append(f"Tooth {tooth}: {conditions[condition]['label']}")
+    
+    # Generate summary
+    st.markdown("#### 🔍 Dental Analysis Summary")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric("Total Findings", len([f for f in findings.values() if f != 'normal']))
+    
+    with col2:
+        severe_conditions = len([f for f in findings.values() if conditions.get(f, {}).get('priority', 0) >= 3])
+        st.metric("Severe Conditions", severe_conditions)
+    
+    with col3:
+        total_teeth = len(findings)
+        affected_percentage = (len([f for f in findings.values() if f != 'normal']) / total_teeth * 100) if total_teeth > 0 else 0
+        st.metric("Affected Teeth %", f"{affected_percentage:.1f}%")
+    
+    # Detailed findings
+    if problem_teeth:
+        st.markdown("#### 📋 Detailed Findings")
+        for finding in problem_teeth:
+            st.markdown(f"• {finding}")
+        
+        # Recommendations
+        st.markdown("#### 💡 Recommendations")
+        generate_dental_recommendations(findings, conditions)
+
+
+def generate_dental_recommendations(findings, conditions):
+    """Generate treatment recommendations based on findings"""
+    recommendations = []
+    
+    # Count different types of conditions
+    gingivitis_count = len([f for f in findings.values() if 'gingivitis' in f])
+    calculus_count = len([f for f in findings.values() if 'calculus' in f])
+    pocket_count = len([f for f in findings.values() if 'pocket' in f])
+    fracture_count = len([f for f in findings.values() if f == 'fracture'])
+    extraction_count = len([f for f in findings.values() if f in ['extracted', 'missing']])
+    
+    if gingivitis_count > 0:
+        recommendations.append(f"🦷 **Gingivitis Management**: {gingivitis_count} teeth affected - Recommend professional cleaning and improved home care")
+    
+    if calculus_count > 0:
+        recommendations.append(f"🧽 **Calculus Removal**: {calculus_count} teeth with calculus buildup - Professional scaling required")
+    
+    if pocket_count > 0:
+        recommendations.append(f"📏 **Periodontal Therapy**: {pocket_count} teeth with deep pockets - May require root planing or surgical treatment")
+    
+    if fracture_count > 0:
+        recommendations.append(f"🔨 **Fracture Repair**: {fracture_count} fractured teeth - Evaluate for extraction or restoration")
+    
+    if extraction_count > 0:
+        recommendations.append(f"⚕️ **Post-Extraction Care**: {extraction_count} teeth extracted/missing - Monitor healing and pain management")
+    
+    if not recommendations:
+        recommendations.append("✅ **Good Oral Health**: No significant dental pathology detected - Continue current home care routine")
+    
+    for rec in recommendations:
+        st.markdown(rec)
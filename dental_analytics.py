@@ -0,0 +1,179 @@
+"""Clinic-wide dental analytics over every stored chart.
+
+Stored charts are loaded into one ``DentalMatrix`` per species: a
+(charts x teeth) uint8 array of condition codes in the current
+``dental_codes`` tables, with the patient's age in years alongside. Aggregate
+queries (prevalence heatmaps, severity distributions, age-band breakdowns)
+are then a few array operations over the whole practice history instead of
+a loop over findings dicts.
+
+Charts in the current coded form are decoded in bulk: their code strings are
+joined and mapped through a lookup table in one step. Charts saved under
+older table versions, or whole before encoding, go through
+``decode_findings`` one at a time. Findings outside the current tables
+(teeth not in the layout, unknown conditions) are left out of the matrix.
+"""
+import json
+import re
+from functools import cached_property, lru_cache
+
+import numpy as np
+
+from dental_codes import (CHART_TABLES, CHART_VERSION, CODE_ALPHABET, DENTAL_CONDITIONS, is_encoded, layout_key,
+                          decode_findings)
+
+CONDITIONS = CHART_TABLES[CHART_VERSION]['conditions']
+# Severity of each condition code, as the chart's priorities
+SEVERITY = np.array([DENTAL_CONDITIONS[condition]['priority'] for condition in CONDITIONS], dtype=np.uint8)
+
+# Conditions grouped for the per-species overview
+CONDITION_GROUPS = {
+    "Gingivitis": ('gingivitis_mild', 'gingivitis_moderate', 'gingivitis_severe'),
+    "Calculus": ('calculus_light', 'calculus_moderate', 'calculus_heavy'),
+    "Periodontal pockets": ('pocket_4mm', 'pocket_5mm', 'pocket_6mm'),
+    "Fracture": ('fracture',),
+    "Missing/extracted": ('missing', 'extracted'),
+    "Crown/restoration": ('crown',),
+}
+PERIODONTAL_CONDITIONS = CONDITION_GROUPS["Periodontal pockets"] + ('gingivitis_severe',)
+# Worst-severity levels a chart can have
+SEVERITY_LABELS = ("0 - All normal", "1 - Mild", "2 - Moderate", "3 - Severe", "4 - Pocket 6+ mm or fracture",
+                   "5 - Missing or extracted")
+
+# Lower bound of each age band, in years
+AGE_BAND_STARTS = (0, 1, 3, 7, 11)
+AGE_BAND_LABELS = ("Under 1", "1-3 years", "3-7 years", "7-11 years", "11+ years", "Unknown")
+
+# Code character -> code value, for bulk decoding
+_CODE_LOOKUP = np.zeros(256, dtype=np.uint8)
+for _value, _char in enumerate(CODE_ALPHABET):
+    _CODE_LOOKUP[ord(_char)] = _value
+
+_AGE_PART = re.compile(r'(\d+(?:\.\d+)?)\s*(y|mo|m|w|d)', re.IGNORECASE)
+_AGE_UNIT_YEARS = {'y': 1.0, 'mo': 1 / 12, 'm': 1 / 12, 'w': 7 / 365.25, 'd': 1 / 365.25}
+
+
+@lru_cache(maxsize=4096)
+def parse_age_years(age):
+    """Age in years from text like "7 years" or "2 years 6 months"; NaN if it cannot be read"""
+    parts = _AGE_PART.findall(str(age or ""))
+    if not parts:
+        return float('nan')
+    return sum(float(number) * _AGE_UNIT_YEARS[unit.lower()] for number, unit in parts)
+
+
+_CONDITION_CODES = {condition: code for code, condition in enumerate(CONDITIONS)}
+
+
+def _codes_of(teeth, findings):
+    """Code row of findings in the current tables; findings they cannot hold are dropped"""
+    positions = {tooth: position for position, tooth in enumerate(teeth)}
+    row = np.zeros(len(teeth), dtype=np.uint8)
+    for tooth, condition in findings.items():
+        position = positions.get(str(tooth))
+        code = _CONDITION_CODES.get(condition) if isinstance(condition, str) else None
+        if position is not None and code is not None:
+            row[position] = code
+    return row
+
+
+class DentalMatrix:
+    """Every chart of one species as a (charts x teeth) array of condition codes"""
+
+    def __init__(self, species, codes, ages):
+        self.species = species
+        self.teeth = CHART_TABLES[CHART_VERSION]['teeth'][layout_key(species)]
+        self.codes = codes
+        self.ages = ages
+
+    def __len__(self):
+        return len(self.codes)
+
+    @cached_property
+    def condition_counts(self):
+        """(charts x conditions) number of teeth with each condition, per chart"""
+        n_conditions = len(CONDITIONS)
+        cells = (np.arange(len(self), dtype=np.intp)[:, None] * n_conditions + self.codes).ravel()
+        return np.bincount(cells, minlength=len(self) * n_conditions).reshape(len(self), n_conditions)
+
+    def prevalence(self):
+        """(teeth x conditions) share of charts with each condition on each tooth"""
+        n_teeth, n_conditions = len(self.teeth), len(CONDITIONS)
+        cells = (np.arange(n_teeth, dtype=np.intp) * n_conditions + self.codes).ravel()
+        counts = np.bincount(cells, minlength=n_teeth * n_conditions).reshape(n_teeth, n_conditions)
+        return counts / max(len(self), 1)
+
+    def worst_severity(self):
+        """Most severe condition's severity per chart"""
+        return np.where(self.condition_counts > 0, SEVERITY, 0).max(axis=1, initial=0)
+
+    def severity_distribution(self):
+        """Number of charts by their worst severity, 0 (all normal) to the highest"""
+        return np.bincount(self.worst_severity(), minlength=int(SEVERITY.max()) + 1)
+
+    def has_any(self, conditions):
+        """Per chart, whether any tooth has one of the conditions"""
+        return self.condition_counts[:, [CONDITIONS.index(c) for c in conditions]].any(axis=1)
+
+    def group_prevalence(self):
+        """{group: share of charts with any condition of the group}"""
+        return {group: float(self.has_any(conditions).mean()) if len(self) else 0.0
+                for group, conditions in CONDITION_GROUPS.items()}
+
+    def age_bands(self):
+        """Per age band: charts, mean affected teeth, share with periodontal disease and mean worst severity"""
+        bands = np.digitize(self.ages, AGE_BAND_STARTS) - 1
+        bands[np.isnan(self.ages)] = len(AGE_BAND_STARTS)
+        n_bands = len(AGE_BAND_LABELS)
+        charts = np.bincount(bands, minlength=n_bands)
+        affected = np.bincount(bands, weights=len(self.teeth) - self.condition_counts[:, 0], minlength=n_bands)
+        periodontal = np.bincount(bands, weights=self.has_any(PERIODONTAL_CONDITIONS), minlength=n_bands)
+        severity = np.bincount(bands, weights=self.worst_severity(), minlength=n_bands)
+        return [
+            {
+                "age_band": label,
+                "charts": int(charts[band]),
+                "mean_affected_teeth": float(affected[band] / charts[band]),
+                "periodontal_share": float(periodontal[band] / charts[band]),
+                "mean_worst_severity": float(severity[band] / charts[band]),
+            }
+            for band, label in enumerate(AGE_BAND_LABELS) if charts[band]
+        ]
+
+
+def build_matrices(rows):
+    """{species: DentalMatrix} from (species, age, stored chart) rows
+
+    Stored charts may be dicts or, from some stores, their JSON text.
+    """
+    coded = {}
+    other = {}
+    for species, age, chart in rows:
+        if isinstance(chart, str):
+            chart = json.loads(chart)
+        if not isinstance(chart, dict):
+            continue
+        species = str(chart.get('species') or species or "Unknown").title()
+        if is_encoded(chart) and chart['v'] == CHART_VERSION:
+            # Its 'extra' findings are outside the tables, so only the codes count
+            group = coded.setdefault(species, ([], []))
+            group[0].append(chart['codes'])
+            group[1].append(parse_age_years(age))
+        else:
+            other.setdefault(species, []).append((chart, parse_age_years(age)))
+
+    matrices = {}
+    for species in sorted(set(coded) | set(other)):
+        teeth = CHART_TABLES[CHART_VERSION]['teeth'][layout_key(species)]
+        blocks, ages = [], []
+        if species in coded:
+            code_strings, coded_ages = coded[species]
+            block = _CODE_LOOKUP[np.frombuffer("".join(code_strings).encode('ascii'), dtype=np.uint8)]
+            blocks.append(block.reshape(len(code_strings), len(teeth)))
+            ages.extend(coded_ages)
+        if species in other:
+            blocks.append(np.array([_codes_of(teeth, decode_findings(chart)) for chart, _ in other[species]],
+                                   dtype=np.uint8).reshape(-1, len(teeth)))
+            ages.extend(age for _, age in other[species])
+        matrices[species] = DentalMatrix(species, np.concatenate(blocks), np.array(ages, dtype=float))
+    return matrices
@@ -0,0 +1,132 @@
+"""Compact stored form of dental charts.
+
+An appointment's chart used to be saved as the whole structure from
+``generate_dental_chart_data()``: the species' tooth layout and the condition
+color/label table, repeated in every dental appointment. It is now saved as
+one condition code per tooth of the species' layout, as a string:
+
+    {"v": 1, "species": "Dog", "codes": "00020000001000...", "extra": {...}}
+
+The tooth order and condition list that give the codes their meaning are the
+versioned tables in ``CHART_TABLES``, whose conditions come from
+``DENTAL_CONDITIONS``, the one table of chart conditions with their colors,
+labels and severity priorities. A published version is never changed;
+new teeth or conditions go in a new version, and charts saved under older
+versions still decode with their own tables. Findings the tables cannot hold
+(teeth outside the layout, unknown conditions) are kept as they are in
+``extra``, so decoding gives back the findings that were encoded; only teeth
+explicitly marked normal, the default, are left out.
+"""
+import string
+
+# Triadan numbers by quadrant, for each species' dental formula
+CANINE_TEETH = {
+    'upper_right': ['101', '102', '103', '104', '105', '106', '107', '108', '109', '110'],
+    'upper_left': ['201', '202', '203', '204', '205', '206', '207', '208', '209', '210', '211'],
+    'lower_right': ['401', '402', '403', '404', '405', '406', '407', '408', '409', '410', '411'],
+    'lower_left': ['301', '302', '303', '304', '305', '306', '307', '308', '309', '310']
+}
+
+FELINE_TEETH = {
+    'upper_right': ['101', '102', '103', '104', '105', '106', '107', '108', '109'],
+    'upper_left': ['201', '202', '203', '204', '205', '206', '207', '208', '209'],
+    'lower_right': ['401', '402', '403', '404', '405', '406', '407'],
+    'lower_left': ['301', '302', '303', '304', '305', '306', '307']
+}
+
+QUADRANTS = ('upper_right', 'upper_left', 'lower_right', 'lower_left')
+
+# Chart conditions, in code order, with their colors, labels and severity (most
+# severe highest). New conditions go at the end, in a new chart version.
+DENTAL_CONDITIONS = {
+    'normal': {'color': '#e5e7eb', 'label': 'Normal', 'priority': 0},
+    'gingivitis_mild': {'color': '#fbbf24', 'label': 'Mild Gingivitis', 'priority': 1},
+    'gingivitis_moderate': {'color': '#f97316', 'label': 'Moderate Gingivitis', 'priority': 2},
+    'gingivitis_severe': {'color': '#dc2626', 'label': 'Severe Gingivitis', 'priority': 3},
+    'calculus_light': {'color': '#d1d5db', 'label': 'Light Calculus', 'priority': 1},
+    'calculus_moderate': {'color': '#9ca3af', 'label': 'Moderate Calculus', 'priority': 2},
+    'calculus_heavy': {'color': '#4b5563', 'label': 'Heavy Calculus', 'priority': 3},
+    'pocket_4mm': {'color': '#3b82f6', 'label': '4mm Pocket', 'priority': 2},
+    'pocket_5mm': {'color': '#1d4ed8', 'label': '5mm Pocket', 'priority': 3},
+    'pocket_6mm': {'color': '#1e40af', 'label': '6+ mm Pocket', 'priority': 4},
+    'fracture': {'color': '#7c2d12', 'label': 'Fracture', 'priority': 4},
+    'missing': {'color': '#000000', 'label': 'Missing', 'priority': 5},
+    'extracted': {'color': '#ef4444', 'label': 'Extracted Today', 'priority': 5},
+    'crown': {'color': '#ffd700', 'label': 'Crown/Restoration', 'priority': 1}
+}
+
+# One character per code
+CODE_ALPHABET = string.digits + string.ascii_lowercase
+
+CHART_TABLES = {
+    1: {
+        'teeth': {
+            'dog': tuple(tooth for quadrant in QUADRANTS for tooth in CANINE_TEETH[quadrant]),
+            'cat': tuple(tooth for quadrant in QUADRANTS for tooth in FELINE_TEETH[quadrant]),
+        },
+        # The 14 conditions there were when version 1 was published
+        'conditions': tuple(DENTAL_CONDITIONS)[:14],
+    },
+}
+CHART_VERSION = max(CHART_TABLES)
+
+# (version, layout) -> {tooth: position}, and version -> {condition: code}
+_TOOTH_POSITIONS = {
+    (version, layout): {tooth: position for position, tooth in enumerate(teeth)}
+    for version, tables in CHART_TABLES.items()
+    for layout, teeth in tables['teeth'].items()
+}
+_CODE_VALUES = {code: value for value, code in enumerate(CODE_ALPHABET)}
+_CONDITION_CODES = {
+    version: {condition: CODE_ALPHABET[code] for code, condition in enumerate(tables['conditions'])}
+    for version, tables in CHART_TABLES.items()
+}
+
+
+def layout_key(species):
+    """Layout a species is charted on: dogs on the canine formula, others on the feline one"""
+    return 'dog' if str(species).lower() == 'dog' else 'cat'
+
+
+def teeth_layout_for(species):
+    return CANINE_TEETH if layout_key(species) == 'dog' else FELINE_TEETH
+
+
+def encode_chart(species, findings, version=CHART_VERSION):
+    """Stored form of a chart's findings"""
+    layout = layout_key(species)
+    positions = _TOOTH_POSITIONS[(version, layout)]
+    condition_codes = _CONDITION_CODES[version]
+    codes = [CODE_ALPHABET[0]] * len(positions)
+    extra = {}
+    for tooth, condition in findings.items():
+        position = positions.get(str(tooth))
+        code = condition_codes.get(condition) if isinstance(condition, str) else None
+        if position is None or code is None:
+            extra[str(tooth)] = condition
+        else:
+            codes[position] = code
+    stored = {'v': version, 'species': species, 'codes': "".join(codes)}
+    if extra:
+        stored['extra'] = extra
+    return stored
+
+
+def is_encoded(stored):
+    return isinstance(stored, dict) and 'codes' in stored
+
+
+def decode_findings(stored):
+    """Findings dict of a stored chart; charts saved whole before encoding are read as they are"""
+    if not is_encoded(stored):
+        return dict(stored.get('findings') or {})
+    tables = CHART_TABLES[stored['v']]
+    teeth = tables['teeth'][layout_key(stored['species'])]
+    conditions = tables['conditions']
+    findings = {
+        tooth: conditions[_CODE_VALUES[code]]
+        for tooth, code in zip(teeth, stored['codes'])
+        if code != CODE_ALPHABET[0]
+    }
+    findings.update(stored.get('extra') or {})
+    return findings
@@ -0,0 +1,161 @@
+"""Rule-based extraction of dental findings from COHAT notes.
+
+Most dictated COHAT notes already name teeth by Triadan number and use the
+chart's condition vocabulary ("moderate calculus on 108 and 208, 6mm pocket
+on 409, 409 extracted"). ``extract_findings`` reads those with precompiled
+patterns, without a model call, and returns the findings together with a
+coverage score: the share of tooth numbers and condition mentions it could
+pair up. Callers fall back to the AI extractor when coverage is below
+``RULE_COVERAGE_THRESHOLD``.
+
+Within a sentence, each tooth gets the closest condition mentioned before it
+or, failing that, the first one after it. Clauses separated by commas or
+semicolons are read in turn; a clause listing teeth without a condition
+("on 104, 204") continues the previous clause's condition. Negated mentions
+("no fractures") are ignored. When a tooth has several findings, the most
+severe is kept, as the chart shows one condition per tooth.
+
+Findings the chart has no condition for ("resorption", "grade 2 mobility",
+an unknown key like ``pocket_8mm``) count as unpaired mentions, and a clause
+with one does not continue the previous clause's condition, so such notes go
+to the model. Text with no teeth or conditions at all has coverage 0.
+"""
+import re
+from collections import namedtuple
+
+from dental_codes import DENTAL_CONDITIONS
+
+RULE_COVERAGE_THRESHOLD = 0.8
+
+# Condition -> rank, most severe highest: the chart's priorities
+CONDITION_RANK = {condition: info['priority'] for condition, info in DENTAL_CONDITIONS.items()}
+
+_SEVERITY_LEVELS = {
+    'mild': 0, 'slight': 0, 'light': 0, 'minimal': 0,
+    'moderate': 1,
+    'severe': 2, 'heavy': 2, 'marked': 2,
+}
+# Graded conditions by severity level; unqualified mentions take the mildest
+_GRADED = {
+    'calculus': ('calculus_light', 'calculus_moderate', 'calculus_heavy'),
+    'gingivitis': ('gingivitis_mild', 'gingivitis_moderate', 'gingivitis_severe'),
+}
+
+_SEVERITY = r'(?:mild|slight|light|minimal|moderate|severe|heavy|marked)'
+
+# Condition keys written as they are ("108 calculus_moderate")
+_KEYS = "|".join(sorted((key for key in CONDITION_RANK if '_' in key), key=len, reverse=True))
+
+_CONDITION = re.compile(
+    rf"""
+    (?<!_)(?:
+      \b(?P<key>{_KEYS})\b
+    | (?:(?P<calculus_before>{_SEVERITY})\s+(?:dental\s+)?)?(?P<calculus>calculus|tartar)
+        (?:\s*:?\s*(?P<calculus_after>{_SEVERITY})\b)?
+    | (?:(?P<gingivitis_before>{_SEVERITY})\s+)?(?P<gingivitis>gingivitis|gingival\s+inflammation)
+        (?:\s*:?\s*(?P<gingivitis_after>{_SEVERITY})\b)?
+    | (?P<pocket_before>\d+(?:\.\d+)?)\s*mm\s+(?:periodontal\s+)?pocket(?:s|ing)?
+    | (?:pocket(?:s|ing)?|probing)(?:\s+depths?)?(?:\s+of)?\s*(?P<pocket_after>\d+(?:\.\d+)?)\s*mm
+    | (?P<fracture>fractur(?:e|ed|es)|broken)
+    | (?P<extracted>extract(?:ed|ion|ions)|removed)
+    | (?P<missing>missing|absent)
+    | (?P<crown>restor(?:ation|ations|ed)|crown(?:ed|\s+(?:placed|restoration|therapy)))
+    )(?!_)
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+# Permanent teeth 101-111 to 401-411, not part of a longer number or a measurement
+_TOOTH = re.compile(
+    r'(?<!\d)(?<!\d\.)([1-4](?:0[1-9]|1[01]))(?!\d|\.\d)(?!\s*(?:°|%|mm\b|kg\b|mg\b|g\b|ml\b|lbs?\b|bpm\b|f\b|c\b))',
+    re.IGNORECASE,
+)
+# Findings the chart cannot show, and unknown condition keys
+_UNCHARTED = re.compile(
+    r'\b(?:[a-z]+_[a-z0-9_]+|resorpti\w*|mobil(?:e|ity)|abscess\w*|furcation|recession|hyperplasi\w*|'
+    r'hypoplasi\w*|stomatitis|ulcer\w*|caries|carious|lesions?|discolou?r\w*|retained|persistent|'
+    r'malocclusion|(?:pulp\s+)?exposure)\b',
+    re.IGNORECASE,
+)
+_NEGATION = re.compile(r'\b(?:no|not|without|negative\s+for)\b[^.,;]{0,20}$', re.IGNORECASE)
+_SENTENCE = re.compile(r'(?<=[.!?])\s+|\n+')
+_CLAUSE = re.compile(r'[,;]|\bwhile\b|\bwhereas\b', re.IGNORECASE)
+
+RuleExtraction = namedtuple("RuleExtraction", "findings coverage teeth conditions")
+RuleExtraction.__doc__ = """Findings by tooth, the share of mentions paired up, and how many teeth and conditions were mentioned"""
+
+
+def _condition(match):
+    """Chart condition key of a condition match; pockets under 4 mm are normal"""
+    if match.group('key'):
+        return match.group('key').lower()
+    for name, levels in _GRADED.items():
+        if match.group(name):
+            severity = match.group(f"{name}_before") or match.group(f"{name}_after")
+            return levels[_SEVERITY_LEVELS[severity.lower()] if severity else 0]
+    depth = match.group('pocket_before') or match.group('pocket_after')
+    if depth:
+        depth = float(depth)
+        if depth < 4:
+            return 'normal'
+        return 'pocket_4mm' if depth < 5 else 'pocket_5mm' if depth < 6 else 'pocket_6mm'
+    for name in ('fracture', 'extracted', 'missing'):
+        if match.group(name):
+            return name
+    return 'crown'
+
+
+def extract_findings(text):
+    """Dental findings in text by rule, as a RuleExtraction"""
+    findings = {}
+    teeth_seen = set()
+    teeth_paired = set()
+    # [position, condition, paired with a tooth] per condition mentioned
+    all_mentions = []
+    unpaired_uncharted = 0
+
+    for sentence in _SENTENCE.split(text or ""):
+        previous = None
+        for clause in _CLAUSE.split(sentence):
+            mentions = []
+            spans = []
+            for match in _CONDITION.finditer(clause):
+                spans.append(match.span())
+                if _NEGATION.search(clause, 0, match.start()):
+                    continue
+                mentions.append([match.start(), _condition(match), False])
+            all_mentions.extend(mentions)
+
+            uncharted = 0
+            for match in _UNCHARTED.finditer(clause):
+                if any(start <= match.start() < end for start, end in spans):
+                    continue
+                if not _NEGATION.search(clause, 0, match.start()):
+                    uncharted += 1
+            if uncharted:
+                # This clause's teeth may belong to the finding we cannot read
+                previous = None
+                unpaired_uncharted += uncharted
+
+            for tooth in _TOOTH.finditer(clause):
+                teeth_seen.add(tooth.group(1))
+                before = [m for m in mentions if m[0] < tooth.start()]
+                after = [m for m in mentions if m[0] > tooth.start()]
+                mention = before[-1] if before else after[0] if after else previous
+                if mention is None:
+                    continue
+                mention[2] = True
+                teeth_paired.add(tooth.group(1))
+                if mention[1] == 'normal':
+                    continue
+                current = findings.get(tooth.group(1))
+                if current is None or CONDITION_RANK[mention[1]] > CONDITION_RANK[current]:
+                    findings[tooth.group(1)] = mention[1]
+
+            if mentions:
+                previous = mentions[-1]
+
+    units = len(teeth_seen) + len(all_mentions) + unpaired_uncharted
+    paired = len(teeth_paired) + sum(1 for m in all_mentions if m[2])
+    coverage = paired / units if units else 0.0
+    return RuleExtraction(findings, coverage, len(teeth_seen), len(all_mentions))
@@ -0,0 +1,496 @@
+"""Document generation: chat requests, and running them cached, metered and routed.
+
+The SOAP note, client summary and client email templates and requests live
+here, with the map-reduce condensing of notes too long for one request. A
+``Generator`` runs them against what every call needs - the AI provider, the
+response cache, the model routes and the usage ledger - so the app and the
+pipeline benchmark go through the same code.
+"""
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from ledger import AdmissionDeferred, DOWNGRADE, DEFER, PRIORITY_NORMAL
+from routing import TASKS, cheapest_model
+from tokens import fits_context, count_tokens, request_tokens, context_tokens, split_sections, CONTEXT_MARGIN_TOKENS
+from tracing import span
+
+# Medical Transcription SOAP Note Template
+SOAP_TEMPLATE = """
+You are a medical transcription assistant. Organize the provided veterinary appointment notes into SOAP format.
+
+CRITICAL INSTRUCTIONS:
+- ONLY use information explicitly mentioned in the notes below
+- DO NOT add medical knowledge, normal ranges, or assumptions
+- DO NOT infer anything not directly stated
+- If a SOAP section has no information, write "Not documented"
+- Better to have incomplete sections than fabricated information
+
+SUBJECTIVE: Only client-reported symptoms, concerns, and history mentioned in notes
+OBJECTIVE: Only examination findings, vitals, and observations explicitly stated
+ASSESSMENT: Only diagnoses or clinical impressions actually mentioned
+PLAN: Only treatments, medications, and recommendations specifically given
+
+Appointment Notes:
+{input_text}
+
+Create a factual SOAP note using only the above information:
+"""
+
+# Enhanced Client Summary Template
+CLIENT_SUMMARY_TEMPLATE = """
+You are Dr. VetScribe, a compassionate veterinarian who excels at explaining medical information to pet owners in a clear, caring way.
+
+Based on the appointment information below, create a client-friendly summary that a pet owner can easily understand. Your goal is to:
+
+- Explain what happened during the visit in simple terms
+- Clearly describe any findings or concerns
+- Explain the treatment plan and why it's important
+- Provide clear home care instructions
+- Give realistic expectations and follow-up plans
+- Be reassuring when appropriate, but honest about concerns
+- Use everyday language while being medically accurate
+
+Remember: Pet owners are often worried about their beloved companions. Be empathetic, thorough, and clear. Avoid excessive medical jargon but don't talk down to them.
+
+Appointment Information: {input_text}
+
+Create a caring, clear summary for the pet owner:
+"""
+
+# Notes too long for the model context are split into overlapping sections,
+# each condensed into SOAP fragments in parallel, then merged in a final pass
+SOAP_SECTION_TEMPLATE = """
+You are a medical transcription assistant. The notes below are section {index} of {total} of one long veterinary appointment; neighbouring sections overlap slightly.
+
+Extract the facts in this section as SOAP fragments.
+
+CRITICAL INSTRUCTIONS:
+- ONLY use information explicitly mentioned in this section
+- DO NOT add medical knowledge, normal ranges, or assumptions
+- DO NOT infer anything not directly stated
+- Leave out any SOAP heading this section has no information for
+
+Appointment Notes (section {index} of {total}):
+{input_text}
+
+SOAP fragments from this section:
+"""
+
+SOAP_MERGE_TEMPLATE = """
+You are a medical transcription assistant. The SOAP fragments below were extracted, in order, from consecutive overlapping sections of one long veterinary appointment. Merge them into a single SOAP note.
+
+CRITICAL INSTRUCTIONS:
+- ONLY use information present in the fragments below
+- DO NOT add medical knowledge, normal ranges, or assumptions
+- DO NOT infer anything not directly stated
+- State each fact once - the sections overlap, so some facts appear twice
+- If a SOAP section has no information, write "Not documented"
+
+SUBJECTIVE: Only client-reported symptoms, concerns, and history mentioned
+OBJECTIVE: Only examination findings, vitals, and observations explicitly stated
+ASSESSMENT: Only diagnoses or clinical impressions actually mentioned
+PLAN: Only treatments, medications, and recommendations specifically given
+
+SOAP Fragments:
+{input_text}
+
+Create a factual SOAP note using only the above information:
+"""
+
+TRANSCRIPTION_SYSTEM_PROMPT = "You are a medical transcription assistant. You organize veterinary notes but NEVER add information not present in the input. If information is missing, state 'Not documented' rather than inferring details."
+
+SECTION_MAX_TOKENS = 2500
+SECTION_OVERLAP_TOKENS = 200
+SECTION_RESPONSE_TOKENS = 800
+SECTION_WORKERS = 4
+
+# Single-request template producing all three documents as JSON
+COMBINED_TEMPLATE = """
+You are a medical transcription assistant for a veterinary practice. From the appointment notes below, write three documents and return them as one JSON object with exactly these string fields:
+
+"soap_note": A SOAP note (SUBJECTIVE, OBJECTIVE, ASSESSMENT, PLAN). ONLY use information explicitly mentioned in the notes. DO NOT add medical knowledge, normal ranges, or assumptions. If a section has no information, write "Not documented".
+"client_summary": A caring, clear summary for the pet owner in everyday language - what happened during the visit, the findings, the treatment plan and why it matters, home care instructions and follow-up - using only what the notes state.
+"client_email": A warm, professional follow-up email to the client about the visit. ONLY include information explicitly mentioned in the notes. If specific treatments weren't mentioned, write "as discussed during the visit".
+
+Return only the JSON object, with no text before or after it.
+
+Appointment Notes:
+{input_text}
+"""
+
+COMBINED_FIELDS = ("soap_note", "client_summary", "client_email")
+
+
+def transcription_request(content, max_tokens=1200, model="gpt-4"):
+    """Chat request for the transcription assistant"""
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system", 
+                "content": TRANSCRIPTION_SYSTEM_PROMPT
+            },
+            {
+                "role": "user", 
+                "content": content
+            }
+        ],
+        max_tokens=max_tokens,  # Reduced to prevent elaborate responses
+        temperature=0.0,  # Zero creativity - purely factual
+    )
+
+
+def input_budget(template, max_tokens, model="gpt-4"):
+    """Tokens left for {input_text} in a transcription request from template"""
+    empty = transcription_request(template.format(input_text="", index=1, total=1), max_tokens, model)
+    return context_tokens(model) - request_tokens(empty) - max_tokens - CONTEXT_MARGIN_TOKENS
+
+
+def parse_combined_documents(text):
+    """Validate a combined generation response; returns the documents dict or None"""
+    if not text:
+        return None
+    # Tolerate a markdown code fence or a sentence around the object
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        documents = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(documents, dict):
+        return None
+    if not all(isinstance(documents.get(field), str) and documents[field].strip() for field in COMBINED_FIELDS):
+        return None
+    return {field: documents[field].strip() for field in COMBINED_FIELDS}
+
+
+def combined_request(prompt, model="gpt-4"):
+    """Chat request for the SOAP note, client summary and client email together"""
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a medical transcription assistant. You organize veterinary notes but NEVER add information not present in the input. You always answer with a single valid JSON object."
+            },
+            {
+                "role": "user",
+                "content": COMBINED_TEMPLATE.format(input_text=prompt)
+            }
+        ],
+        max_tokens=3000,  # Room for all three documents
+        temperature=0.0,
+    )
+
+
+def client_email_request(appointment_data, model="gpt-4"):
+    """Chat request for a client email about an appointment"""
+    email_prompt = f"""
+    Create a professional email to {appointment_data['client_name']} about {appointment_data['patient_name']}'s veterinary visit.
+    
+    CRITICAL RULES:
+    - ONLY include information explicitly mentioned in the appointment notes
+    - DO NOT add treatments, medications, or recommendations not stated
+    - DO NOT infer medical advice beyond what was discussed
+    - If specific treatments weren't mentioned, write "as discussed during the visit"
+    - Be warm and professional but stick strictly to documented facts
+    
+    Patient: {appointment_data['patient_name']} ({appointment_data['species']})
+    Original Notes: {appointment_data['original_notes']}
+    
+    Create an email using ONLY the information from the notes above.
+    """
+    
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are writing a follow-up email for a veterinarian. Use ONLY information explicitly stated in the appointment notes. Never add medical recommendations not mentioned in the original notes."
+            },
+            {
+                "role": "user", 
+                "content": email_prompt
+            }
+        ],
+        temperature=0.1  # Lower temperature for more factual responses
+    )
+
+
+class Generator:
+    """Generates documents through a provider, with response caching, model routing and usage metering
+
+    ``routes`` is the task -> models mapping from routing.load_routes(); it is
+    read on every call, so updating it in place reroutes later calls.
+    Clinic budgets in ``ledger`` are checked and its usage recorded under
+    ``clinic``.
+    """
+
+    def __init__(self, provider, response_cache, routes, ledger, clinic):
+        self.provider = provider
+        self.response_cache = response_cache
+        self.routes = routes
+        self.ledger = ledger
+        self.clinic = clinic
+        # Notes being condensed, so concurrent SOAP and summary requests share the work
+        self._condensing = {}
+        self._condensing_lock = threading.Lock()
+
+    def record_usage(self, task, model, seconds, prompt_tokens=0, completion_tokens=0, audio_seconds=0.0, error=False):
+        """Add one AI call of this clinic to the usage ledger"""
+        try:
+            self.ledger.record(self.clinic, task, model, prompt_tokens, completion_tokens, audio_seconds,
+                               latency_ms=seconds * 1000, error=error)
+        except Exception as e:
+            # Metering must never fail the call it measures
+            print(f"⚠️ Could not record usage: {str(e)}")
+
+    def metered_chat(self, task, request):
+        """Send one non-streamed chat request, recording its usage"""
+        started = time.perf_counter()
+        try:
+            response = self.provider.chat(**request)
+        except Exception:
+            self.record_usage(task, request['model'], time.perf_counter() - started, error=True)
+            raise
+        usage = getattr(response, 'usage', None)
+        self.record_usage(task, request['model'], time.perf_counter() - started,
+                          getattr(usage, 'prompt_tokens', 0) or 0, getattr(usage, 'completion_tokens', 0) or 0)
+        return response
+
+    def complete_chat(self, request, on_token=None, use_cache=True, task="chat"):
+        """Run a chat completion request and return its text
+        
+        With on_token the response is streamed, and on_token(text_so_far) is
+        called as tokens arrive. Identical requests (model, prompts and
+        parameters) are answered from the response cache; use_cache=False skips
+        the lookup but still stores the fresh response. Calls that reach the
+        provider are recorded in the usage ledger under task.
+        """
+        cache_key = self.response_cache.make_key(request=request)
+        if use_cache:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                if on_token is not None:
+                    on_token(cached)
+                return cached
+        
+        if on_token is None:
+            response = self.metered_chat(task, request)
+            text = response.choices[0].message.content
+        else:
+            started = time.perf_counter()
+            parts = []
+            usage = None
+            try:
+                for chunk in self.provider.chat_stream(stream_options={"include_usage": True}, **request):
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        on_token("".join(parts))
+            except Exception:
+                self.record_usage(task, request['model'], time.perf_counter() - started, error=True)
+                raise
+            text = "".join(parts)
+            if usage is not None:
+                prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+            else:
+                # Providers that do not report usage on streams are estimated
+                prompt_tokens, completion_tokens = request_tokens(request), count_tokens(text, request['model'])
+            self.record_usage(task, request['model'], time.perf_counter() - started, prompt_tokens, completion_tokens)
+        
+        self.response_cache.set(cache_key, text)
+        return text
+
+    def complete_routed(self, task, build_request, on_token=None, use_cache=True, priority=PRIORITY_NORMAL):
+        """Run a task on the models routed to it, falling back down the route on failure
+        
+        build_request(model) makes the request for one model; the rest is as
+        complete_chat. The last model's error is raised.
+        
+        Low-priority work is subject to the clinic's budgets: near one it runs on
+        the cheapest model only, and once one is almost used up AdmissionDeferred
+        is raised instead of sending anything.
+        """
+        models = self.routes[task]
+        admission = self.ledger.admission(self.clinic, priority)
+        if admission.action == DEFER:
+            when = "in about a minute" if admission.retry_after else "tomorrow"
+            raise AdmissionDeferred(f"Deferred to stay within budget - {admission.reason}; try again {when}",
+                                    admission.retry_after)
+        if admission.action == DOWNGRADE:
+            print(f"⚠️ {TASKS[task]} downgraded to {cheapest_model()}: {admission.reason}")
+            models = [cheapest_model()]
+        for attempt, model in enumerate(models):
+            try:
+                return self.complete_chat(build_request(model), on_token, use_cache, task=task)
+            except Exception as e:
+                if attempt + 1 == len(models):
+                    raise
+                print(f"⚠️ {TASKS[task]} failed on {model}, falling back to {models[attempt + 1]}: {str(e)}")
+
+    def condense_notes(self, prompt, model="gpt-4", final_template=SOAP_MERGE_TEMPLATE):
+        """Condense notes too long for the context into SOAP fragments
+        
+        The notes are split into overlapping sections, each summarized into SOAP
+        fragments concurrently. While the fragments together are still too long
+        for the final request, made with ``final_template``, consecutive groups
+        of them are merged, again concurrently. Concurrent calls for the same
+        notes and final template wait for the first one instead of repeating it.
+        """
+        key = (prompt, model, final_template)
+        with self._condensing_lock:
+            future = self._condensing.get(key)
+            owner = future is None
+            if owner:
+                future = self._condensing[key] = Future()
+        if owner:
+            try:
+                future.set_result(self._condense_notes(prompt, model, final_template))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._condensing_lock:
+                    del self._condensing[key]
+        return future.result()
+
+    def _condense_notes(self, prompt, model, final_template):
+        max_tokens = input_budget(final_template, 1200, model)
+        section_budget = min(SECTION_MAX_TOKENS, input_budget(SOAP_SECTION_TEMPLATE, SECTION_RESPONSE_TOKENS, model))
+        sections = split_sections(prompt, section_budget, SECTION_OVERLAP_TOKENS, model)
+        with ThreadPoolExecutor(max_workers=SECTION_WORKERS) as pool:
+            fragments = list(pool.map(
+                lambda item: self.complete_chat(transcription_request(
+                    SOAP_SECTION_TEMPLATE.format(input_text=item[1], index=item[0], total=len(sections)),
+                    SECTION_RESPONSE_TOKENS, model
+                ), task="condense"),
+                enumerate(sections, start=1)
+            ))
+            
+            merge_budget = input_budget(SOAP_MERGE_TEMPLATE, SECTION_RESPONSE_TOKENS, model)
+            while len(fragments) > 1 and count_tokens("\n\n".join(fragments), model) > max_tokens:
+                # Group consecutive fragments that fit one merge request
+                groups, current, size = [], [], 0
+                for fragment in fragments:
+                    fragment_tokens = count_tokens(fragment, model) + 2
+                    if current and size + fragment_tokens > merge_budget:
+                        groups.append(current)
+                        current, size = [], 0
+                    current.append(fragment)
+                    size += fragment_tokens
+                groups.append(current)
+                if len(groups) == len(fragments):
+                    raise ValueError("SOAP fragments are too long to merge")
+                fragments = list(pool.map(
+                    lambda group: self.complete_chat(transcription_request(
+                        SOAP_MERGE_TEMPLATE.format(input_text="\n\n".join(group)), SECTION_RESPONSE_TOKENS, model
+                    ), task="condense") if len(group) > 1 else group[0],
+                    groups
+                ))
+        return "\n\n".join(fragments)
+
+    def generate_ai_response(self, prompt, template_type="soap", on_token=None):
+        """Generate AI response using OpenAI GPT with medical transcription focus
+        
+        Pass on_token to stream the response (see complete_chat). Notes too
+        long for the model context are first condensed section by section (see
+        condense_notes); the SOAP note is then the merge of the fragments and
+        the client summary is written from them.
+        """
+        template = SOAP_TEMPLATE if template_type == "soap" else CLIENT_SUMMARY_TEMPLATE
+        
+        def build_request(model):
+            request = transcription_request(template.format(input_text=prompt), model=model)
+            if fits_context(request):
+                return request
+            merge_template = SOAP_MERGE_TEMPLATE if template_type == "soap" else template
+            fragments = self.condense_notes(prompt, model, merge_template)
+            return transcription_request(merge_template.format(input_text=fragments), model=model)
+        
+        try:
+            return self.complete_routed(template_type, build_request, on_token)
+        except Exception as e:
+            return f"Error generating response: {str(e)}"
+
+    def generate_ai_responses(self, prompt, template_types, placeholders=None, spans=None):
+        """Generate several documents from the same notes concurrently
+        
+        Returns the responses in the order of template_types; failures come back
+        as error strings exactly as from generate_ai_response. With placeholders
+        (one st.empty() per template) the responses are streamed into them as
+        tokens arrive. A "generate_<template>" span per document is appended to
+        spans.
+        """
+        updates = queue.Queue()
+        spans = [] if spans is None else spans
+        
+        def generate(index, template_type):
+            # Workers cannot touch Streamlit elements - hand text to the script thread
+            on_token = (lambda text: updates.put((index, text))) if placeholders else None
+            with span(f"generate_{template_type}", spans) as record:
+                text = self.generate_ai_response(prompt, template_type, on_token=on_token)
+                if text.startswith("Error"):
+                    record["error"] = True
+            return text
+        
+        with ThreadPoolExecutor(max_workers=len(template_types)) as pool:
+            futures = [pool.submit(generate, i, template_type) for i, template_type in enumerate(template_types)]
+            while placeholders:
+                try:
+                    latest = dict([updates.get(timeout=0.05)])
+                except queue.Empty:
+                    if all(future.done() for future in futures) and updates.empty():
+                        break
+                    continue
+                # Only the newest text of each document is worth drawing
+                while not updates.empty():
+                    index, text = updates.get_nowait()
+                    latest[index] = text
+                for index, text in latest.items():
+                    placeholders[index].markdown(text + " ▌")
+            return [future.result() for future in futures]
+
+    def generate_combined_documents(self, prompt):
+        """Generate the SOAP note, client summary and client email in one request
+        
+        The notes are sent once instead of three times. Returns a dict with the
+        COMBINED_FIELDS, or None if the request failed, the notes are too long
+        for one request or the response was not valid, in which case callers
+        fall back to per-document generation.
+        """
+        def build_request(model):
+            request = combined_request(prompt, model)
+            if not fits_context(request):
+                # Long notes go through the per-document map-reduce path instead
+                raise ValueError(f"notes too long for a combined request on {model}")
+            return request
+        
+        try:
+            text = self.complete_routed("combined", build_request)
+        except Exception as e:
+            print(f"⚠️ Combined generation failed: {str(e)}")
+            return None
+        return parse_combined_documents(text)
+
+    def generate_client_email(self, appointment_data, on_token=None, use_cache=True, priority=PRIORITY_NORMAL):
+        """Generate professional client email from appointment data
+        
+        Pass on_token to stream the email and use_cache=False to force a new
+        draft (see complete_chat). Regenerating a draft is low priority, so it
+        may be downgraded or deferred near the clinic's budget (see
+        complete_routed); AdmissionDeferred is raised for the caller to report.
+        """
+        try:
+            return self.complete_routed(
+                "client_email", lambda model: client_email_request(appointment_data, model),
+                on_token, use_cache=use_cache, priority=priority
+            )
+        except AdmissionDeferred:
+            raise
+        except Exception as e:
+            return f"Error generating email: {str(e)}"
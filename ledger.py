@@ -0,0 +1,188 @@
+"""Usage ledger of AI calls, per-clinic budgets and admission control.
+
+Every chat and transcription call is recorded with its clinic, task, model,
+tokens in and out, audio seconds and latency. The ledger keeps per-minute
+totals rather than one row per call, in a small SQLite database shared by
+every process, and drops buckets older than ``retention_days``.
+
+Each clinic may have budgets for tokens per minute, tokens per day and audio
+minutes per day. ``UsageLedger.admission`` decides whether low-priority work,
+such as regenerating a client email, may run now. When any budget window is
+``DOWNGRADE_AT`` used, low-priority work moves to a cheaper model; at
+``DEFER_AT`` it is deferred. Clinical notes and transcription are never held
+back.
+"""
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+USAGE_RETENTION_DAYS = 31
+DOWNGRADE_AT = 0.8
+DEFER_AT = 0.95
+
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+ADMIT = "admit"
+DOWNGRADE = "downgrade"
+DEFER = "defer"
+
+Budget = namedtuple("Budget", "tokens_per_minute tokens_per_day audio_minutes_per_day")
+Budget.__new__.__defaults__ = (0, 0, 0)
+Budget.__doc__ = "A clinic's limits; 0 means unlimited"
+
+Admission = namedtuple("Admission", "action reason retry_after")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    minute INTEGER NOT NULL,
+    clinic TEXT NOT NULL,
+    task TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    audio_seconds REAL NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (minute, clinic, task, model)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS budgets (
+    clinic TEXT PRIMARY KEY,
+    tokens_per_minute INTEGER NOT NULL DEFAULT 0,
+    tokens_per_day INTEGER NOT NULL DEFAULT 0,
+    audio_minutes_per_day REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class AdmissionDeferred(RuntimeError):
+    """Low-priority work held back because a budget is nearly used up"""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class UsageLedger:
+    """Rolling per-minute usage totals and budgets in a SQLite file"""
+
+    def __init__(self, db_file, retention_days=USAGE_RETENTION_DAYS):
+        self.db_file = db_file
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._pruned_at = 0
+
+    def record(self, clinic, task, model, prompt_tokens=0, completion_tokens=0, audio_seconds=0.0,
+               latency_ms=0.0, error=False, now=None):
+        """Add one call to its minute's totals"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO usage (minute, clinic, task, model, calls, errors, prompt_tokens,
+                                      completion_tokens, audio_seconds, latency_ms)
+                   VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+                   ON CONFLICT (minute, clinic, task, model) DO UPDATE SET
+                       calls = calls + 1,
+                       errors = errors + excluded.errors,
+                       prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                       completion_tokens = completion_tokens + excluded.completion_tokens,
+                       audio_seconds = audio_seconds + excluded.audio_seconds,
+                       latency_ms = latency_ms + excluded.latency_ms""",
+                (int(now // 60), clinic, task, model or "", int(bool(error)), int(prompt_tokens or 0),
+                 int(completion_tokens or 0), float(audio_seconds or 0), float(latency_ms or 0))
+            )
+            if now - self._pruned_at > 3600:
+                self._conn.execute("DELETE FROM usage WHERE minute < ?",
+                                   (int(now // 60) - self.retention_days * 24 * 60,))
+                self._pruned_at = now
+
+    def totals(self, clinic, window_seconds, now=None):
+        """Usage totals of a clinic over the last window_seconds (whole minutes)"""
+        now = time.time() if now is None else now
+        since = int(now // 60) - max(1, int(window_seconds // 60)) + 1
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT COALESCE(SUM(calls), 0), COALESCE(SUM(errors), 0), COALESCE(SUM(prompt_tokens), 0),
+                          COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(audio_seconds), 0), COALESCE(SUM(latency_ms), 0)
+                   FROM usage WHERE clinic = ? AND minute >= ?""",
+                (clinic, since)
+            ).fetchone()
+        calls, errors, prompt_tokens, completion_tokens, audio_seconds, latency_ms = row
+        return {
+            'calls': calls, 'errors': errors, 'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens, 'tokens': prompt_tokens + completion_tokens,
+            'audio_seconds': audio_seconds, 'latency_ms': latency_ms,
+        }
+
+    def breakdown(self, window_seconds, now=None):
+        """Usage per (clinic, task, model) over the last window_seconds"""
+        now = time.time() if now is None else now
+        since = int(now // 60) - max(1, int(window_seconds // 60)) + 1
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT clinic, task, model, SUM(calls), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens),
+                          SUM(audio_seconds), SUM(latency_ms)
+                   FROM usage WHERE minute >= ? GROUP BY clinic, task, model ORDER BY clinic, task, model""",
+                (since,)
+            ).fetchall()
+        return [
+            {
+                'clinic': clinic, 'task': task, 'model': model, 'calls': calls, 'errors': errors,
+                'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'audio_seconds': round(audio_seconds, 1), 'mean_latency_ms': round(latency_ms / calls, 1) if calls else 0,
+            }
+            for clinic, task, model, calls, errors, prompt_tokens, completion_tokens, audio_seconds, latency_ms in rows
+        ]
+
+    def budget(self, clinic):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tokens_per_minute, tokens_per_day, audio_minutes_per_day FROM budgets WHERE clinic = ?",
+                (clinic,)
+            ).fetchone()
+        return Budget(*row) if row else Budget()
+
+    def set_budget(self, clinic, budget):
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO budgets (clinic, tokens_per_minute, tokens_per_day, audio_minutes_per_day)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT (clinic) DO UPDATE SET tokens_per_minute = excluded.tokens_per_minute,
+                       tokens_per_day = excluded.tokens_per_day, audio_minutes_per_day = excluded.audio_minutes_per_day""",
+                (clinic, int(budget.tokens_per_minute), int(budget.tokens_per_day), float(budget.audio_minutes_per_day))
+            )
+
+    def budget_use(self, clinic, now=None):
+        """[(window label, fraction used, seconds until it frees up)] for each budget the clinic has"""
+        budget = self.budget(clinic)
+        used = []
+        if budget.tokens_per_minute:
+            minute = self.totals(clinic, 60, now)
+            used.append(("tokens this minute", minute['tokens'] / budget.tokens_per_minute, 60))
+        if budget.tokens_per_day or budget.audio_minutes_per_day:
+            day = self.totals(clinic, 24 * 60 * 60, now)
+            if budget.tokens_per_day:
+                used.append(("tokens today", day['tokens'] / budget.tokens_per_day, None))
+            if budget.audio_minutes_per_day:
+                used.append(("audio minutes today", day['audio_seconds'] / 60 / budget.audio_minutes_per_day, None))
+        return used
+
+    def admission(self, clinic, priority=PRIORITY_NORMAL, now=None):
+        """Whether work of this priority may run now: ADMIT, DOWNGRADE or DEFER"""
+        if priority != PRIORITY_LOW:
+            return Admission(ADMIT, None, None)
+        use = self.budget_use(clinic, now)
+        if not use:
+            return Admission(ADMIT, None, None)
+        label, fraction, retry_after = max(use, key=lambda item: item[1])
+        reason = f"{fraction * 100:.0f}% of the clinic's budget for {label} is used"
+        if fraction >= DEFER_AT:
+            return Admission(DEFER, reason, retry_after)
+        if fraction >= DOWNGRADE_AT:
+            return Admission(DOWNGRADE, reason, retry_after)
+        return Admission(ADMIT, None, None)
@@ -0,0 +1,30 @@
+"""Advisory file locks shared by processes using the same data files."""
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks on this platform; writers are then only
+    # serialized within one process
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, held by one process at a time
+
+    Not reentrant; callers take it while already holding their thread lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
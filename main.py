@@ -5,11 +5,25 @@ import json
 import datetime
 import time
 import pandas as pd
+import altair as alt
 from io import BytesIO
 import base64
-import tempfile
 import numpy as np
 import wave
+import uuid
+from storage import open_data_store
+from audio import transcribe_source, wav_duration
+from spool import AudioSpool, cleanup_spools, PREVIEW_MAX_BYTES
+from cache import DiskCache
+from dental import generate_dental_chart_data, render_dental_chart, stored_dental_chart, load_dental_chart, DENTAL_CONDITIONS
+from dental_analytics import build_matrices, CONDITIONS, SEVERITY_LABELS, PERIODONTAL_CONDITIONS
+from dental_findings import extract_findings, RULE_COVERAGE_THRESHOLD
+from tracing import span, timing_spans, LatencyLog, STAGES, ROLLING_WINDOW
+from providers import open_provider, configured_provider
+from routing import TASKS, AVAILABLE_MODELS, load_routes, save_routes
+from ledger import UsageLedger, AdmissionDeferred, Budget, PRIORITY_NORMAL, PRIORITY_LOW
+from model_benchmark import run_benchmark
+from generation import Generator, SOAP_TEMPLATE, CLIENT_SUMMARY_TEMPLATE, transcription_request, combined_request, client_email_request
 
 # Load environment variables from .env file for local development
 try:
@@ -46,11 +60,33 @@ if BASIC_RECORDER_AVAILABLE:
 # Data persistence
 DATA_FILE = "vetscribe_data.json"
 
+# Shown instead of the player for recordings too long to load into memory
+SPOOL_PREVIEW_LIMIT_NOTE = (f"Playback and download are off for recordings over {PREVIEW_MAX_BYTES // (1024 * 1024)} MB; "
+                            "the recording can still be transcribed.")
+
+# Whisper transcripts of previously seen audio
+TRANSCRIPT_CACHE_DIR = os.path.join("vetscribe_cache", "transcripts")
+TRANSCRIPT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+WHISPER_PARAMS = {"model": "whisper-1", "response_format": "text"}
+
+# Chat completions for identical requests (all run at temperature 0-0.1)
+RESPONSE_CACHE_DIR = os.path.join("vetscribe_cache", "responses")
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Per-stage timings of every appointment, as JSON lines
+LATENCY_LOG_FILE = "vetscribe_latency.jsonl"
+
+# Tokens, audio and latency of every AI call, per clinic, with the clinics' budgets
+USAGE_DB_FILE = "vetscribe_usage.db"
+CLINIC_ID = os.getenv("VETSCRIBE_CLINIC") or "default"
+
 # Configure OpenAI - Using Environment Variables for Security
-openai.api_key = os.getenv("OPENAI_API_KEY") or st.secrets.get("OPENAI_API_KEY", "")
+# The offline stub provider needs no key, so secrets are not required for it
+openai.api_key = os.getenv("OPENAI_API_KEY") or (st.secrets.get("OPENAI_API_KEY", "") if configured_provider() != "stub" else "")
 
-# Check API key configuration
-if not openai.api_key:
+# Check API key configuration (the offline stub provider needs none)
+if not openai.api_key and configured_provider() != "stub":
     st.error("🔑 **OpenAI API Key Required**")
     st.markdown("### Setup Instructions:")
     st.markdown("**For Local Development:**")
@@ -70,20 +106,65 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize session state with data persistence
-if 'appointments' not in st.session_state:
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                st.session_state.appointments = data.get('appointments', [])
-                st.session_state.patients = data.get('patients', [])
-        except:
-            st.session_state.appointments = []
-            st.session_state.patients = []
-    else:
-        st.session_state.appointments = []
-        st.session_state.patients = []
+@st.cache_resource
+def get_data_store():
+    """Data store shared by every session in this process (backend from VETSCRIBE_STORAGE)"""
+    return open_data_store(DATA_FILE)
+
+@st.cache_resource
+def get_ai_provider(api_key, provider):
+    """AI provider shared by every session in this process (VETSCRIBE_PROVIDER)
+    
+    For OpenAI this pools connections and applies timeouts, retries with
+    backoff and a per-model limit on requests in flight; see ai_client.
+    """
+    return open_provider(api_key, provider)
+
+def provider_cache_dir(directory):
+    """Cache directory for the configured provider, so stub results never mix with real ones"""
+    provider = configured_provider()
+    return directory if provider == "openai" else f"{directory}_{provider}"
+
+@st.cache_resource
+def get_transcript_cache():
+    """Transcript cache shared by every session in this process"""
+    return DiskCache(provider_cache_dir(TRANSCRIPT_CACHE_DIR), TRANSCRIPT_CACHE_MAX_BYTES)
+
+@st.cache_resource
+def get_response_cache():
+    """Chat completion cache shared by every session in this process"""
+    return DiskCache(provider_cache_dir(RESPONSE_CACHE_DIR), RESPONSE_CACHE_MAX_BYTES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+
+@st.cache_resource(max_entries=1)
+def get_dental_matrices(data_version):
+    """Every stored dental chart as analytics matrices per species
+    
+    Keyed on the store's data version, so the matrices are rebuilt after
+    any write and shared by every session until then.
+    """
+    return build_matrices(data_store.appointment_fields(("species", "age", "dental_chart_data"), with_field="dental_chart_data"))
+
+@st.cache_resource
+def get_latency_log():
+    """Latency log shared by every session in this process"""
+    return LatencyLog(LATENCY_LOG_FILE)
+
+@st.cache_resource
+def get_usage_ledger():
+    """Usage ledger shared by every session in this process"""
+    return UsageLedger(USAGE_DB_FILE)
+
+# Appointments and patients are queried from the store as needed rather than
+# loaded into each session; records come back as read-only shared views
+data_store = get_data_store()
+# Resolved here so generation worker threads can use them too
+response_cache = get_response_cache()
+ai_provider = get_ai_provider(openai.api_key, configured_provider())
+# Model per task with fallbacks, as saved from Settings
+model_routes = load_routes()
+latency_log = get_latency_log()
+usage_ledger = get_usage_ledger()
+generator = Generator(ai_provider, response_cache, model_routes, usage_ledger, CLINIC_ID)
 
 if 'current_appointment' not in st.session_state:
     st.session_state.current_appointment = None
@@ -92,150 +173,119 @@ if 'last_transcription' not in st.session_state:
 if 'audio_recorded' not in st.session_state:
     st.session_state.audio_recorded = False
 
-# Medical Transcription SOAP Note Template
-SOAP_TEMPLATE = """
-You are a medical transcription assistant. Organize the provided veterinary appointment notes into SOAP format.
-
-CRITICAL INSTRUCTIONS:
-- ONLY use information explicitly mentioned in the notes below
-- DO NOT add medical knowledge, normal ranges, or assumptions
-- DO NOT infer anything not directly stated
-- If a SOAP section has no information, write "Not documented"
-- Better to have incomplete sections than fabricated information
-
-SUBJECTIVE: Only client-reported symptoms, concerns, and history mentioned in notes
-OBJECTIVE: Only examination findings, vitals, and observations explicitly stated
-ASSESSMENT: Only diagnoses or clinical impressions actually mentioned
-PLAN: Only treatments, medications, and recommendations specifically given
-
-Appointment Notes:
-{input_text}
-
-Create a factual SOAP note using only the above information:
-"""
+def whisper_transcribe(audio_file):
+    """Send one named in-memory audio upload to Whisper through the AI provider"""
+    return ai_provider.transcribe(audio_file, **WHISPER_PARAMS)
 
-# Enhanced Client Summary Template
-CLIENT_SUMMARY_TEMPLATE = """
-You are Dr. VetScribe, a compassionate veterinarian who excels at explaining medical information to pet owners in a clear, caring way.
-
-Based on the appointment information below, create a client-friendly summary that a pet owner can easily understand. Your goal is to:
+def transcribe_audio(audio_source, filename=None, on_progress=None, audio_hash=None):
+    """Transcribe audio using OpenAI Whisper, in concurrent segments for long recordings
+    
+    Accepts recorder arrays, raw bytes or uploaded files. Audio transcribed
+    before is answered from the transcript cache. Otherwise WAV audio is first
+    downmixed, resampled to 16 kHz and trimmed of long silences; the savings
+    and per-stage timings are kept in session state for the UI. The stage
+    timings are logged as latency spans and held in pending_spans until the
+    appointment they belong to is saved.
+    """
+    started = time.perf_counter()
+    try:
+        transcript, stats = transcribe_source(
+            audio_source, whisper_transcribe, filename=filename, on_progress=on_progress,
+            cache=get_transcript_cache(), model_params=WHISPER_PARAMS, audio_hash=audio_hash
+        )
+    except Exception as e:
+        elapsed = time.perf_counter() - started
+        latency_log.record(timing_spans({"transcription": elapsed}, error=True))
+        generator.record_usage("transcription", WHISPER_PARAMS['model'], elapsed, error=True)
+        return f"Error transcribing audio: {str(e)}"
+    
+    st.session_state.last_audio_stats = stats
+    if not stats.get('cached'):
+        # Billed audio is what was sent after trimming; unknown for compressed uploads
+        generator.record_usage("transcription", WHISPER_PARAMS['model'], stats['timings'].get('transcribe', 0),
+                     audio_seconds=stats.get('output_seconds', 0))
+    timings = stats['timings']
+    stage_seconds = {"audio_ingest": timings['ingest']}
+    if 'preprocess' in timings:
+        stage_seconds["audio_preprocess"] = timings['preprocess']
+    stage_seconds["transcription"] = timings.get('cache', 0) + timings.get('transcribe', 0)
+    spans = timing_spans(stage_seconds, cached=stats.get('cached', False), audio_bytes=stats['input_bytes'])
+    latency_log.record(spans)
+    st.session_state.pending_spans = spans
+    return transcript
 
-- Explain what happened during the visit in simple terms
-- Clearly describe any findings or concerns
-- Explain the treatment plan and why it's important
-- Provide clear home care instructions
-- Give realistic expectations and follow-up plans
-- Be reassuring when appropriate, but honest about concerns
-- Use everyday language while being medically accurate
+def get_audio_spool():
+    """This session's disk spool for recorded audio"""
+    if 'audio_spool' not in st.session_state:
+        # New session - drop recordings left behind by abandoned ones
+        cleanup_spools()
+        st.session_state.audio_spool = AudioSpool(uuid.uuid4().hex)
+    return st.session_state.audio_spool
 
-Remember: Pet owners are often worried about their beloved companions. Be empathetic, thorough, and clear. Avoid excessive medical jargon but don't talk down to them.
+def transcription_progress():
+    """Progress bar callback for transcribe_audio"""
+    progress_bar = st.progress(0.0)
+    def on_progress(done, total):
+        progress_bar.progress(done / total, text=f"Transcribed {done} of {total} segment(s)")
+    return on_progress
 
-Appointment Information: {input_text}
+def format_signalment(patient_name, species, breed, age, sex, weight, client_name, appointment_type, notes):
+    """Patient details and notes as sent to the generation prompts"""
+    return f"\nPatient: {patient_name}\nSpecies: {species}\nBreed: {breed}\nAge: {age}\nSex: {sex}\nWeight: {weight}\nClient: {client_name}\nAppointment Type: {appointment_type}\n\nAppointment Notes:\n{notes}"
 
-Create a caring, clear summary for the pet owner:
-"""
+def benchmark_request(task, appointment, model):
+    """Request a task makes for a fixture appointment, for the model benchmark"""
+    signalment = format_signalment(
+        appointment['patient_name'], appointment['species'], appointment['breed'], appointment['age'],
+        appointment['sex'], appointment['weight'], appointment['client_name'],
+        appointment['appointment_type'], appointment['original_notes']
+    )
+    if task == "soap":
+        return transcription_request(SOAP_TEMPLATE.format(input_text=signalment), model=model)
+    if task == "client_summary":
+        return transcription_request(CLIENT_SUMMARY_TEMPLATE.format(input_text=signalment), model=model)
+    if task == "client_email":
+        return client_email_request(appointment, model)
+    if task == "dental_findings":
+        return dental_findings_request(appointment['original_notes'], model)
+    return combined_request(signalment, model)
 
-def transcribe_audio(audio_bytes):
-    """Transcribe audio using OpenAI Whisper"""
+def save_appointment(appointment_data):
+    """Save appointment to the data store and return its allocated id"""
     try:
-        # Create a temporary file to save the audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_bytes)
-            tmp_file_path = tmp_file.name
-        
-        # Transcribe using Whisper
-        with open(tmp_file_path, "rb") as audio_file:
-            transcript = openai.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text"
-            )
-        
-        # Clean up the temporary file
-        os.unlink(tmp_file_path)
-        
-        return transcript
+        return get_data_store().add_appointment(appointment_data)
     except Exception as e:
-        return f"Error transcribing audio: {str(e)}"
+        st.error(f"Error saving data: {str(e)}")
+        return None
 
-def generate_ai_response(prompt, template_type="soap"):
-    """Generate AI response using OpenAI GPT with medical transcription focus"""
+def update_appointment(appointment_id, **fields):
+    """Update fields of a saved appointment in the data store"""
     try:
-        template = SOAP_TEMPLATE if template_type == "soap" else CLIENT_SUMMARY_TEMPLATE
-        
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a medical transcription assistant. You organize veterinary notes but NEVER add information not present in the input. If information is missing, state 'Not documented' rather than inferring details."
-                },
-                {
-                    "role": "user", 
-                    "content": template.format(input_text=prompt)
-                }
-            ],
-            max_tokens=1200,  # Reduced to prevent elaborate responses
-            temperature=0.0,  # Zero creativity - purely factual
-        )
-        return response.choices[0].message.content
+        get_data_store().update_appointment(appointment_id, fields)
     except Exception as e:
-        return f"Error generating response: {str(e)}"
+        st.error(f"Error saving data: {str(e)}")
 
-def save_data():
-    """Save all data to JSON file"""
+def attach_spans(appointment_id, spans):
+    """Add latency spans to an appointment's record"""
+    if appointment_id is None:
+        return
     try:
-        data = {
-            'appointments': st.session_state.appointments,
-            'patients': st.session_state.patients
-        }
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        # One atomic append, so spans recorded by other sessions are kept
+        get_data_store().append_to_appointment(appointment_id, 'latency_spans', spans)
     except Exception as e:
         st.error(f"Error saving data: {str(e)}")
 
-def save_appointment(appointment_data):
-    """Save appointment to session state and file"""
-    st.session_state.appointments.append(appointment_data)
-    save_data()
+def record_spans(appointment_id, spans):
+    """Add latency spans to an appointment's record and the latency log"""
+    attach_spans(appointment_id, spans)
+    latency_log.record(spans, appointment_id)
 
-def generate_client_email(appointment_data):
-    """Generate professional client email from appointment data"""
-    
-    email_prompt = f"""
-    Create a professional email to {appointment_data['client_name']} about {appointment_data['patient_name']}'s veterinary visit.
-    
-    CRITICAL RULES:
-    - ONLY include information explicitly mentioned in the appointment notes
-    - DO NOT add treatments, medications, or recommendations not stated
-    - DO NOT infer medical advice beyond what was discussed
-    - If specific treatments weren't mentioned, write "as discussed during the visit"
-    - Be warm and professional but stick strictly to documented facts
-    
-    Patient: {appointment_data['patient_name']} ({appointment_data['species']})
-    Original Notes: {appointment_data['original_notes']}
-    
-    Create an email using ONLY the information from the notes above.
-    """
-    
+def save_patient(patient_data):
+    """Save patient to the data store"""
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are writing a follow-up email for a veterinarian. Use ONLY information explicitly stated in the appointment notes. Never add medical recommendations not mentioned in the original notes."
-                },
-                {
-                    "role": "user", 
-                    "content": email_prompt
-                }
-            ],
-            temperature=0.1  # Lower temperature for more factual responses
-        )
-        return response.choices[0].message.content
+        get_data_store().add_patient(patient_data)
     except Exception as e:
-        return f"Error generating email: {str(e)}"
+        st.error(f"Error saving data: {str(e)}")
 
 def export_to_text(content, filename):
     """Create downloadable text file"""
@@ -269,6 +319,7 @@ def simulate_pims_integration(appointment_data):
         with col1:
             if st.button("🚀 Export to PIMS", type="primary", key=f"export_pims_{appointment_data.get('id', 'temp')}"):
                 with st.spinner(f"Connecting to {selected_pims}..."):
+                    export_started = time.perf_counter()
                     time.sleep(2)  # Simulate API connection time
                     
                     if selected_pims == "Demo Mode (Simulation)":
@@ -293,6 +344,8 @@ def simulate_pims_integration(appointment_data):
                             time.sleep(0.5)
                         
                         status_text.text("Integration complete!")
+                        export_seconds = time.perf_counter() - export_started
+                        record_spans(appointment_data.get('id'), timing_spans({"pims_export": export_seconds}, system=selected_pims))
                         
                         # Show integration results
                         st.balloons()
@@ -303,7 +356,7 @@ def simulate_pims_integration(appointment_data):
                             st.metric("Billing Generated", "$185.00")
                         with col_b:
                             st.metric("Follow-up Scheduled", "1 week")
-                            st.metric("Integration Time", "2.3 sec")
+                            st.metric("Integration Time", f"{export_seconds:.1f} sec")
                         
                         # Track integration in session state
                         if 'integrations_performed' not in st.session_state:
@@ -343,8 +396,8 @@ def simulate_pims_integration(appointment_data):
         st.error(f"PIMS integration error: {str(e)}")
         st.info("PIMS integration disabled due to error - core functionality unaffected")
 
-def extract_dental_findings_from_text(text):
-    """Extract dental findings from COHAT notes using AI"""
+def dental_findings_request(text, model="gpt-4"):
+    """Chat request extracting dental findings from COHAT notes"""
     dental_prompt = f"""
     Analyze the following veterinary dental examination notes and extract specific dental findings.
     
@@ -367,271 +420,72 @@ def extract_dental_findings_from_text(text):
     Example: {{"108": "calculus_moderate", "209": "gingivitis_severe", "301": "pocket_5mm"}}
     """
     
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a veterinary dental specialist. Extract only explicitly mentioned dental findings. Return valid Python dictionary format only."
+            },
+            {
+                "role": "user",
+                "content": dental_prompt
+            }
+        ],
+        temperature=0.0
+    )
+
+def extract_dental_findings_from_text(text, details=None):
+    """Extract dental findings from COHAT notes, by rule and with AI when the rules miss too much
+    
+    Notes written with Triadan numbers and the chart's condition terms are
+    read by dental_findings without a model call. Below
+    RULE_COVERAGE_THRESHOLD the AI extractor runs too, and its findings are
+    merged over the rule ones. details, if given, receives the method used
+    and the rule coverage (the dental_extraction span, for the hit rate).
+    """
+    extraction = extract_findings(text)
+    if details is not None:
+        details["coverage"] = round(extraction.coverage, 3)
+        details["method"] = "rules"
+    if extraction.coverage >= RULE_COVERAGE_THRESHOLD:
+        return extraction.findings
+    
+    if details is not None:
+        details["method"] = "ai"
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a veterinary dental specialist. Extract only explicitly mentioned dental findings. Return valid Python dictionary format only."
-                },
-                {
-                    "role": "user",
-                    "content": dental_prompt
-                }
-            ],
-            temperature=0.0
-        )
+        result = generator.complete_routed("dental_findings", lambda model: dental_findings_request(text, model))
         
-        # Extract dictionary from response
-        result = response.choices[0].message.content
         # Try to parse as dictionary
         import ast
         try:
             findings = ast.literal_eval(result)
-            return findings if isinstance(findings, dict) else {}
+            return {**extraction.findings, **findings} if isinstance(findings, dict) else extraction.findings
         except:
-            return {}
+            return extraction.findings
             
     except Exception as e:
         st.error(f"Error extracting dental findings: {str(e)}")
-        return {}
-
-def generate_dental_chart_data(species, findings_dict):
-    """Generate comprehensive dental chart data"""
-    
-    # Dental formulas
-    canine_teeth = {
-        'upper_right': ['101', '102', '103', '104', '105', '106', '107', '108', '109', '110'],
-        'upper_left': ['201', '202', '203', '204', '205', '206', '207', '208', '209', '210', '211'],
-        'lower_right': ['401', '402', '403', '404', '405', '406', '407', '408', '409', '410', '411'],
-        'lower_left': ['301', '302', '303', '304', '305', '306', '307', '308', '309', '310']
-    }
-    
-    feline_teeth = {
-        'upper_right': ['101', '102', '103', '104', '105', '106', '107', '108', '109'],
-        'upper_left': ['201', '202', '203', '204', '205', '206', '207', '208', '209'],
-        'lower_right': ['401', '402', '403', '404', '405', '406', '407'],
-        'lower_left': ['301', '302', '303', '304', '305', '306', '307']
-    }
-    
-    teeth_layout = canine_teeth if species.lower() == 'dog' else feline_teeth
-    
-    # Condition colors and labels
-    conditions = {
-        'normal': {'color': '#e5e7eb', 'label': 'Normal', 'priority': 0},
-        'gingivitis_mild': {'color': '#fbbf24', 'label': 'Mild Gingivitis', 'priority': 1},
-        'gingivitis_moderate': {'color': '#f97316', 'label': 'Moderate Gingivitis', 'priority': 2},
-        'gingivitis_severe': {'color': '#dc2626', 'label': 'Severe Gingivitis', 'priority': 3},
-        'calculus_light': {'color': '#d1d5db', 'label': 'Light Calculus', 'priority': 1},
-        'calculus_moderate': {'color': '#9ca3af', 'label': 'Moderate Calculus', 'priority': 2},
-        'calculus_heavy': {'color': '#4b5563', 'label': 'Heavy Calculus', 'priority': 3},
-        'pocket_4mm': {'color': '#3b82f6', 'label': '4mm Pocket', 'priority': 2},
-        'pocket_5mm': {'color': '#1d4ed8', 'label': '5mm Pocket', 'priority': 3},
-        'pocket_6mm': {'color': '#1e40af', 'label': '6+ mm Pocket', 'priority': 4},
-        'fracture': {'color': '#7c2d12', 'label': 'Fracture', 'priority': 4},
-        'missing': {'color': '#000000', 'label': 'Missing', 'priority': 5},
-        'extracted': {'color': '#ef4444', 'label': 'Extracted Today', 'priority': 5},
-        'crown': {'color': '#ffd700', 'label': 'Crown/Restoration', 'priority': 1}
-    }
-    
-    return {
-        'teeth_layout': teeth_layout,
-        'conditions': conditions,
-        'findings': findings_dict,
-        'species': species
-    }
-
-def render_dental_chart(chart_data):
-    """Render interactive dental chart in Streamlit"""
-    
-    st.markdown("### 🦷 AI-Generated Dental Chart")
-    
-    teeth_layout = chart_data['teeth_layout']
-    conditions = chart_data['conditions']
-    findings = chart_data['findings']
-    species = chart_data['species']
-    
-    # Chart header
-    col1, col2 = st.columns([3, 1])
-    with col1:
-        st.markdown(f"**{species.title()} Dental Chart**")
-    with col2:
-        if st.button("📊 Generate Analysis", key="dental_analysis"):
-            analyze_dental_findings(findings, conditions)
-    
-    # CSS for dental chart styling
-    st.markdown("""
-    <style>
-    .tooth-normal { 
-        background-color: #e5e7eb; border: 2px solid #9ca3af; 
-        width: 35px; height: 45px; margin: 2px; display: inline-block; 
-        text-align: center; line-height: 45px; font-size: 10px; font-weight: bold;
-        border-radius: 8px 8px 4px 4px; position: relative;
-    }
-    .tooth-finding { 
-        border: 3px solid #dc2626 !important; 
-        box-shadow: 0 0 8px rgba(220, 38, 38, 0.5);
-    }
-    .tooth-label { font-size: 8px; color: #374151; }
-    .jaw-section { 
-        background: #f9fafb; padding: 15px; margin: 10px 0; 
-        border-radius: 8px; border: 1px solid #e5e7eb; 
-    }
-    </style>
-    """, unsafe_allow_html=True)
-    
-    # Upper jaw
-    st.markdown('<div class="jaw-section">', unsafe_allow_html=True)
-    st.markdown("**UPPER JAW (Maxilla)**")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown("*Left Side*")
-        render_tooth_row(teeth_layout['upper_left'], findings, conditions, reverse=True)
-    
-    with col2:
-        st.markdown("*Right Side*")
-        render_tooth_row(teeth_layout['upper_right'], findings, conditions)
-    
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Lower jaw
-    st.markdown('<div class="jaw-section">', unsafe_allow_html=True)
-    st.markdown("**LOWER JAW (Mandible)**")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown("*Left Side*")
-        render_tooth_row(teeth_layout['lower_left'], findings, conditions, reverse=True)
-    
-    with col2:
-        st.markdown("*Right Side*")
-        render_tooth_row(teeth_layout['lower_right'], findings, conditions)
-    
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Legend
-    st.markdown("### Chart Legend")
-    cols = st.columns(4)
-    conditions_list = list(conditions.items())
-    
-    for i, (condition_key, condition_data) in enumerate(conditions_list):
-        with cols[i % 4]:
-            st.markdown(f"""
-            <div style="display: flex; align-items: center; margin: 5px 0;">
-                <div style="width: 20px; height: 20px; background-color: {condition_data['color']}; 
-                     border: 1px solid #ccc; margin-right: 8px; border-radius: 3px;"></div>
-                <span style="font-size: 12px;">{condition_data['label']}</span>
-            </div>
-            """, unsafe_allow_html=True)
-
-def render_tooth_row(teeth, findings, conditions, reverse=False):
-    """Render a row of teeth"""
-    if reverse:
-        teeth = list(reversed(teeth))
-    
-    tooth_html = ""
-    for tooth in teeth:
-        condition = findings.get(tooth, 'normal')
-        condition_data = conditions.get(condition, conditions['normal'])
-        
-        finding_class = "tooth-finding" if condition != 'normal' else ""
-        
-        tooth_html += f"""
-        <div class="tooth-normal {finding_class}" 
-             style="background-color: {condition_data['color']}; color: {'white' if condition == 'missing' else 'black'};"
-             title="Tooth {tooth}: {condition_data['label']}">
-            {tooth[-2:]}
-        </div>
-        """
-    
-    st.markdown(tooth_html, unsafe_allow_html=True)
-
-def analyze_dental_findings(findings, conditions):
-    """Generate AI analysis of dental findings"""
-    if not findings:
-        st.info("No dental findings detected in the examination notes.")
-        return
-    
-    # Count findings by severity
-    severity_counts = {}
-    problem_teeth = []
-    
-    for tooth, condition in findings.items():
-        if condition != 'normal':
-            severity = conditions[condition]['priority']
-            severity_counts[severity] = severity_counts.get(severity, 0) + 1
-            problem_teeth.append(f"Tooth {tooth}: {conditions[condition]['label']}")
-    
-    # Generate summary
-    st.markdown("#### 🔍 Dental Analysis Summary")
-    
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.metric("Total Findings", len([f for f in findings.values() if f != 'normal']))
-    
-    with col2:
-        severe_conditions = len([f for f in findings.values() if conditions.get(f, {}).get('priority', 0) >= 3])
-        st.metric("Severe Conditions", severe_conditions)
-    
-    with col3:
-        total_teeth = len(findings)
-        affected_percentage = (len([f for f in findings.values() if f != 'normal']) / total_teeth * 100) if total_teeth > 0 else 0
-        st.metric("Affected Teeth %", f"{affected_percentage:.1f}%")
-    
-    # Detailed findings
-    if problem_teeth:
-        st.markdown("#### 📋 Detailed Findings")
-        for finding in problem_teeth:
-            st.markdown(f"• {finding}")
-        
-        # Recommendations
-        st.markdown("#### 💡 Recommendations")
-        generate_dental_recommendations(findings, conditions)
+        return extraction.findings
 
-def generate_dental_recommendations(findings, conditions):
-    """Generate treatment recommendations based on findings"""
-    recommendations = []
-    
-    # Count different types of conditions
-    gingivitis_count = len([f for f in findings.values() if 'gingivitis' in f])
-    calculus_count = len([f for f in findings.values() if 'calculus' in f])
-    pocket_count = len([f for f in findings.values() if 'pocket' in f])
-    fracture_count = len([f for f in findings.values() if f == 'fracture'])
-    extraction_count = len([f for f in findings.values() if f in ['extracted', 'missing']])
-    
-    if gingivitis_count > 0:
-        recommendations.append(f"🦷 **Gingivitis Management**: {gingivitis_count} teeth affected - Recommend professional cleaning and improved home care")
-    
-    if calculus_count > 0:
-        recommendations.append(f"🧽 **Calculus Removal**: {calculus_count} teeth with calculus buildup - Professional scaling required")
-    
-    if pocket_count > 0:
-        recommendations.append(f"📏 **Periodontal Therapy**: {pocket_count} teeth with deep pockets - May require root planing or surgical treatment")
-    
-    if fracture_count > 0:
-        recommendations.append(f"🔨 **Fracture Repair**: {fracture_count} fractured teeth - Evaluate for extraction or restoration")
-    
-    if extraction_count > 0:
-        recommendations.append(f"⚕️ **Post-Extraction Care**: {extraction_count} teeth extracted/missing - Monitor healing and pain management")
-    
-    if not recommendations:
-        recommendations.append("✅ **Good Oral Health**: No significant dental pathology detected - Continue current home care routine")
-    
-    for rec in recommendations:
-        st.markdown(rec)
+def dental_rule_hit_rate():
+    """(share of dental extractions answered by rules alone, extractions) from the latency log"""
+    methods = [s["method"] for s in latency_log.recent() if s.get("stage") == "dental_extraction" and "method" in s]
+    if not methods:
+        return None, 0
+    return methods.count("rules") / len(methods), len(methods)
 
 # Sidebar Navigation
 st.sidebar.title("VetScribe AI")
 st.sidebar.markdown("*Professional Veterinary AI Scribe*")
 
+menu_options = ["Home", "New Appointment", "View Appointments", "Patients", "Settings"]
+if st.session_state.get('enable_dental_testing', False):
+    menu_options.insert(-1, "Dental Analytics")
+
 menu_option = st.sidebar.selectbox(
     "Navigation",
-    ["Home", "New Appointment", "View Appointments", "Patients", "Settings"]
+    menu_options
 )
 
 # Initialize transcribed text from session state
@@ -649,14 +503,14 @@ if menu_option == "Home":
         col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
-        st.metric("Total Appointments", len(st.session_state.appointments))
+        st.metric("Total Appointments", data_store.count_appointments())
     
     with col2:
-        st.metric("Patients Registered", len(st.session_state.patients))
+        st.metric("Patients Registered", data_store.count_patients())
     
     with col3:
         # Count emails generated
-        emails_generated = sum(1 for apt in st.session_state.appointments if apt.get('client_email'))
+        emails_generated = data_store.count_appointments(with_field='client_email')
         st.metric("Emails Generated", emails_generated)
     
     with col4:
@@ -665,13 +519,32 @@ if menu_option == "Home":
         st.metric("PIMS Integrations", pims_integrations)
     
     with col5:
-        st.metric("Time Saved (est.)", f"{len(st.session_state.appointments) * 15} min")
+        st.metric("Time Saved (est.)", f"{data_store.count_appointments() * 15} min")
     
     # Show dental chart metric if feature enabled
     if st.session_state.get('enable_dental_testing', False):
         with col6:
-            dental_charts = sum(1 for apt in st.session_state.appointments if apt.get('dental_chart_data'))
-            st.metric("Dental Charts", dental_charts)
+            dental_charts = data_store.count_appointments(with_field='dental_chart_data')
+            hit_rate, extractions = dental_rule_hit_rate()
+            st.metric("Dental Charts", dental_charts,
+                      delta=f"{hit_rate * 100:.0f}% read by rules" if hit_rate is not None else None, delta_color="off",
+                      help=f"Share of the last {extractions} dental extractions answered without an AI call" if extractions else None)
+    
+    # Measured waits per pipeline stage, across every session
+    stage_stats = latency_log.stage_stats()
+    if stage_stats:
+        st.markdown("### ⏱️ Where Time Goes")
+        st.caption(f"Rolling median (p50) and 95th percentile (p95) over the last {ROLLING_WINDOW} runs of each stage")
+        st.dataframe(pd.DataFrame([
+            {
+                "Stage": STAGES.get(stage, stage),
+                "Runs": stats['runs'],
+                "Errors": stats['errors'],
+                "p50 (sec)": round(stats['p50_ms'] / 1000, 2),
+                "p95 (sec)": round(stats['p95_ms'] / 1000, 2),
+            }
+            for stage, stats in stage_stats.items()
+        ]), use_container_width=True, hide_index=True)
     
     st.markdown("---")
     
@@ -860,24 +733,27 @@ elif menu_option == "New Appointment":
         if len(audio_data) > 0:
             st.success("🎉 Recording captured successfully!")
             
-            # Convert audio data to bytes for processing
-            audio_bytes = audio_data.tobytes()
-            
-            # Store audio in session state for persistence
-            st.session_state.current_audio_bytes = audio_bytes
+            # Spool the recording to disk rather than keeping it in session state
+            audio_spool = get_audio_spool()
+            audio_spool.write(audio_data)
             st.session_state.audio_recorded = True
             
             # Show recording info
             col1, col2 = st.columns(2)
             with col1:
-                st.metric("Recording Size", f"{len(audio_bytes):,} bytes")
-                estimated_duration = len(audio_bytes) / (44100 * 2)  # Assuming 44.1kHz, 16-bit
+                st.metric("Recording Size", f"{audio_spool.size():,} bytes")
+                # Read from the WAV header, else assume 44.1kHz 16-bit mono
+                with audio_spool.mapped() as audio_view:
+                    estimated_duration = wav_duration(audio_view) or len(audio_view) / (44100 * 2)
                 st.metric("Est. Duration", f"{estimated_duration:.1f} sec")
             
             with col2:
                 # Playback
                 st.markdown("**🔊 Playback:**")
-                st.audio(audio_bytes, format="audio/wav")
+                if audio_spool.previewable():
+                    st.audio(audio_spool.path, format="audio/wav")
+                else:
+                    st.caption(SPOOL_PREVIEW_LIMIT_NOTE)
             
             # Transcribe button
             col1, col2, col3 = st.columns(3)
@@ -885,52 +761,38 @@ elif menu_option == "New Appointment":
             with col1:
                 if st.button("🚀 Transcribe Recording", type="primary", key="transcribe_btn"):
                     with st.spinner("Transcribing with Whisper AI..."):
-                        # Use audio from session state if available
-                        audio_to_transcribe = st.session_state.get('current_audio_bytes', audio_bytes)
+                        # Transcribe with Whisper straight from the memory-mapped spool
+                        with audio_spool.mapped() as audio_view:
+                            transcript = transcribe_audio(audio_view, on_progress=transcription_progress(),
+                                                          audio_hash=audio_spool.digest)
                         
-                        # Create temporary file for transcription
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-                            tmp_file.write(audio_to_transcribe)
-                            tmp_file_path = tmp_file.name
-                        
-                        # Transcribe with Whisper
-                        try:
-                            with open(tmp_file_path, "rb") as audio_file:
-                                transcript = openai.audio.transcriptions.create(
-                                    model="whisper-1",
-                                    file=audio_file,
-                                    response_format="text"
-                                )
-                            
+                        if not transcript.startswith("Error"):
                             # Store transcription in session state
-                            st.session_state.last_transcription = str(transcript)
+                            st.session_state.last_transcription = transcript
                             
                             st.success("✅ Recording transcribed successfully!")
                             st.markdown("**Transcribed Text:**")
-                            st.text_area("Transcription Preview", str(transcript), height=200, key="transcription_preview")
-                            
-                            # Clean up
-                            os.unlink(tmp_file_path)
+                            st.text_area("Transcription Preview", transcript, height=200, key="transcription_preview")
                             
                             # Force rerun to update the manual notes field
                             st.rerun()
-                            
-                        except Exception as e:
-                            st.error(f"Transcription error: {str(e)}")
-                            if os.path.exists(tmp_file_path):
-                                os.unlink(tmp_file_path)
+                        else:
+                            st.error(f"Transcription error: {transcript}")
             
             with col2:
                 # Download option
-                st.download_button(
-                    "💾 Download Audio",
-                    audio_bytes,
-                    file_name=f"vet_recording_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.wav",
-                    mime="audio/wav"
-                )
+                if audio_spool.previewable():
+                    with audio_spool.open() as audio_file:
+                        st.download_button(
+                            "💾 Download Audio",
+                            audio_file,
+                            file_name=f"vet_recording_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.wav",
+                            mime="audio/wav"
+                        )
             
             with col3:
                 if st.button("🗑️ Clear Recording"):
+                    audio_spool.clear()
                     st.rerun()
         
         else:
@@ -957,42 +819,34 @@ elif menu_option == "New Appointment":
         if audio_bytes:
             st.success("🎉 Basic recording captured!")
             
-            # Store in session state
-            st.session_state.current_audio_bytes = audio_bytes
+            # Spool to disk rather than keeping it in session state
+            audio_spool = get_audio_spool()
+            audio_spool.write(audio_bytes)
             st.session_state.audio_recorded = True
             
             col1, col2 = st.columns(2)
             with col1:
-                st.metric("Recording Size", f"{len(audio_bytes):,} bytes")
+                st.metric("Recording Size", f"{audio_spool.size():,} bytes")
             with col2:
-                st.audio(audio_bytes, format="audio/wav")
+                if audio_spool.previewable():
+                    st.audio(audio_spool.path, format="audio/wav")
+                else:
+                    st.caption(SPOOL_PREVIEW_LIMIT_NOTE)
             
             # Transcribe button for basic recorder
             if st.button("🚀 Transcribe Recording", type="primary", key="transcribe_basic"):
                 with st.spinner("Transcribing with Whisper AI..."):
-                    try:
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-                            tmp_file.write(audio_bytes)
-                            tmp_file_path = tmp_file.name
-                        
-                        with open(tmp_file_path, "rb") as audio_file:
-                            transcript = openai.audio.transcriptions.create(
-                                model="whisper-1",
-                                file=audio_file,
-                                response_format="text"
-                            )
-                        
-                        st.session_state.last_transcription = str(transcript)
+                    with audio_spool.mapped() as audio_view:
+                        transcript = transcribe_audio(audio_view, on_progress=transcription_progress(),
+                                                      audio_hash=audio_spool.digest)
+                    
+                    if not transcript.startswith("Error"):
+                        st.session_state.last_transcription = transcript
                         st.success("✅ Recording transcribed successfully!")
-                        st.text_area("Transcription Preview", str(transcript), height=200, key="basic_transcription_preview")
-                        
-                        os.unlink(tmp_file_path)
+                        st.text_area("Transcription Preview", transcript, height=200, key="basic_transcription_preview")
                         st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"Transcription error: {str(e)}")
-                        if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-                            os.unlink(tmp_file_path)
+                    else:
+                        st.error(f"Transcription error: {transcript}")
     
     elif recording_method == "manual_only":
         st.info("📝 Manual text entry selected - no audio recording")
@@ -1020,22 +874,16 @@ elif menu_option == "New Appointment":
         
         if st.button("🚀 Transcribe Uploaded File", key="transcribe_upload", type="primary"):
             with st.spinner("Transcribing uploaded audio..."):
-                try:
-                    # Reset file pointer
-                    uploaded_file.seek(0)
-                    transcript = openai.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=uploaded_file,
-                        response_format="text"
-                    )
-                    
-                    st.session_state.last_transcription = str(transcript)
+                # Uploaded WAV files are split like recordings; other formats go up whole
+                transcript = transcribe_audio(uploaded_file, on_progress=transcription_progress())
+                
+                if not transcript.startswith("Error"):
+                    st.session_state.last_transcription = transcript
                     st.success("✅ File transcribed successfully!")
-                    st.text_area("Transcription Preview", str(transcript), height=150, key="upload_transcription_preview")
+                    st.text_area("Transcription Preview", transcript, height=150, key="upload_transcription_preview")
                     st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"Transcription error: {str(e)}")
+                else:
+                    st.error(f"Transcription error: {transcript}")
     
     # Manual text input as alternative
     st.markdown("#### Or Enter Notes Manually")
@@ -1046,12 +894,24 @@ elif menu_option == "New Appointment":
         with col1:
             st.success(f"✅ Audio transcribed successfully! ({len(st.session_state.last_transcription)} characters)")
             st.info("💡 **Transcribed text loaded below** - You can edit it or add more details before generating notes!")
+            audio_stats = st.session_state.get('last_audio_stats')
+            if audio_stats:
+                if 'input_seconds' in audio_stats:
+                    saved_bytes = audio_stats['input_bytes'] - audio_stats['output_bytes']
+                    st.caption(
+                        f"🎚️ Audio optimized before upload: {audio_stats['input_bytes']:,} → {audio_stats['output_bytes']:,} bytes "
+                        f"({saved_bytes:,} bytes saved, {audio_stats['input_seconds'] - audio_stats['output_seconds']:.1f} sec of silence trimmed)"
+                    )
+                stage_times = " · ".join(f"{stage} {seconds:.2f}s" for stage, seconds in audio_stats['timings'].items())
+                source_note = "from transcript cache" if audio_stats.get('cached') else f"{audio_stats['segments']} segment(s)"
+                st.caption(f"⏱️ {source_note} - {stage_times}")
         with col2:
             if st.button("🗑️ Clear Transcription", key="clear_transcription"):
                 st.session_state.last_transcription = ""
+                st.session_state.last_audio_stats = None
+                st.session_state.pending_spans = []
                 st.session_state.audio_recorded = False
-                if 'current_audio_bytes' in st.session_state:
-                    del st.session_state.current_audio_bytes
+                get_audio_spool().clear()
                 st.rerun()
     else:
         st.info("💡 **Often Better**: For detailed veterinary consultations, typing your notes is usually faster and more accurate!")
@@ -1134,17 +994,47 @@ Type your own notes above - the AI will convert them to professional SOAP format
                 st.info("   • Type notes manually in the text area above")
             else:
                 # Add patient signalment to the input
-                signalment_info = f"\nPatient: {patient_name}\nSpecies: {species}\nBreed: {breed}\nAge: {age}\nSex: {sex}\nWeight: {weight}\nClient: {client_name}\nAppointment Type: {appointment_type}\n\nAppointment Notes:\n{input_text}"
+                signalment_info = format_signalment(patient_name, species, breed, age, sex, weight, client_name, appointment_type, input_text)
+                
+                # Notes are streamed into the tabs as they are written
+                st.markdown("---")
+                st.markdown("### Generated Veterinary Notes")
+                
+                tab1, tab2 = st.tabs(["SOAP Note", "Client Summary"])
+                with tab1:
+                    st.markdown("#### Professional SOAP Note")
+                    soap_placeholder = st.empty()
+                with tab2:
+                    st.markdown("#### Client Summary")
+                    summary_placeholder = st.empty()
                 
                 with st.spinner("Dr. VetScribe is analyzing the case and generating professional notes..."):
+                    generation_spans = []
                     try:
-                        soap_note = generate_ai_response(signalment_info, "soap")
-                        client_summary = generate_ai_response(signalment_info, "client_summary")
+                        documents = None
+                        if st.session_state.get('combined_generation', False):
+                            # One request for the notes, summary and email
+                            with span("generate_combined", generation_spans) as record:
+                                documents = generator.generate_combined_documents(signalment_info)
+                                if documents is None:
+                                    record["error"] = True
+                            if documents is None:
+                                st.warning("Combined generation did not return valid documents - generating them separately")
+                        
+                        if documents:
+                            soap_note, client_summary = documents['soap_note'], documents['client_summary']
+                        else:
+                            # Both calls run at once, so the wait is the slower of the two
+                            soap_note, client_summary = generator.generate_ai_responses(
+                                signalment_info, ["soap", "client_summary"],
+                                placeholders=[soap_placeholder, summary_placeholder],
+                                spans=generation_spans
+                            )
+                        client_email = documents['client_email'] if documents else None
                         
                         if soap_note and not soap_note.startswith("Error"):
                             # Create appointment record only if generation was successful
                             appointment_data = {
-                                "id": len(st.session_state.appointments) + 1,
                                 "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
                                 "patient_name": patient_name,
                                 "client_name": client_name,
@@ -1161,14 +1051,31 @@ Type your own notes above - the AI will convert them to professional SOAP format
                                 "consent": consent_text,
                                 "transcribed_audio": st.session_state.last_transcription if st.session_state.last_transcription else None
                             }
+                            if client_email:
+                                appointment_data["client_email"] = client_email
                             
                             # Save appointment
-                            save_appointment(appointment_data)
-                            st.session_state.current_appointment = appointment_data
+                            # The store allocates the id, so concurrent sessions never collide
+                            with span("save_appointment", generation_spans):
+                                appointment_id = save_appointment(appointment_data)
+                            # Transcription spans were logged when it ran; all go on the record
+                            attach_spans(appointment_id, st.session_state.get('pending_spans', []) + generation_spans)
+                            latency_log.record(generation_spans, appointment_id)
+                            st.session_state.pending_spans = []
+                            # Keep the store's shared record rather than a per-session copy
+                            st.session_state.current_appointment = (
+                                data_store.get_appointment(appointment_id) if appointment_id is not None else None
+                            ) or appointment_data
+                            
+                            if client_email:
+                                # Show the combined email in the client communication section
+                                email_key = f"email_{st.session_state.current_appointment.get('id', 'temp')}"
+                                st.session_state[email_key] = client_email
+                                st.session_state[f"{email_key}_recipient"] = client_name
                             
                             # Add patient if new
-                            if not any(p['name'] == patient_name for p in st.session_state.patients):
-                                st.session_state.patients.append({
+                            if not data_store.has_patient(patient_name):
+                                save_patient({
                                     "name": patient_name,
                                     "client": client_name,
                                     "species": species,
@@ -1178,28 +1085,28 @@ Type your own notes above - the AI will convert them to professional SOAP format
                                     "weight": weight,
                                     "added_date": datetime.datetime.now().strftime("%Y-%m-%d")
                                 })
-                                save_data()  # Save after adding new patient
                             
                             st.success("✅ Professional veterinary notes generated successfully!")
                         else:
+                            latency_log.record(generation_spans)
                             st.error(f"AI Generation Error: {soap_note}")
                             soap_note = None
                             client_summary = None
                     except Exception as e:
+                        latency_log.record(generation_spans)
                         st.error(f"Unexpected error during AI generation: {str(e)}")
                         soap_note = None
                         client_summary = None
                 
-                # Display generated notes only if successful
+                if not soap_note:
+                    # Drop any partially streamed text
+                    soap_placeholder.empty()
+                    summary_placeholder.empty()
+                
+                # Finish the streamed notes only if successful
                 if 'soap_note' in locals() and soap_note and not soap_note.startswith("Error"):
-                    st.markdown("---")
-                    st.markdown("### Generated Veterinary Notes")
-                    
-                    tab1, tab2 = st.tabs(["SOAP Note", "Client Summary"])
-                    
                     with tab1:
-                        st.markdown("#### Professional SOAP Note")
-                        st.write(soap_note)
+                        soap_placeholder.write(soap_note)
                         
                         soap_file = export_to_text(soap_note, f"SOAP_Note_{patient_name}_{datetime.datetime.now().strftime('%Y%m%d')}.txt")
                         st.download_button(
@@ -1210,8 +1117,7 @@ Type your own notes above - the AI will convert them to professional SOAP format
                         )
                     
                     with tab2:
-                        st.markdown("#### Client Summary")
-                        st.write(client_summary)
+                        summary_placeholder.write(client_summary)
                         
                         summary_file = export_to_text(client_summary, f"Client_Summary_{patient_name}_{datetime.datetime.now().strftime('%Y%m%d')}.txt")
                         st.download_button(
@@ -1233,18 +1139,22 @@ Type your own notes above - the AI will convert them to professional SOAP format
         
         if st.button("Generate Client Email", type="secondary", key=f"gen_email_{current_apt.get('id', 'new')}"):
             with st.spinner("Generating personalized client email..."):
-                client_email = generate_client_email(current_apt)
+                # Stream the draft, then hand over to the preview below
+                email_stream = st.empty()
+                email_spans = []
+                with span("generate_client_email", email_spans) as record:
+                    client_email = generator.generate_client_email(current_apt, on_token=lambda text: email_stream.markdown(text + " ▌"))
+                    if client_email.startswith("Error"):
+                        record["error"] = True
+                email_stream.empty()
+                record_spans(current_apt.get('id'), email_spans)
                 
                 if not client_email.startswith("Error"):
                     st.session_state[email_key] = client_email
                     st.session_state[f"{email_key}_recipient"] = current_apt['client_name']
                     
                     # Update appointment with email
-                    for i, apt in enumerate(st.session_state.appointments):
-                        if apt['id'] == current_apt['id']:
-                            st.session_state.appointments[i]['client_email'] = client_email
-                            save_data()
-                            break
+                    update_appointment(current_apt.get('id'), client_email=client_email)
                     
                     st.success("Client email generated successfully!")
                 else:
@@ -1315,7 +1225,11 @@ Type your own notes above - the AI will convert them to professional SOAP format
                                 with st.spinner("Analyzing dental findings with AI..."):
                                     try:
                                         # Extract dental findings from appointment notes
-                                        findings = extract_dental_findings_from_text(current_apt['original_notes'])
+                                        dental_spans = []
+                                        with span("dental_extraction", dental_spans) as record:
+                                            findings = extract_dental_findings_from_text(current_apt['original_notes'], record)
+                                            record["findings"] = len(findings)
+                                        record_spans(current_apt.get('id'), dental_spans)
                                         
                                         if findings:
                                             # Generate chart data
@@ -1342,6 +1256,10 @@ Type your own notes above - the AI will convert them to professional SOAP format
                                         st.error(f"Error generating dental chart: {str(e)}")
                                         st.info("Dental chart generation failed - core functionality unaffected")
                         
+                        # A chart saved with the appointment is rebuilt from its stored codes
+                        if not st.session_state.get('dental_chart_data') and current_apt.get('dental_chart_data'):
+                            st.session_state.dental_chart_data = load_dental_chart(current_apt['dental_chart_data'])
+                        
                         # Display chart if generated
                         if st.session_state.get('dental_chart_data'):
                             try:
@@ -1364,15 +1282,11 @@ Type your own notes above - the AI will convert them to professional SOAP format
                                     if st.button("🖨️ Print Chart", key="print_dental_chart"):
                                         st.success("🖨️ Dental chart sent to printer!")
                                 
-                                # Add to appointment record
+                                # Add to appointment record, as one condition code per tooth
                                 if 'dental_chart_data' not in current_apt:
-                                    current_apt['dental_chart_data'] = st.session_state.dental_chart_data
-                                    # Update in appointments list
-                                    for i, apt in enumerate(st.session_state.appointments):
-                                        if apt['id'] == current_apt['id']:
-                                            st.session_state.appointments[i] = current_apt
-                                            save_data()
-                                            break
+                                    update_appointment(current_apt.get('id'), dental_chart_data=stored_dental_chart(st.session_state.dental_chart_data))
+                                    # Stored records are read-only - pick up the updated copy
+                                    st.session_state.current_appointment = data_store.get_appointment(current_apt.get('id')) or current_apt
                                 
                             except Exception as e:
                                 st.error(f"Error rendering dental chart: {str(e)}")
@@ -1398,35 +1312,33 @@ Type your own notes above - the AI will convert them to professional SOAP format
 elif menu_option == "View Appointments":
     st.title("Appointment History")
     
-    if not st.session_state.appointments:
+    if data_store.count_appointments() == 0:
         st.info("No appointments recorded yet. Create your first appointment!")
     else:
-        df_appointments = pd.DataFrame(st.session_state.appointments)
-        
         col1, col2 = st.columns(2)
         with col1:
             search_patient = st.text_input("Search by patient name")
         with col2:
-            filter_type = st.selectbox("Filter by appointment type", ["All"] + list(df_appointments["appointment_type"].unique()))
+            filter_type = st.selectbox("Filter by appointment type", ["All"] + data_store.appointment_types())
         
-        filtered_df = df_appointments.copy()
-        if search_patient:
-            filtered_df = filtered_df[filtered_df["patient_name"].str.contains(search_patient, case=False, na=False)]
-        if filter_type != "All":
-            filtered_df = filtered_df[filtered_df["appointment_type"] == filter_type]
+        # Only headers of the matching rows are fetched; note text loads on selection
+        filtered_df = pd.DataFrame(data_store.find_appointment_headers(
+            patient_name=search_patient or None,
+            appointment_type=filter_type if filter_type != "All" else None
+        ))
         
         display_columns = ["date", "patient_name", "client_name", "species", "appointment_type"]
-        if "age" in df_appointments.columns:
+        if "age" in filtered_df.columns:
             display_columns.append("age")
             
-        st.dataframe(filtered_df[display_columns], use_container_width=True)
+        st.dataframe(filtered_df.reindex(columns=display_columns), use_container_width=True)
         
         if len(filtered_df) > 0:
             st.markdown("---")
             selected_id = st.selectbox("Select appointment to view details:", filtered_df["id"].tolist())
             
             if selected_id:
-                appointment = next((apt for apt in st.session_state.appointments if apt["id"] == selected_id), None)
+                appointment = data_store.get_appointment(selected_id)
                 if appointment:
                     st.markdown(f"### Appointment Details - {appointment['patient_name']}")
                     
@@ -1491,13 +1403,37 @@ elif menu_option == "View Appointments":
                     
                     if st.button(email_button_text, type="secondary", key=f"generate_email_{appointment['id']}"):
                         with st.spinner("Generating personalized client email..."):
-                            client_email = generate_client_email(appointment)
+                            # Stream the draft where the preview will appear
+                            email_stream = st.empty()
+                            # Regenerate asks for a new draft, so it bypasses the response cache
+                            email_spans = []
+                            deferral = None
+                            with span("generate_client_email", email_spans, regenerated=bool(appointment.get("client_email"))) as record:
+                                try:
+                                    client_email = generator.generate_client_email(
+                                        appointment,
+                                        on_token=lambda text: email_stream.markdown(text + " ▌"),
+                                        use_cache=not appointment.get("client_email"),
+                                        priority=PRIORITY_LOW if appointment.get("client_email") else PRIORITY_NORMAL
+                                    )
+                                except AdmissionDeferred as e:
+                                    # Held back by the budget before anything was sent - not a failure
+                                    deferral = e
+                                    record["deferred"] = True
+                                    client_email = ""
+                                if client_email.startswith("Error"):
+                                    record["error"] = True
+                            record_spans(appointment['id'], email_spans)
                             
-                            if not client_email.startswith("Error"):
-                                st.success("Client email generated successfully!")
-                                
+                            if deferral is not None:
+                                email_stream.empty()
+                                retry_at = (f" (after {(datetime.datetime.now() + datetime.timedelta(seconds=deferral.retry_after)).strftime('%H:%M')})"
+                                            if deferral.retry_after else "")
+                                st.warning(f"⏳ {deferral}{retry_at}. The current email is kept.")
+                            elif not client_email.startswith("Error"):
                                 # Show email preview
-                                st.text_area("Email Preview", client_email, height=400, key=f"email_preview_{appointment['id']}")
+                                email_stream.text_area("Email Preview", client_email, height=400, key=f"email_preview_{appointment['id']}")
+                                st.success("Client email generated successfully!")
                                 
                                 # Download options
                                 col1, col2 = st.columns(2)
@@ -1519,22 +1455,19 @@ elif menu_option == "View Appointments":
                                             st.info("📱 Client will receive visit summary and care instructions")
                                 
                                 # Save email to appointment record
-                                for i, apt in enumerate(st.session_state.appointments):
-                                    if apt['id'] == appointment['id']:
-                                        st.session_state.appointments[i]['client_email'] = client_email
-                                        save_data()
-                                        break
+                                update_appointment(appointment['id'], client_email=client_email)
                                 
                             else:
+                                email_stream.empty()
                                 st.error(client_email)
 
 elif menu_option == "Patients":
     st.title("Patient Management")
     
-    if not st.session_state.patients:
+    if data_store.count_patients() == 0:
         st.info("No patients registered yet. Patients are automatically added when creating appointments.")
     else:
-        df_patients = pd.DataFrame(st.session_state.patients)
+        df_patients = pd.DataFrame(data_store.list_patients())
         
         st.markdown("### Registered Patients")
         st.dataframe(df_patients, use_container_width=True)
@@ -1553,12 +1486,129 @@ elif menu_option == "Patients":
             st.metric("Total Patients", len(df_patients))
             st.metric("Most Common Species", species_counts.index[0] if not species_counts.empty else "N/A")
 
+elif menu_option == "Dental Analytics":
+    st.title("Dental Analytics")
+    st.caption("Periodontal trends across every saved dental chart, by species, tooth and condition")
+    
+    dental_matrices = get_dental_matrices(data_store.data_version())
+    
+    if not dental_matrices:
+        st.info("No dental charts saved yet. Charts generated from COHAT notes on New Appointment are added here.")
+    else:
+        species_options = sorted(dental_matrices, key=lambda name: -len(dental_matrices[name]))
+        selected_species = st.selectbox("Species", species_options,
+                                        format_func=lambda name: f"{name} ({len(dental_matrices[name]):,} charts)")
+        matrix = dental_matrices[selected_species]
+        
+        query_started = time.perf_counter()
+        prevalence = matrix.prevalence()
+        severity_counts = matrix.severity_distribution()
+        group_shares = matrix.group_prevalence()
+        age_rows = matrix.age_bands()
+        periodontal_share = float(matrix.has_any(PERIODONTAL_CONDITIONS).mean())
+        query_ms = (time.perf_counter() - query_started) * 1000
+        
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Charts", f"{len(matrix):,}")
+        col2.metric("Periodontal Disease", f"{periodontal_share * 100:.1f}%",
+                    help="Charts with a pocket of 4 mm or more, or severe gingivitis")
+        col3.metric("Mean Affected Teeth", f"{(prevalence[:, 1:].sum() if len(matrix) else 0):.1f}")
+        st.caption(f"Computed over {len(matrix):,} charts in {query_ms:.1f} ms")
+        
+        st.markdown("### Prevalence by Tooth and Condition")
+        heatmap = pd.DataFrame(
+            [
+                {"Tooth": tooth, "Condition": DENTAL_CONDITIONS[condition]['label'], "Share of charts": prevalence[t, c]}
+                for t, tooth in enumerate(matrix.teeth)
+                for c, condition in enumerate(CONDITIONS) if condition != 'normal'
+            ]
+        )
+        st.altair_chart(
+            alt.Chart(heatmap).mark_rect().encode(
+                x=alt.X("Condition:N", sort=[DENTAL_CONDITIONS[c]['label'] for c in CONDITIONS if c != 'normal']),
+                y=alt.Y("Tooth:O", sort=list(matrix.teeth)),
+                color=alt.Color("Share of charts:Q", scale=alt.Scale(scheme="reds"), legend=alt.Legend(format="%")),
+                tooltip=["Tooth", "Condition", alt.Tooltip("Share of charts:Q", format=".1%")],
+            ),
+            use_container_width=True
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("### Conditions")
+            st.bar_chart(pd.Series(group_shares, name="Share of charts"))
+        with col2:
+            st.markdown("### Worst Severity per Chart")
+            st.bar_chart(pd.Series(severity_counts, index=SEVERITY_LABELS[:len(severity_counts)], name="Charts"))
+        
+        st.markdown("### By Age")
+        if age_rows:
+            st.dataframe(pd.DataFrame(age_rows).rename(columns={
+                "age_band": "Age",
+                "charts": "Charts",
+                "mean_affected_teeth": "Mean Affected Teeth",
+                "periodontal_share": "Periodontal Disease",
+                "mean_worst_severity": "Mean Worst Severity",
+            }).style.format({"Periodontal Disease": "{:.1%}", "Mean Affected Teeth": "{:.1f}", "Mean Worst Severity": "{:.2f}"}),
+                use_container_width=True, hide_index=True)
+
 elif menu_option == "Settings":
     st.title("Settings")
     
     st.markdown("### API Configuration")
-    st.write("**Current Configuration:** OpenAI GPT-4 + Whisper (hardcoded for testing)")
-    st.info("The app is configured to use OpenAI's GPT-4 for veterinary note generation and Whisper for audio transcription.")
+    st.write("**Current Configuration:** OpenAI chat models per task + Whisper")
+    if configured_provider() == "stub":
+        st.warning("🧪 **Offline stub provider** (VETSCRIBE_PROVIDER=stub): transcripts and notes are simulated locally, with latency and failures set by the VETSCRIBE_STUB_* variables. Nothing is sent to OpenAI.")
+    st.info("Each generation task runs on its first model below. If a request to it fails, the next model in its fallbacks is tried. Audio is transcribed with Whisper.")
+    
+    with st.expander("Model Routing"):
+        new_routes = {}
+        for task, label in TASKS.items():
+            route = model_routes[task]
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                primary = st.selectbox(
+                    label, AVAILABLE_MODELS,
+                    index=AVAILABLE_MODELS.index(route[0]) if route[0] in AVAILABLE_MODELS else 0,
+                    key=f"route_{task}"
+                )
+            with col2:
+                fallbacks = st.multiselect(
+                    f"{label} fallbacks", [model for model in AVAILABLE_MODELS if model != primary],
+                    default=[model for model in route[1:] if model in AVAILABLE_MODELS and model != primary],
+                    key=f"route_{task}_fallbacks"
+                )
+            new_routes[task] = [primary] + fallbacks
+        
+        if st.button("Save Model Routing"):
+            save_routes(new_routes)
+            model_routes.update(new_routes)
+            st.success("Model routing saved!")
+    
+    with st.expander("Model Benchmark"):
+        st.info("Replays fixture appointments through every model configured for the selected tasks and reports latency, tokens and estimated cost. Requests bypass the response cache and are billed as usual.")
+        benchmark_tasks = st.multiselect("Tasks", list(TASKS), default=list(TASKS), format_func=TASKS.get)
+        benchmark_repeats = st.number_input("Runs per appointment", min_value=1, max_value=10, value=1)
+        
+        if st.button("Run Benchmark"):
+            progress_bar = st.progress(0.0)
+            results = run_benchmark(
+                lambda **request: generator.metered_chat("benchmark", request), benchmark_request,
+                {task: model_routes[task] for task in benchmark_tasks},
+                repeats=int(benchmark_repeats),
+                on_progress=lambda done, total: progress_bar.progress(done / total, text=f"Request {done} of {total}")
+            )
+            st.session_state.benchmark_results = results
+        
+        if st.session_state.get('benchmark_results'):
+            results = st.session_state.benchmark_results
+            st.dataframe(pd.DataFrame(results), use_container_width=True)
+            st.download_button(
+                "Download Benchmark Results",
+                json.dumps(results, indent=2).encode('utf-8'),
+                file_name=f"vetscribe_model_benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime="application/json"
+            )
     
     st.markdown("---")
     st.markdown("### App Settings")
@@ -1573,6 +1623,14 @@ elif menu_option == "Settings":
         if st.button("Save Templates"):
             st.success("Templates saved successfully!")
     
+    with st.expander("Generation Mode"):
+        combined = st.checkbox(
+            "Generate SOAP note, client summary and client email in one request",
+            value=st.session_state.get('combined_generation', False),
+            help="Sends the appointment notes once instead of three times. Falls back to separate requests if the combined response is not valid. Notes are not streamed in this mode."
+        )
+        st.session_state.combined_generation = combined
+    
     st.markdown("---")
     st.markdown("### Data Management")
     
@@ -1581,26 +1639,89 @@ elif menu_option == "Settings":
     with col1:
         if st.button("Export All Data"):
             all_data = {
-                "appointments": st.session_state.appointments,
-                "patients": st.session_state.patients,
+                "appointments": data_store.list_appointments(),
+                "patients": data_store.list_patients(),
                 "export_date": datetime.datetime.now().isoformat()
             }
             
             st.download_button(
                 "Download Data Export",
-                json.dumps(all_data, indent=2).encode('utf-8'),
+                json.dumps(all_data, indent=2, default=dict).encode('utf-8'),
                 file_name=f"vetscribe_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                 mime="application/json"
             )
     
+        if os.path.exists(LATENCY_LOG_FILE):
+            with open(LATENCY_LOG_FILE, 'rb') as latency_file:
+                st.download_button(
+                    "Download Latency Log",
+                    latency_file.read(),
+                    file_name=f"vetscribe_latency_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+                    mime="application/x-ndjson",
+                    help="Per-stage timing spans of every appointment, one JSON object per line"
+                )
+    
     with col2:
         if st.button("Clear All Data", type="secondary"):
             if st.checkbox("I understand this will delete all data"):
-                st.session_state.appointments = []
-                st.session_state.patients = []
-                save_data()  # Persist the cleared state
+                data_store.clear()  # Persist the cleared state
                 st.success("All data cleared successfully!")
     
+    st.markdown("---")
+    st.markdown("### AI Response Caches")
+    st.info("Identical generation requests and previously transcribed audio are answered from a local cache. Counters cover this server process since it started.")
+    
+    for cache_label, cache in [("Generated notes & emails", response_cache), ("Transcripts", get_transcript_cache())]:
+        cache_stats = cache.stats()
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        st.markdown(f"**{cache_label}**")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Cache Hits", cache_stats['hits'])
+        with col2:
+            st.metric("Cache Misses", cache_stats['misses'])
+        with col3:
+            st.metric("Hit Rate", f"{cache_stats['hits'] / lookups * 100:.0f}%" if lookups else "N/A")
+        with col4:
+            st.metric("Size on Disk", f"{cache_stats['bytes'] / (1024 * 1024):.1f} MB")
+    
+    if st.button("Clear AI Caches"):
+        response_cache.clear()
+        get_transcript_cache().clear()
+        st.success("AI caches cleared!")
+    
+    st.markdown("---")
+    st.markdown("### AI Usage & Budgets")
+    st.info(f"Tokens, audio and latency of every AI call, recorded for clinic **{CLINIC_ID}** (set with VETSCRIBE_CLINIC). "
+            "Near a budget, regenerated client emails move to the cheapest model, and are deferred once it is almost used up; "
+            "clinical notes and transcription always run.")
+    
+    usage_today = usage_ledger.totals(CLINIC_ID, 24 * 60 * 60)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("AI Calls (24h)", usage_today['calls'], delta=f"{usage_today['errors']} failed" if usage_today['errors'] else None,
+                delta_color="inverse")
+    col2.metric("Tokens (24h)", f"{usage_today['tokens']:,}")
+    col3.metric("Tokens (last minute)", f"{usage_ledger.totals(CLINIC_ID, 60)['tokens']:,}")
+    col4.metric("Audio Minutes (24h)", f"{usage_today['audio_seconds'] / 60:.1f}")
+    
+    for label, fraction, _ in usage_ledger.budget_use(CLINIC_ID):
+        st.progress(min(fraction, 1.0), text=f"Budget for {label}: {fraction * 100:.0f}% used")
+    
+    usage_rows = usage_ledger.breakdown(24 * 60 * 60)
+    if usage_rows:
+        st.dataframe(pd.DataFrame(usage_rows), use_container_width=True, hide_index=True)
+    
+    with st.expander(f"Budgets for {CLINIC_ID}"):
+        budget = usage_ledger.budget(CLINIC_ID)
+        st.caption("0 means unlimited.")
+        tokens_per_minute = st.number_input("Tokens per minute", min_value=0, value=int(budget.tokens_per_minute), step=1000)
+        tokens_per_day = st.number_input("Tokens per day", min_value=0, value=int(budget.tokens_per_day), step=10000)
+        audio_minutes_per_day = st.number_input("Audio minutes per day", min_value=0.0,
+                                                value=float(budget.audio_minutes_per_day), step=10.0)
+        if st.button("Save Budgets"):
+            usage_ledger.set_budget(CLINIC_ID, Budget(tokens_per_minute, tokens_per_day, audio_minutes_per_day))
+            st.success("Budgets saved!")
+    
     st.markdown("---")
     st.markdown("### 🧪 Experimental Features")
     
@@ -0,0 +1,100 @@
+"""Latency, token and cost benchmark of chat models per task.
+
+Replays a fixed set of appointment notes through every model configured for
+each task and summarizes p50/p95 latency, mean token counts and estimated
+cost per (task, model). Requests are sent one at a time and bypass the
+response cache, so latencies are comparable between models.
+"""
+import time
+
+import numpy as np
+
+from routing import request_cost
+
+# Fixture appointments covering the common visit types
+BENCHMARK_APPOINTMENTS = [
+    {
+        "patient_name": "Bella", "species": "Dog", "breed": "Labrador Retriever", "age": "7 years",
+        "sex": "Female Spayed", "weight": "31 kg", "client_name": "Sarah Johnson",
+        "appointment_type": "Wellness Exam",
+        "original_notes": "Annual wellness visit. Owner reports normal appetite and energy, occasional stiffness after long walks. "
+                          "T 38.6, HR 96, RR 24. BCS 6/9. Mild tartar on upper premolars. Mild discomfort on extension of both hips. "
+                          "Rabies and DHPP boosters given. Recommend weight loss of 2 kg and start joint supplement. Recheck in 6 months.",
+    },
+    {
+        "patient_name": "Milo", "species": "Cat", "breed": "Domestic Shorthair", "age": "12 years",
+        "sex": "Male Neutered", "weight": "4.1 kg", "client_name": "David Chen",
+        "appointment_type": "Sick Visit",
+        "original_notes": "Owner reports increased thirst and urination for three weeks and weight loss of about 0.5 kg. "
+                          "Mildly dehydrated, thyroid slip palpable on the left. Blood and urine samples collected for CBC, "
+                          "chemistry, T4 and urinalysis. Subcutaneous fluids given. Will call owner with results tomorrow.",
+    },
+    {
+        "patient_name": "Rocky", "species": "Dog", "breed": "Boxer", "age": "4 years",
+        "sex": "Male", "weight": "29 kg", "client_name": "Maria Lopez",
+        "appointment_type": "Emergency",
+        "original_notes": "Presented after eating part of a chocolate cake about 2 hours ago, estimated dark chocolate 150 g. "
+                          "Restless, HR 140, panting. Apomorphine given, productive emesis with chocolate material. "
+                          "Activated charcoal administered. Monitor at home for vomiting, tremors or restlessness; return if any occur.",
+    },
+    {
+        "patient_name": "Luna", "species": "Dog", "breed": "Miniature Schnauzer", "age": "9 years",
+        "sex": "Female Spayed", "weight": "8 kg", "client_name": "Emily Park",
+        "appointment_type": "COHAT",
+        "original_notes": "COHAT under general anesthesia. Moderate calculus on 108 and 208, heavy calculus on 109. "
+                          "Gingivitis moderate on 104 and 204. 5mm pocket on 309, 6mm pocket on 409. Tooth 409 extracted. "
+                          "Fractured crown on 204. Scaling and polishing completed. Recommend daily brushing and recheck in 3 months.",
+    },
+]
+
+
+def run_benchmark(chat, build_request, routes, appointments=BENCHMARK_APPOINTMENTS, repeats=1, on_progress=None):
+    """Time every (task, model) pair in routes over the fixture appointments
+
+    chat(**request) sends one chat request and returns the API response;
+    build_request(task, appointment, model) makes the request for a task.
+    on_progress(done, total) is called after each request. Returns one
+    summary dict per (task, model), in route order.
+    """
+    runs = [(task, model, appointment)
+            for task, models in routes.items()
+            for model in models
+            for appointment in appointments
+            for _ in range(repeats)]
+    samples = {}
+    for done, (task, model, appointment) in enumerate(runs, start=1):
+        sample = samples.setdefault((task, model), {'latency': [], 'prompt': [], 'completion': [], 'errors': 0})
+        request = build_request(task, appointment, model)
+        start = time.perf_counter()
+        try:
+            response = chat(**request)
+        except Exception:
+            sample['errors'] += 1
+        else:
+            sample['latency'].append(time.perf_counter() - start)
+            usage = getattr(response, 'usage', None)
+            sample['prompt'].append(getattr(usage, 'prompt_tokens', 0) or 0)
+            sample['completion'].append(getattr(usage, 'completion_tokens', 0) or 0)
+        if on_progress is not None:
+            on_progress(done, len(runs))
+    return [summarize(task, model, sample) for (task, model), sample in samples.items()]
+
+
+def summarize(task, model, sample):
+    """Summary row for one (task, model) from its latencies and token counts"""
+    row = {'task': task, 'model': model, 'runs': len(sample['latency']), 'errors': sample['errors']}
+    if not sample['latency']:
+        return row
+    latency = np.array(sample['latency']) * 1000
+    prompt = np.array(sample['prompt'])
+    completion = np.array(sample['completion'])
+    row.update({
+        'p50_ms': float(np.percentile(latency, 50)),
+        'p95_ms': float(np.percentile(latency, 95)),
+        'prompt_tokens': float(prompt.mean()),
+        'completion_tokens': float(completion.mean()),
+    })
+    cost = request_cost(model, int(prompt.sum()), int(completion.sum()))
+    if cost is not None:
+        row['cost_per_run_usd'] = cost / len(latency)
+    return row
@@ -0,0 +1,371 @@
+"""Benchmark of the appointment pipeline's hot paths as the practice history grows.
+
+Builds synthetic practices of each size, writes them as a data file and times
+the paths the pages run against it:
+
+- startup load of the data file (and, for sqlite, reopening the database)
+- saving appointments and patients
+- compaction (the full data file rewrite that replaced save_data())
+- the View Appointments table with and without filters, and opening one appointment
+- the Patients species ``value_counts``
+- the Home dashboard metrics
+- rebuilding a stored dental chart and rendering it
+- loading every stored dental chart into the analytics matrices, and querying them
+- transcription, and generation through the app's ``generation.Generator``
+  (routing, response cache and usage metering), against the offline stub provider
+
+Nothing is sent over the network. Results are written as JSON, one entry per
+(size, stage) with p50/p95 timings, so runs can be compared by a script:
+
+    python pipeline_benchmark.py --sizes 1000 10000 100000 --output bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from audio import transcribe_source, write_wav
+from cache import DiskCache
+from dental_codes import encode_chart
+from dental_analytics import DentalMatrix, build_matrices
+from generation import Generator
+from ledger import UsageLedger
+from providers import StubProvider
+from routing import default_routes
+from storage import STORAGE_BACKENDS, open_data_store
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Repeats of each timed read; writes are timed per operation
+DEFAULT_REPEATS = 5
+DEFAULT_WRITES = 100
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+SPECIES = ("Dog", "Cat", "Bird", "Rabbit", "Ferret", "Guinea Pig", "Other")
+SPECIES_WEIGHTS = (0.55, 0.35, 0.03, 0.03, 0.02, 0.01, 0.01)
+APPOINTMENT_TYPES = ("Wellness Exam", "Sick Visit", "Surgery Consultation", "Follow-up", "Emergency",
+                     "Dental", "Vaccination", "Geriatric Check", "Other")
+NAMES = ("Bella", "Max", "Luna", "Charlie", "Lucy", "Cooper", "Daisy", "Milo", "Bailey", "Rocky",
+         "Sadie", "Oliver", "Molly", "Tucker", "Chloe", "Bear", "Zoe", "Duke", "Lily", "Toby")
+SURNAMES = ("Smith", "Johnson", "Chen", "Garcia", "Patel", "Lopez", "Nguyen", "Brown", "Park", "Miller")
+NOTE_SENTENCES = (
+    "Owner reports normal appetite and energy.",
+    "Occasional coughing at night for one week.",
+    "T 38.6, HR 96, RR 24, BCS 5/9.",
+    "Mild tartar on upper premolars.",
+    "Vaccines given as scheduled.",
+    "Recommend recheck in six months.",
+    "Skin mildly erythematous on ventral abdomen.",
+    "Started on a two-week course of antibiotics.",
+)
+DENTAL_CONDITIONS = ("gingivitis_mild", "calculus_moderate", "calculus_heavy", "pocket_5mm", "fracture", "extracted")
+DENTAL_TEETH = ("104", "108", "109", "204", "208", "209", "309", "409")
+
+
+def synthetic_practice(size, seed=0):
+    """(appointments, patients) for a practice with size appointments"""
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    patients = {}
+    appointments = []
+    for apt_id in range(1, size + 1):
+        # About four visits per patient
+        patient_key = rng.randrange(max(1, size // 4))
+        name = f"{NAMES[patient_key % len(NAMES)]} {patient_key}"
+        if patient_key not in patients:
+            patients[patient_key] = {
+                "name": name,
+                "client": f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}",
+                "species": rng.choices(SPECIES, SPECIES_WEIGHTS)[0],
+                "breed": "Mixed",
+                "age": f"{rng.randint(1, 16)} years",
+                "sex": rng.choice(("Male", "Female", "Male Neutered", "Female Spayed")),
+                "weight": f"{rng.randint(2, 40)} kg",
+                "added_date": start.strftime("%Y-%m-%d"),
+            }
+        patient = patients[patient_key]
+        notes = " ".join(rng.choice(NOTE_SENTENCES) for _ in range(6))
+        appointment = {
+            "id": apt_id,
+            "date": (start + datetime.timedelta(minutes=37 * apt_id)).strftime("%Y-%m-%d %H:%M"),
+            "patient_name": name,
+            "client_name": patient["client"],
+            "species": patient["species"],
+            "breed": patient["breed"],
+            "age": patient["age"],
+            "sex": patient["sex"],
+            "weight": patient["weight"],
+            "appointment_type": rng.choice(APPOINTMENT_TYPES),
+            "template_type": "SOAP Note",
+            "original_notes": notes,
+            "soap_note": f"SUBJECTIVE: {notes}\nOBJECTIVE: Not documented\nASSESSMENT: Not documented\nPLAN: Not documented",
+            "client_summary": f"Thank you for bringing {name} in today. {notes}",
+            "consent": "Client consent obtained",
+            "transcribed_audio": None,
+        }
+        if rng.random() < 0.3:
+            appointment["client_email"] = f"Dear {patient['client']},\n\n{notes}\n\nKind regards"
+        if appointment["appointment_type"] == "Dental":
+            findings = {tooth: rng.choice(DENTAL_CONDITIONS) for tooth in rng.sample(DENTAL_TEETH, 4)}
+            appointment["dental_chart_data"] = encode_chart(patient["species"], findings)
+        appointments.append(appointment)
+    return appointments, list(patients.values())
+
+
+def timing_summary(size, backend, stage, seconds, **extra):
+    """Result entry for one stage from its per-run durations"""
+    ms = np.array(seconds) * 1000
+    entry = {
+        "size": size,
+        "backend": backend,
+        "stage": stage,
+        "runs": len(seconds),
+        "total_ms": float(ms.sum()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "max_ms": float(ms.max()),
+    }
+    entry.update(extra)
+    return entry
+
+
+def timed(function, repeats):
+    """Durations of repeats calls of function()"""
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def view_appointments(store, **filters):
+    """What the View Appointments page computes before drawing"""
+    store.count_appointments()
+    types = store.appointment_types()
+    df = pd.DataFrame(store.find_appointment_headers(**filters))
+    display_columns = ["date", "patient_name", "client_name", "species", "appointment_type"]
+    if "age" in df.columns:
+        display_columns.append("age")
+    return types, df.reindex(columns=display_columns)
+
+
+def patients_value_counts(store):
+    """What the Patients page computes before drawing"""
+    df_patients = pd.DataFrame(store.list_patients())
+    return df_patients["species"].value_counts()
+
+
+def home_metrics(store):
+    """What the Home dashboard computes before drawing"""
+    return (
+        store.count_appointments(),
+        store.count_patients(),
+        store.count_appointments(with_field='client_email'),
+        store.count_appointments(with_field='dental_chart_data'),
+    )
+
+
+def bench_dental_chart(size, backend, appointments, repeats):
+    """Stored dental chart rebuild and render, if Streamlit is installed"""
+    try:
+        import streamlit  # noqa: F401 - rendering needs it
+    except ImportError:
+        return [{"size": size, "backend": backend, "stage": "render_dental_chart", "skipped": "streamlit is not installed"}]
+    import logging
+    # Outside `streamlit run` every element call warns about the missing script context
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    from dental import load_dental_chart, render_dental_chart
+
+    charts = [apt["dental_chart_data"] for apt in appointments if apt.get("dental_chart_data")][:repeats] or \
+        [encode_chart("Dog", {})]
+    seconds = []
+    for chart in charts:
+        start = time.perf_counter()
+        render_dental_chart(load_dental_chart(chart))
+        seconds.append(time.perf_counter() - start)
+    return [timing_summary(size, backend, "render_dental_chart", seconds)]
+
+
+def bench_dental_analytics(size, backend, store, repeats):
+    """Loading the Dental Analytics matrices from the store, and the page's queries over them"""
+    def load():
+        return build_matrices(store.appointment_fields(("species", "age", "dental_chart_data"), with_field="dental_chart_data"))
+
+    matrices = load()
+
+    def query():
+        for loaded in matrices.values():
+            # A fresh matrix each run, so cached per-chart counts are not reused
+            matrix = DentalMatrix(loaded.species, loaded.codes, loaded.ages)
+            matrix.prevalence()
+            matrix.severity_distribution()
+            matrix.group_prevalence()
+            matrix.age_bands()
+
+    charts = sum(len(matrix) for matrix in matrices.values())
+    return [
+        timing_summary(size, backend, "dental_analytics_load", timed(load, repeats), charts=charts),
+        timing_summary(size, backend, "dental_analytics_queries", timed(query, repeats), charts=charts),
+    ]
+
+
+def bench_stub_pipeline(size, backend, appointments, repeats, workdir):
+    """Transcription and generation through the stub provider with no simulated latency
+
+    Times the app's own overhead: audio preprocessing and splitting, and the
+    generation the pages run - building requests, routing them, the response
+    cache and usage metering - on notes not seen before and again on cached ones.
+    """
+    provider = StubProvider(latency_seconds=0, token_seconds=0, transcribe_seconds_per_mb=0)
+    rng = np.random.default_rng(0)
+    # One minute of 44.1 kHz stereo: speech-like bursts with pauses between them
+    rate = 44100
+    envelope = np.repeat(rng.random(60) > 0.3, rate)
+    samples = (rng.standard_normal((60 * rate, 2)) * 8000 * envelope[:, None]).astype(np.int16)
+    wav_bytes = write_wav(samples, rate)
+
+    transcribe = timed(lambda: transcribe_source(wav_bytes, lambda f: provider.transcribe(f, model="whisper-1", response_format="text")), repeats)
+
+    generator = Generator(
+        provider,
+        DiskCache(os.path.join(workdir, f"responses_{backend}_{size}"), RESPONSE_CACHE_MAX_BYTES),
+        default_routes(),
+        UsageLedger(os.path.join(workdir, f"usage_{backend}_{size}.db")),
+        "benchmark",
+    )
+    appointment = (appointments or synthetic_practice(1)[0])[0]
+    runs = iter(range(repeats * 2))
+
+    def fresh_appointment():
+        # Different notes every run, so nothing is answered from the cache
+        return {**appointment, "original_notes": f"{appointment['original_notes']} Visit {next(runs)}."}
+
+    def generate(apt):
+        """The New Appointment page's separate generation, then the client email"""
+        generator.generate_ai_responses(apt["original_notes"], ["soap", "client_summary"])
+        generator.generate_client_email(apt)
+
+    generation = timed(lambda: generate(fresh_appointment()), repeats)
+    cached = timed(lambda: generate(appointment), repeats + 1)[1:]
+    combined = timed(lambda: generator.generate_combined_documents(fresh_appointment()["original_notes"]), repeats)
+    return [
+        timing_summary(size, backend, "stub_transcription", transcribe, audio_seconds=60),
+        timing_summary(size, backend, "stub_generation", generation, requests_per_run=3),
+        timing_summary(size, backend, "stub_generation_cached", cached, requests_per_run=3),
+        timing_summary(size, backend, "stub_generation_combined", combined, requests_per_run=1),
+    ]
+
+
+def run_size(size, backend, repeats, writes, workdir):
+    """All stage results for one practice size"""
+    results = []
+    appointments, patients = synthetic_practice(size)
+    data_file = os.path.join(workdir, f"bench_{backend}_{size}.json")
+    with open(data_file, 'w') as f:
+        json.dump({"appointments": appointments, "patients": patients}, f)
+    file_bytes = os.path.getsize(data_file)
+
+    db_file = os.path.splitext(data_file)[0] + ".db"
+    store = None
+    seconds = []
+    for _ in range(repeats):
+        # Every run is a first start, which for sqlite imports the data file
+        store = None
+        for path in (db_file, db_file + "-wal", db_file + "-shm"):
+            if os.path.exists(path):
+                os.unlink(path)
+        start = time.perf_counter()
+        store = open_data_store(data_file, backend)
+        seconds.append(time.perf_counter() - start)
+    results.append(timing_summary(size, backend, "startup_load", seconds, file_bytes=file_bytes))
+    if backend == "sqlite":
+        results.append(timing_summary(size, backend, "startup_reopen", timed(
+            lambda: open_data_store(data_file, backend), repeats)))
+
+    results.append(timing_summary(size, backend, "view_appointments", timed(lambda: view_appointments(store), repeats)))
+    results.append(timing_summary(size, backend, "view_appointments_filtered", timed(
+        lambda: view_appointments(store, patient_name="bella", appointment_type="Dental",
+                                  date_from="2020-06-01 00:00", date_to="2021-06-01 00:00"), repeats)))
+    rng = random.Random(1)
+    results.append(timing_summary(size, backend, "open_appointment", timed(
+        lambda: store.get_appointment(rng.randint(1, size)), repeats * 20)))
+    results.append(timing_summary(size, backend, "patients_value_counts", timed(lambda: patients_value_counts(store), repeats)))
+    results.append(timing_summary(size, backend, "home_metrics", timed(lambda: home_metrics(store), repeats)))
+
+    new_appointments, new_patients = synthetic_practice(writes, seed=size)
+    # New patients, not more visits of existing ones
+    for record in new_patients:
+        record["name"] += " (new)"
+    for record in new_appointments:
+        record["patient_name"] += " (new)"
+    pending = iter(new_appointments)
+    results.append(timing_summary(size, backend, "save_appointment", timed(lambda: store.add_appointment(next(pending)), writes)))
+    pending_patients = iter(new_patients)
+
+    def save_patient():
+        patient = next(pending_patients, None)
+        if patient is not None and not store.has_patient(patient["name"]):
+            store.add_patient(patient)
+    results.append(timing_summary(size, backend, "save_patient", timed(save_patient, len(new_patients))))
+
+    if hasattr(store, "compact"):
+        results.append(timing_summary(size, backend, "save_data_compaction", timed(store.compact, 1)))
+    else:
+        results.append({"size": size, "backend": backend, "stage": "save_data_compaction",
+                        "skipped": "backend writes rows in place"})
+
+    results.extend(bench_dental_chart(size, backend, appointments, repeats))
+    results.extend(bench_dental_analytics(size, backend, store, repeats))
+    results.extend(bench_stub_pipeline(size, backend, appointments, repeats, workdir))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="appointment counts to test")
+    parser.add_argument("--backend", choices=STORAGE_BACKENDS, default=os.getenv("VETSCRIBE_STORAGE") or "journal")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="runs of each timed read")
+    parser.add_argument("--writes", type=int, default=DEFAULT_WRITES, help="appointments saved per size")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="vetscribe_bench_")
+    try:
+        for size in args.sizes:
+            for entry in run_size(size, args.backend, args.repeats, args.writes, workdir):
+                results.append(entry)
+                if "skipped" in entry:
+                    print(f"{size:>8} {entry['stage']:<28} skipped: {entry['skipped']}", file=sys.stderr)
+                else:
+                    print(f"{size:>8} {entry['stage']:<28} p50 {entry['p50_ms']:>10.2f} ms  p95 {entry['p95_ms']:>10.2f} ms",
+                          file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
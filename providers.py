@@ -0,0 +1,186 @@
+"""Backends that run the app's transcription and chat requests.
+
+Transcription and generation call an ``AIProvider``, which takes OpenAI
+request parameters and returns objects shaped like OpenAI responses.
+``open_provider()`` picks the backend from the ``VETSCRIBE_PROVIDER``
+environment variable: "openai" by default, which sends requests through
+``ai_client.OpenAIGateway``, or "stub".
+
+``StubProvider`` answers offline, so the pipeline can be load-tested and
+benchmarked without network access or billing. Answers are deterministic:
+the text depends only on the request, and simulated latency and failures
+depend only on the seed, the request and how many times it has been sent.
+Latency, per-token streaming delay and failure rate are set with the
+``VETSCRIBE_STUB_*`` variables in ``STUB_SETTINGS_ENV``.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from tokens import count_tokens
+
+PROVIDERS = ("openai", "stub")
+
+# StubProvider argument -> environment variable it is read from
+STUB_SETTINGS_ENV = {
+    "latency_seconds": "VETSCRIBE_STUB_LATENCY",
+    "token_seconds": "VETSCRIBE_STUB_TOKEN_DELAY",
+    "failure_rate": "VETSCRIBE_STUB_FAILURE_RATE",
+    "seed": "VETSCRIBE_STUB_SEED",
+}
+
+# Sentences stub transcripts are made of
+STUB_TRANSCRIPT_SENTENCES = (
+    "Owner reports the patient has been eating and drinking normally.",
+    "Temperature, heart rate and respiratory rate are within the expected range today.",
+    "Mild tartar noted on the upper premolars.",
+    "Vaccines are up to date and boosters were given.",
+    "Recommend a recheck in six months or sooner if anything changes.",
+    "Weight is stable since the last visit.",
+)
+# 16 kHz mono 16-bit audio; sets how much text a stub transcript has
+STUB_AUDIO_BYTES_PER_SECOND = 32000
+STUB_SECONDS_PER_SENTENCE = 5
+
+_TOOTH_NUMBER = re.compile(r'\b[1-4][01]\d\b')
+
+
+class ProviderError(RuntimeError):
+    """A request failure simulated by the stub provider"""
+
+
+class AIProvider:
+    """Interface shared by the AI backends"""
+
+    def chat(self, **request):
+        """Create a chat completion; returns an OpenAI-shaped response"""
+        raise NotImplementedError
+
+    def chat_stream(self, **request):
+        """Create a streamed chat completion; yields OpenAI-shaped chunks"""
+        raise NotImplementedError
+
+    def transcribe(self, file, **params):
+        """Transcribe an audio file object with Whisper parameters"""
+        raise NotImplementedError
+
+
+def configured_provider():
+    """Name of the provider selected by VETSCRIBE_PROVIDER"""
+    return (os.getenv("VETSCRIBE_PROVIDER") or "openai").lower()
+
+
+def stub_settings():
+    """StubProvider arguments set in the environment"""
+    settings = {}
+    for argument, variable in STUB_SETTINGS_ENV.items():
+        value = os.getenv(variable)
+        if value:
+            settings[argument] = int(value) if argument == "seed" else float(value)
+    return settings
+
+
+def open_provider(api_key=None, provider=None):
+    """Create the configured AI provider"""
+    provider = (provider or configured_provider()).lower()
+    if provider == "openai":
+        from ai_client import OpenAIGateway
+        return OpenAIGateway(api_key)
+    if provider == "stub":
+        return StubProvider(**stub_settings())
+    raise ValueError(f"Unknown AI provider '{provider}' - expected one of {', '.join(PROVIDERS)}")
+
+
+class StubProvider(AIProvider):
+    """Deterministic offline stand-in for OpenAI chat and Whisper"""
+
+    def __init__(self, latency_seconds=0.3, token_seconds=0.01, failure_rate=0.0,
+                 transcribe_seconds_per_mb=0.5, seed=0, sleep=time.sleep):
+        self.latency_seconds = latency_seconds
+        self.token_seconds = token_seconds
+        self.failure_rate = failure_rate
+        self.transcribe_seconds_per_mb = transcribe_seconds_per_mb
+        self.seed = seed
+        self.sleep = sleep
+        self._sends = {}
+        self._lock = threading.Lock()
+
+    def _outcome(self, key):
+        """Random source for this send of a request, and whether it fails"""
+        with self._lock:
+            sends = self._sends[key] = self._sends.get(key, 0) + 1
+        rng = random.Random(f"{self.seed}:{key}:{sends}")
+        return rng, rng.random() < self.failure_rate
+
+    def _start(self, key):
+        rng, failed = self._outcome(key)
+        # Latency varies +-50% around the configured mean
+        self.sleep(self.latency_seconds * rng.uniform(0.5, 1.5))
+        if failed:
+            raise ProviderError("Simulated provider failure")
+
+    @staticmethod
+    def _request_key(request):
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _chat_text(request):
+        """Deterministic answer in the shape the prompt asks for"""
+        system = request['messages'][0]['content'] if len(request['messages']) > 1 else ""
+        prompt = request['messages'][-1]['content']
+        if "dental specialist" in system:
+            return repr({tooth: "calculus_light" for tooth in sorted(set(_TOOTH_NUMBER.findall(prompt)))})
+        # Echo the prompt's words, limited like a response would be
+        words = prompt.split()[:min(request.get('max_tokens') or 400, 400) // 2]
+        text = f"[stub {request['model']}] " + " ".join(words)
+        if "JSON object" in system:
+            return json.dumps({"soap_note": f"SUBJECTIVE: {text}", "client_summary": text, "client_email": f"Dear client, {text}"})
+        return text
+
+    @staticmethod
+    def _usage(request, text):
+        prompt_tokens = sum(count_tokens(message['content'], request['model']) for message in request['messages'])
+        completion_tokens = count_tokens(text, request['model'])
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                               total_tokens=prompt_tokens + completion_tokens)
+
+    def chat(self, **request):
+        self._start(self._request_key(request))
+        text = self._chat_text(request)
+        usage = self._usage(request, text)
+        self.sleep(self.token_seconds * usage.completion_tokens)
+        message = SimpleNamespace(role="assistant", content=text)
+        return SimpleNamespace(
+            model=request['model'], usage=usage,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        )
+
+    def chat_stream(self, **request):
+        self._start(self._request_key(request))
+        text = self._chat_text(request)
+        for piece in re.findall(r'\S+\s*', text):
+            self.sleep(self.token_seconds)
+            delta = SimpleNamespace(role="assistant", content=piece)
+            yield SimpleNamespace(model=request['model'], choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)], usage=None)
+        if (request.get('stream_options') or {}).get('include_usage'):
+            # Like OpenAI, usage comes in a last chunk without choices
+            yield SimpleNamespace(model=request['model'], choices=[], usage=self._usage(request, text))
+
+    def transcribe(self, file, **params):
+        data = file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        self._start(self._request_key({'audio': digest, 'params': params}))
+        self.sleep(len(data) / (1024 * 1024) * self.transcribe_seconds_per_mb)
+        # Text scales with the audio length and depends only on its content
+        rng = random.Random(digest)
+        seconds = len(data) / STUB_AUDIO_BYTES_PER_SECOND
+        sentences = max(1, int(seconds // STUB_SECONDS_PER_SENTENCE))
+        text = " ".join(rng.choice(STUB_TRANSCRIPT_SENTENCES) for _ in range(sentences))
+        if params.get('response_format') == "text":
+            return text
+        return SimpleNamespace(text=text)
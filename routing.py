@@ -0,0 +1,76 @@
+"""Which chat model each task runs on, and what the models cost.
+
+Each task has a route: a list of models tried in order, so a task falls back
+to the next model when a request to the previous one fails. Routes are
+edited on the Settings page and saved to ``ROUTES_FILE``; tasks missing from
+the file use ``DEFAULT_MODEL``. Prices are used to estimate benchmark costs
+and to pick the model low-priority work is downgraded to near a budget.
+"""
+import json
+import os
+
+ROUTES_FILE = "vetscribe_models.json"
+
+# Task id -> label shown in Settings
+TASKS = {
+    "soap": "SOAP note",
+    "client_summary": "Client summary",
+    "client_email": "Client email",
+    "dental_findings": "Dental findings extraction",
+    "combined": "Combined documents",
+}
+
+DEFAULT_MODEL = "gpt-4"
+
+# USD per 1K prompt tokens and per 1K completion tokens
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+AVAILABLE_MODELS = tuple(MODEL_PRICES)
+
+
+def default_routes():
+    return {task: [DEFAULT_MODEL] for task in TASKS}
+
+
+def load_routes(path=ROUTES_FILE):
+    """Routes from path, with defaults for tasks it does not cover"""
+    routes = default_routes()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return routes
+    if not isinstance(saved, dict):
+        return routes
+    for task, models in saved.items():
+        if (task in TASKS and isinstance(models, list) and models
+                and all(isinstance(model, str) and model for model in models)):
+            routes[task] = models
+    return routes
+
+
+def save_routes(routes, path=ROUTES_FILE):
+    """Write routes to path atomically"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(routes, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def request_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of one request, or None for a model without a price"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return prompt_tokens / 1000 * prices[0] + completion_tokens / 1000 * prices[1]
+
+
+def cheapest_model(models=AVAILABLE_MODELS):
+    """The priced model in models with the lowest prompt plus completion price"""
+    priced = [model for model in models if model in MODEL_PRICES]
+    return min(priced or AVAILABLE_MODELS, key=lambda model: sum(MODEL_PRICES[model]))
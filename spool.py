@@ -0,0 +1,98 @@
+"""Disk spool for recorded consultation audio.
+
+An hour of 44.1 kHz recording is over 300 MB, too much to keep in every
+session's state. Each session instead writes its current recording to its own
+file in ``SPOOL_DIR`` and keeps only the small ``AudioSpool`` handle, and
+transcription maps the file into memory rather than reading it.
+
+Playback and download are not streamed: Streamlit's audio player and download
+button hold the whole file in server memory while the page shows them. They
+are therefore only offered for recordings up to ``PREVIEW_MAX_BYTES``; longer
+ones can still be transcribed. Spools not touched for ``SPOOL_MAX_AGE_SECONDS``
+belong to abandoned sessions and are deleted by ``cleanup_spools()``.
+"""
+import mmap
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from cache import content_hash
+
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "vetscribe_spool")
+SPOOL_MAX_AGE_SECONDS = 6 * 60 * 60
+SPOOL_SUFFIX = ".wav"
+# Largest recording offered for playback and download, about 20 minutes of 44.1 kHz mono
+PREVIEW_MAX_BYTES = 100 * 1024 * 1024
+
+
+class AudioSpool:
+    """One session's current recording, kept in a file instead of in memory"""
+
+    def __init__(self, session_id, spool_dir=SPOOL_DIR):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.path = os.path.join(spool_dir, f"{session_id}{SPOOL_SUFFIX}")
+        # content_hash() of the spooled recording, also used as its transcript cache key
+        self.digest = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def size(self):
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def previewable(self):
+        """Whether the recording is small enough to load for playback and download"""
+        return self.size() <= PREVIEW_MAX_BYTES
+
+    def write(self, audio_data):
+        """Replace the spooled recording; a no-op if it is unchanged
+
+        ``audio_data`` may be bytes or any buffer, such as a recorder's numpy
+        array, and is written without copying. Recorder widgets return the
+        same audio on every rerun, so the file is only rewritten when the
+        recording's content hash changed.
+        """
+        data = memoryview(audio_data).cast('B')
+        digest = content_hash(data)
+        if digest == self.digest and self.exists():
+            os.utime(self.path)
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        self.digest = digest
+
+    def open(self):
+        """Open the recording for streamed reading"""
+        os.utime(self.path)
+        return open(self.path, 'rb')
+
+    @contextmanager
+    def mapped(self):
+        """Memory-map the recording read-only for the duration of the block"""
+        with self.open() as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+    def clear(self):
+        """Delete the spooled recording"""
+        self.digest = None
+        if self.exists():
+            os.unlink(self.path)
+
+
+def cleanup_spools(spool_dir=SPOOL_DIR, max_age_seconds=SPOOL_MAX_AGE_SECONDS):
+    """Delete spooled recordings nobody has touched for max_age_seconds"""
+    if not os.path.isdir(spool_dir):
+        return
+    cutoff = time.time() - max_age_seconds
+    for name in os.listdir(spool_dir):
+        path = os.path.join(spool_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            # Removed by another process in the meantime
+            pass
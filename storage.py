@@ -0,0 +1,833 @@
+"""Pluggable persistence for VetScribe appointments and patients.
+
+Two backends implement the ``DataStore`` interface:
+
+- ``JournalStore`` keeps the data in memory and appends every mutation to a
+  JSON-lines journal next to the data file, so the cost of a save depends on
+  the size of the change rather than on the size of the practice history. A
+  background thread periodically folds the journal into a full snapshot (the
+  original ``vetscribe_data.json`` format) and truncates the records it
+  covered. On startup the snapshot is loaded and the journal replayed. Worker
+  processes sharing the files coordinate through an advisory file lock.
+- ``SqliteStore`` keeps the data in an embedded SQLite database with indexes on
+  the columns the app filters by, so pages only load the rows they display.
+
+``open_data_store()`` picks the backend from the ``VETSCRIBE_STORAGE``
+environment variable ("journal" by default, or "sqlite").
+
+Appointments are split into a lightweight header and a body holding the long
+note text and timing spans (``APPOINTMENT_BODY_FIELDS``). List views, filters and dashboard
+counts only touch headers; the body is loaded when one appointment is opened.
+
+Records returned by a store are read-only mappings. ``JournalStore`` hands out
+views of the records it shares between every session, and mutations replace a
+record rather than editing it (copy-on-write), so a view never changes under a
+reader and sessions never hold private copies of the practice history.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from types import MappingProxyType
+
+from locks import FileLock
+
+JOURNAL_SUFFIX = ".journal"
+LOCK_SUFFIX = ".lock"
+COMPACT_EVERY_RECORDS = 500  # Journal records before a background compaction
+COMPACT_EVERY_BYTES = 16 * 1024 * 1024  # ... or journal size, whichever first
+MARKER_MAX_BYTES = 256  # Longest snapshot marker line at the start of a journal
+
+STORAGE_BACKENDS = ("journal", "sqlite")
+
+# Long free-text fields kept out of appointment headers
+APPOINTMENT_BODY_FIELDS = ('soap_note', 'client_summary', 'original_notes', 'transcribed_audio', 'latency_spans')
+
+
+class DataStore:
+    """Interface shared by the storage backends
+
+    Reads return read-only mappings; change a record through the mutation
+    methods and read it again to see the result.
+    """
+
+    def get_appointment(self, appointment_id):
+        """Return one full appointment by id, or None"""
+        raise NotImplementedError
+
+    def find_appointment_headers(self, patient_name=None, client_name=None, appointment_type=None,
+                                 date_from=None, date_to=None):
+        """Return headers of the appointments matching the given filters, oldest first
+
+        Headers are appointments without their ``APPOINTMENT_BODY_FIELDS``.
+        Name filters are case-insensitive substring matches, the type filter is
+        exact and the date bounds compare against the "YYYY-MM-DD HH:MM" string.
+        """
+        raise NotImplementedError
+
+    def find_appointments(self, patient_name=None, client_name=None, appointment_type=None,
+                          date_from=None, date_to=None):
+        """Return full appointments matching the find_appointment_headers filters"""
+        raise NotImplementedError
+
+    def list_appointments(self):
+        """Return every appointment"""
+        return self.find_appointments()
+
+    def appointment_types(self):
+        """Return the distinct appointment types in use"""
+        raise NotImplementedError
+
+    def count_appointments(self, with_field=None):
+        """Count appointments, optionally only those where a field is set"""
+        raise NotImplementedError
+
+    def appointment_fields(self, fields, with_field=None):
+        """Return a tuple of the given header fields per appointment, oldest first
+
+        Only appointments where with_field is set are included, if given. For
+        aggregate views that need a few fields of many records.
+        """
+        raise NotImplementedError
+
+    def data_version(self):
+        """Number that changes whenever appointments or patients are written, by any process
+
+        For keying caches of data derived from the store.
+        """
+        raise NotImplementedError
+
+    def add_appointment(self, appointment):
+        """Persist a new appointment under a newly allocated id and return the id
+
+        Ids increase monotonically and are never reused, even by concurrent
+        writers in other processes; any ``id`` in the given record is ignored.
+        """
+        raise NotImplementedError
+
+    def update_appointment(self, appointment_id, fields):
+        """Persist a partial update of an existing appointment"""
+        raise NotImplementedError
+
+    def append_to_appointment(self, appointment_id, field, values):
+        """Append values to a list field of an existing appointment, atomically
+
+        Concurrent appends to the same field, from any process, all land.
+        """
+        raise NotImplementedError
+
+    def list_patients(self):
+        """Return every patient"""
+        raise NotImplementedError
+
+    def count_patients(self):
+        """Count registered patients"""
+        raise NotImplementedError
+
+    def has_patient(self, name):
+        """Whether a patient with exactly this name is registered"""
+        raise NotImplementedError
+
+    def add_patient(self, patient):
+        """Persist a new patient"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all appointments and patients"""
+        raise NotImplementedError
+
+
+def open_data_store(data_file, backend=None):
+    """Create the configured storage backend for a data file"""
+    backend = (backend or os.getenv("VETSCRIBE_STORAGE") or "journal").lower()
+    if backend == "sqlite":
+        return SqliteStore(os.path.splitext(data_file)[0] + ".db", import_from=data_file)
+    if backend == "journal":
+        return JournalStore(data_file)
+    raise ValueError(f"Unknown storage backend '{backend}' - expected one of {', '.join(STORAGE_BACKENDS)}")
+
+
+def _split_appointment(appointment):
+    """Split an appointment into its header and body dicts"""
+    header, body = {}, {}
+    for key, value in appointment.items():
+        (body if key in APPOINTMENT_BODY_FIELDS else header)[key] = value
+    return header, body
+
+
+def _matches(apt, patient_name, client_name, appointment_type, date_from, date_to):
+    """Whether an in-memory appointment passes the find_appointments filters"""
+    if patient_name and patient_name.lower() not in str(apt.get('patient_name', '')).lower():
+        return False
+    if client_name and client_name.lower() not in str(apt.get('client_name', '')).lower():
+        return False
+    if appointment_type and apt.get('appointment_type') != appointment_type:
+        return False
+    if date_from and apt.get('date', '') < date_from:
+        return False
+    if date_to and apt.get('date', '') > date_to:
+        return False
+    return True
+
+
+def _read_marker(f):
+    """Snapshot marker at the start of an open journal file, or None
+
+    Leaves the file positioned at its start.
+    """
+    first = f.readline(MARKER_MAX_BYTES)
+    f.seek(0)
+    if not first.endswith(b"\n"):
+        return None
+    try:
+        marker = json.loads(first)
+    except ValueError:
+        return None
+    return marker if isinstance(marker, dict) and marker.get('op') == 'snapshot' else None
+
+
+class JournalStore(DataStore):
+    """Appointment/patient store backed by a snapshot plus append-only journal
+
+    Several processes may share the same files: appends and compaction happen
+    under an exclusive lock on ``<data file>.lock``, and every read first
+    applies any records other processes appended since the last one.
+    """
+
+    def __init__(self, data_file, compact_every_records=COMPACT_EVERY_RECORDS,
+                 compact_every_bytes=COMPACT_EVERY_BYTES):
+        self.data_file = data_file
+        self.journal_file = data_file + JOURNAL_SUFFIX
+        self.compact_every_records = compact_every_records
+        self.compact_every_bytes = compact_every_bytes
+
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(data_file + LOCK_SUFFIX)
+        self._compaction_thread = None
+        self._compaction_lock = threading.Lock()  # One compaction per process at a time
+        self._appointments = {}  # id -> header, in insertion order
+        self._bodies = {}  # id -> body (APPOINTMENT_BODY_FIELDS)
+        self._patients = []
+        self._patient_names = set()
+        self._last_id = 0  # Highest appointment id ever allocated
+        self._seq = 0  # Sequence number of the last applied journal record
+        self._snapshot_seq = 0  # Sequence number covered by the snapshot on disk
+        self._journal_ino = None  # Inode of the journal file we are following
+        self._journal_generation = None  # Compaction count in its marker; None before the first
+        self._journal_bytes = 0  # Read position in that file
+
+        with self._lock, self._file_lock:
+            self._load_snapshot()
+            self._sync()
+            if os.path.exists(self.journal_file) and os.path.getsize(self.journal_file) > self._journal_bytes:
+                # Torn final write from a crash - everything before it is intact.
+                # Live writers hold the file lock, so nobody is mid-append.
+                with open(self.journal_file, 'r+b') as f:
+                    f.truncate(self._journal_bytes)
+        self._maybe_compact()
+
+    # ------------------------------------------------------------------
+    # Loading and replay
+    # ------------------------------------------------------------------
+    def _load_snapshot(self):
+        """Replace the in-memory state with the snapshot on disk"""
+        self._appointments = {}
+        self._bodies = {}
+        self._patients = []
+        self._patient_names = set()
+        self._seq = 0
+        self._snapshot_seq = 0
+        if not os.path.exists(self.data_file):
+            return
+        try:
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+            for apt in data.get('appointments', []):
+                self._appointments[apt['id']], self._bodies[apt['id']] = _split_appointment(apt)
+            self._patients = list(data.get('patients', []))
+            self._patient_names = {p.get('name') for p in self._patients}
+            self._last_id = max([data.get('last_appointment_id', 0), self._last_id, *self._appointments])
+            self._snapshot_seq = data.get('journal_seq', 0)
+            self._seq = self._snapshot_seq
+        except Exception as e:
+            print(f"⚠️ Could not read {self.data_file}: {str(e)}")
+
+    def _sync(self):
+        """Apply journal records appended since our last read, by any process"""
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            marker = _read_marker(f)
+            generation = marker.get('generation', 0) if marker else None
+            # Inode numbers are reused, so a replaced file is also told apart
+            # by the compaction generation in its marker
+            if (ino, generation) != (self._journal_ino, self._journal_generation):
+                # New journal file: either the first one, or another process
+                # compacted and it starts with a marker for its snapshot
+                self._journal_ino = ino
+                self._journal_generation = generation
+                self._journal_bytes = 0
+                if marker:
+                    if marker['seq'] > self._seq:
+                        # The snapshot holds records we never saw
+                        self._load_snapshot()
+                    self._snapshot_seq = marker['seq']
+
+            f.seek(self._journal_bytes)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partial record - still being written, or torn by a crash
+                    break
+                self._journal_bytes += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                # Records already folded into the snapshot are skipped, which
+                # keeps replay correct if we crashed mid-compaction
+                if record['seq'] <= self._seq:
+                    continue
+                self._apply(record)
+                self._seq = record['seq']
+
+    def _apply(self, record):
+        """Apply one journal record to the in-memory state"""
+        op = record['op']
+        data = record.get('data')
+
+        if op == 'add_appointment':
+            self._appointments[data['id']], self._bodies[data['id']] = _split_appointment(data)
+            self._last_id = max(self._last_id, data['id'])
+        elif op == 'update_appointment':
+            apt_id = record['id']
+            if apt_id in self._appointments:
+                # Replace rather than mutate so snapshots taken by the
+                # compactor are never modified underneath it
+                header, body = _split_appointment(data)
+                if header:
+                    self._appointments[apt_id] = {**self._appointments[apt_id], **header}
+                if body:
+                    self._bodies[apt_id] = {**self._bodies.get(apt_id, {}), **body}
+        elif op == 'append_to_appointment':
+            apt_id = record['id']
+            if apt_id in self._appointments:
+                field = record['field']
+                records = self._bodies if field in APPOINTMENT_BODY_FIELDS else self._appointments
+                current = records.get(apt_id, {})
+                records[apt_id] = {**current, field: [*(current.get(field) or []), *data]}
+        elif op == 'add_patient':
+            self._patients.append(dict(data))
+            self._patient_names.add(data.get('name'))
+        elif op == 'clear':
+            # Ids keep counting up so old exports never collide with new records
+            self._appointments = {}
+            self._bodies = {}
+            self._patients = []
+            self._patient_names = set()
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def _full(self, appointment_id):
+        """Header and body of an appointment joined into one record"""
+        return {**self._appointments[appointment_id], **self._bodies.get(appointment_id, {})}
+
+    def get_appointment(self, appointment_id):
+        with self._lock:
+            self._sync()
+            if appointment_id not in self._appointments:
+                return None
+            return MappingProxyType(self._full(appointment_id))
+
+    def find_appointment_headers(self, patient_name=None, client_name=None, appointment_type=None,
+                                 date_from=None, date_to=None):
+        with self._lock:
+            self._sync()
+            return [
+                MappingProxyType(apt) for apt in self._appointments.values()
+                if _matches(apt, patient_name, client_name, appointment_type, date_from, date_to)
+            ]
+
+    def find_appointments(self, patient_name=None, client_name=None, appointment_type=None,
+                          date_from=None, date_to=None):
+        with self._lock:
+            self._sync()
+            return [
+                MappingProxyType(self._full(apt_id)) for apt_id, apt in self._appointments.items()
+                if _matches(apt, patient_name, client_name, appointment_type, date_from, date_to)
+            ]
+
+    def appointment_types(self):
+        with self._lock:
+            self._sync()
+            return list(dict.fromkeys(apt.get('appointment_type') for apt in self._appointments.values()))
+
+    def count_appointments(self, with_field=None):
+        with self._lock:
+            self._sync()
+            if with_field is None:
+                return len(self._appointments)
+            records = self._bodies if with_field in APPOINTMENT_BODY_FIELDS else self._appointments
+            return sum(1 for apt in records.values() if apt.get(with_field))
+
+    def appointment_fields(self, fields, with_field=None):
+        with self._lock:
+            self._sync()
+            return [
+                tuple(apt.get(field) for field in fields) for apt in self._appointments.values()
+                if with_field is None or apt.get(with_field)
+            ]
+
+    def data_version(self):
+        with self._lock:
+            self._sync()
+            return self._seq
+
+    def list_patients(self):
+        with self._lock:
+            self._sync()
+            return [MappingProxyType(p) for p in self._patients]
+
+    def count_patients(self):
+        with self._lock:
+            self._sync()
+            return len(self._patients)
+
+    def has_patient(self, name):
+        with self._lock:
+            self._sync()
+            return name in self._patient_names
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+    def add_appointment(self, appointment):
+        """Journal a new appointment under the next free id"""
+        with self._lock, self._file_lock:
+            # Catch up first so ids allocated by other processes are never reused
+            self._sync()
+            apt_id = self._last_id + 1
+            data = {'id': apt_id}
+            data.update((key, value) for key, value in appointment.items() if key != 'id')
+            self._append_locked({'op': 'add_appointment', 'data': data})
+        self._maybe_compact()
+        return apt_id
+
+    def update_appointment(self, appointment_id, fields):
+        """Journal a partial update of an existing appointment"""
+        self._append({'op': 'update_appointment', 'id': appointment_id, 'data': fields})
+
+    def append_to_appointment(self, appointment_id, field, values):
+        """Journal an append to a list field; applied in journal order, so none is lost"""
+        self._append({'op': 'append_to_appointment', 'id': appointment_id, 'field': field, 'data': list(values)})
+
+    def add_patient(self, patient):
+        """Journal a new patient"""
+        self._append({'op': 'add_patient', 'data': patient})
+
+    def clear(self):
+        """Journal removal of all appointments and patients"""
+        self._append({'op': 'clear'})
+
+    def _append(self, record):
+        """Write one record to the journal and apply it"""
+        with self._lock, self._file_lock:
+            self._sync()
+            self._append_locked(record)
+        self._maybe_compact()
+
+    def _append_locked(self, record):
+        """Append and apply a record; the caller holds both locks and has synced"""
+        record = {'seq': self._seq + 1, **record}
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        with open(self.journal_file, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            ino = os.fstat(f.fileno()).st_ino
+        if ino != self._journal_ino:
+            # We just created the journal
+            self._journal_ino = ino
+            self._journal_generation = None
+            self._journal_bytes = 0
+        self._seq = record['seq']
+        self._journal_bytes += len(line)
+        self._apply(record)
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+    def _maybe_compact(self):
+        """Start a background compaction once the journal is large enough"""
+        with self._lock:
+            pending = self._seq - self._snapshot_seq
+            if pending < self.compact_every_records and self._journal_bytes < self.compact_every_bytes:
+                return
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(
+                target=self.compact, name="vetscribe-compaction", daemon=True
+            )
+            self._compaction_thread.start()
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot of the data file
+
+        Does nothing if this process is already compacting.
+        """
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+        tmp_file = f"{self.data_file}.{os.getpid()}.tmp"
+        try:
+            with self._lock, self._file_lock:
+                self._sync()
+                # Records are replaced, never mutated, so shallow copies are a
+                # consistent view we can serialize without holding the lock
+                appointments = [self._full(apt_id) for apt_id in self._appointments]
+                patients = list(self._patients)
+                seq = self._seq
+                last_id = self._last_id
+                journal = (self._journal_ino, self._journal_generation)
+                journal_offset = self._journal_bytes
+
+            with open(tmp_file, 'w') as f:
+                json.dump({'appointments': appointments, 'patients': patients,
+                           'journal_seq': seq, 'last_appointment_id': last_id}, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self._lock, self._file_lock:
+                self._sync()
+                if (self._journal_ino, self._journal_generation) != journal:
+                    # Another process compacted while we were writing
+                    os.unlink(tmp_file)
+                    return
+                os.replace(tmp_file, self.data_file)
+
+                # Keep only the records appended while the snapshot was written,
+                # behind a marker telling other processes which snapshot it follows
+                generation = (self._journal_generation or 0) + 1
+                marker = (json.dumps({'seq': seq, 'op': 'snapshot', 'generation': generation}) + "\n").encode('utf-8')
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(journal_offset)
+                    tail = f.read()
+                tmp_journal = self.journal_file + ".tmp"
+                with open(tmp_journal, 'wb') as f:
+                    f.write(marker + tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_journal, self.journal_file)
+                self._journal_ino = os.stat(self.journal_file).st_ino
+                self._journal_generation = generation
+                self._journal_bytes = len(marker) + self._journal_bytes - journal_offset
+                self._snapshot_seq = seq
+        except Exception as e:
+            print(f"⚠️ Journal compaction failed: {str(e)}")
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+        finally:
+            self._compaction_lock.release()
+
+
+class SqliteStore(DataStore):
+    """Appointment/patient store in an embedded SQLite database
+
+    Appointment headers are kept as JSON in a ``data`` column and the long
+    note text in a separate ``body`` column that only full reads select; the
+    fields the app filters and sorts by are also stored as indexed columns.
+    """
+
+    # Indexed columns mirrored out of each record
+    APPOINTMENT_COLUMNS = ('date', 'patient_name', 'client_name', 'species', 'appointment_type')
+    PATIENT_COLUMNS = ('name', 'client', 'species')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            patient_name TEXT,
+            client_name TEXT,
+            species TEXT,
+            appointment_type TEXT,
+            data TEXT NOT NULL,
+            body TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments(date);
+        CREATE INDEX IF NOT EXISTS idx_appointments_patient ON appointments(patient_name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_appointments_client ON appointments(client_name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_appointments_type ON appointments(appointment_type);
+
+        CREATE TABLE IF NOT EXISTS patients (
+            rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            client TEXT,
+            species TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name);
+
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO counters (name, value) VALUES ('appointment_id', 0);
+        INSERT OR IGNORE INTO counters (name, value) VALUES ('writes', 0);
+    """
+
+    def __init__(self, db_file, import_from=None):
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        # One connection shared by the Streamlit script threads, serialized by
+        # _lock; other processes are serialized by SQLite's own write lock
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._split_legacy_rows()
+
+        if import_from and (os.path.exists(import_from) or os.path.exists(import_from + JOURNAL_SUFFIX)):
+            self._import_json(import_from)
+
+    @contextmanager
+    def _write(self):
+        """Transaction that takes the database write lock up front
+
+        Read-modify-write sequences inside it cannot interleave with writers
+        on other connections, in this process or any other.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'writes'")
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def _split_legacy_rows(self):
+        """Move note text out of headers in databases created before the split"""
+        with self._write():
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(appointments)")]
+            if 'body' not in columns:
+                self._conn.execute("ALTER TABLE appointments ADD COLUMN body TEXT")
+            rows = self._conn.execute("SELECT data FROM appointments WHERE body IS NULL").fetchall()
+            for row in rows:
+                self._insert_appointment(json.loads(row[0]))
+
+    def _json_imported(self):
+        row = self._conn.execute("SELECT value FROM counters WHERE name = 'json_imported'").fetchone()
+        return bool(row and row[0])
+
+    def _import_json(self, data_file):
+        """One-time migration from the journal backend's data file
+
+        The data file is opened as a JournalStore, so records still in its
+        journal, not yet compacted into the snapshot, are imported too.
+        Recorded in the counters table, so clearing the database later does
+        not bring the JSON data back on the next start.
+        """
+        with self._lock:
+            if self._json_imported():
+                return
+        try:
+            # No background compaction of files we are only reading from
+            source = JournalStore(data_file, compact_every_records=float('inf'), compact_every_bytes=float('inf'))
+            appointments = source.list_appointments()
+            patients = source.list_patients()
+        except Exception as e:
+            print(f"⚠️ Could not import {data_file}: {str(e)}")
+            return
+        with self._write():
+            # Checked inside the transaction so concurrent first starts import once
+            if self._json_imported():
+                return
+            has_rows = self._conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM appointments) OR EXISTS (SELECT 1 FROM patients)"
+            ).fetchone()[0]
+            # A database with rows but no flag was migrated before the flag existed
+            if not has_rows:
+                for apt in appointments:
+                    self._insert_appointment(dict(apt))
+                for patient in patients:
+                    self._insert_patient(dict(patient))
+                # Ids the journal allocated to since-cleared records stay unused
+                self._conn.execute(
+                    "UPDATE counters SET value = MAX(value, ?) WHERE name = 'appointment_id'", (source._last_id,)
+                )
+            self._conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('json_imported', 1)")
+
+    def _insert_appointment(self, appointment):
+        header, body = _split_appointment(appointment)
+        values = [appointment.get(col) for col in self.APPOINTMENT_COLUMNS]
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO appointments (id, {', '.join(self.APPOINTMENT_COLUMNS)}, data, body) "
+            f"VALUES (?, {', '.join('?' for _ in self.APPOINTMENT_COLUMNS)}, ?, ?)",
+            [appointment['id'], *values, json.dumps(header), json.dumps(body)]
+        )
+
+    def _insert_patient(self, patient):
+        values = [patient.get(col) for col in self.PATIENT_COLUMNS]
+        self._conn.execute(
+            f"INSERT INTO patients ({', '.join(self.PATIENT_COLUMNS)}, data) "
+            f"VALUES ({', '.join('?' for _ in self.PATIENT_COLUMNS)}, ?)",
+            [*values, json.dumps(patient)]
+        )
+
+    @staticmethod
+    def _full(row):
+        """Join a (data, body) row into one appointment"""
+        return {**json.loads(row[0]), **json.loads(row[1] or '{}')}
+
+    def get_appointment(self, appointment_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data, body FROM appointments WHERE id = ?", (appointment_id,)).fetchone()
+        return MappingProxyType(self._full(row)) if row else None
+
+    def find_appointment_headers(self, patient_name=None, client_name=None, appointment_type=None,
+                                 date_from=None, date_to=None):
+        rows = self._select_appointments("data", patient_name, client_name, appointment_type, date_from, date_to)
+        return [MappingProxyType(json.loads(row[0])) for row in rows]
+
+    def find_appointments(self, patient_name=None, client_name=None, appointment_type=None,
+                          date_from=None, date_to=None):
+        rows = self._select_appointments("data, body", patient_name, client_name, appointment_type, date_from, date_to)
+        return [MappingProxyType(self._full(row)) for row in rows]
+
+    def _select_appointments(self, columns, patient_name, client_name, appointment_type, date_from, date_to):
+        """Run the find_appointments filters, returning the given columns"""
+        clauses, params = [], []
+        if patient_name:
+            clauses.append("patient_name LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(patient_name)}%")
+        if client_name:
+            clauses.append("client_name LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(client_name)}%")
+        if appointment_type:
+            clauses.append("appointment_type = ?")
+            params.append(appointment_type)
+        if date_from:
+            clauses.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("date <= ?")
+            params.append(date_to)
+
+        sql = f"SELECT {columns} FROM appointments"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id"
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def appointment_types(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT appointment_type FROM appointments GROUP BY appointment_type ORDER BY MIN(id)"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _truthy(column, field):
+        """(SQL condition, params) for a JSON field being truthy, as apt.get(field) in the journal backend"""
+        sql = (
+            f"CASE json_type({column}, ?)"
+            f" WHEN 'true' THEN 1"
+            f" WHEN 'integer' THEN json_extract({column}, ?) != 0"
+            f" WHEN 'real' THEN json_extract({column}, ?) != 0"
+            f" WHEN 'text' THEN json_extract({column}, ?) != ''"
+            f" WHEN 'array' THEN json_array_length({column}, ?) > 0"
+            f" WHEN 'object' THEN json_extract({column}, ?) != '{{}}'"
+            f" ELSE 0 END"  # null, false or missing
+        )
+        return sql, [f"$.{field}"] * 6
+
+    def count_appointments(self, with_field=None):
+        with self._lock:
+            if with_field is None:
+                row = self._conn.execute("SELECT COUNT(*) FROM appointments").fetchone()
+            else:
+                column = "body" if with_field in APPOINTMENT_BODY_FIELDS else "data"
+                condition, params = self._truthy(column, with_field)
+                row = self._conn.execute(f"SELECT COUNT(*) FROM appointments WHERE {condition}", params).fetchone()
+        return row[0]
+
+    def appointment_fields(self, fields, with_field=None):
+        # One JSON array per row, so nested values come back parsed
+        columns = ", ".join("json_extract(data, ?)" for _ in fields)
+        sql = f"SELECT json_array({columns}) FROM appointments"
+        params = [f"$.{field}" for field in fields]
+        if with_field is not None:
+            condition, condition_params = self._truthy("data", with_field)
+            sql += f" WHERE {condition}"
+            params += condition_params
+        sql += " ORDER BY id"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [tuple(json.loads(row[0])) for row in rows]
+
+    def add_appointment(self, appointment):
+        with self._write():
+            # The counter never goes backwards, so ids are not reused after
+            # deletes; MAX(id) covers rows imported before the counter existed
+            self._conn.execute(
+                "UPDATE counters SET value = MAX(value, (SELECT COALESCE(MAX(id), 0) FROM appointments)) + 1 "
+                "WHERE name = 'appointment_id'"
+            )
+            apt_id = self._conn.execute("SELECT value FROM counters WHERE name = 'appointment_id'").fetchone()[0]
+            data = {'id': apt_id}
+            data.update((key, value) for key, value in appointment.items() if key != 'id')
+            self._insert_appointment(data)
+        return apt_id
+
+    def update_appointment(self, appointment_id, fields):
+        with self._write():
+            row = self._conn.execute("SELECT data, body FROM appointments WHERE id = ?", (appointment_id,)).fetchone()
+            if row is None:
+                return
+            self._insert_appointment({**self._full(row), **fields})
+
+    def append_to_appointment(self, appointment_id, field, values):
+        with self._write():
+            row = self._conn.execute("SELECT data, body FROM appointments WHERE id = ?", (appointment_id,)).fetchone()
+            if row is None:
+                return
+            appointment = self._full(row)
+            appointment[field] = [*(appointment.get(field) or []), *values]
+            self._insert_appointment(appointment)
+
+    def data_version(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM counters WHERE name = 'writes'").fetchone()[0]
+
+    def list_patients(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM patients ORDER BY rowid").fetchall()
+        return [MappingProxyType(json.loads(row[0])) for row in rows]
+
+    def count_patients(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+    def has_patient(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM patients WHERE name = ? LIMIT 1", (name,)).fetchone()
+        return row is not None
+
+    def add_patient(self, patient):
+        with self._write():
+            self._insert_patient(patient)
+
+    def clear(self):
+        with self._write():
+            self._conn.execute("DELETE FROM appointments")
+            self._conn.execute("DELETE FROM patients")
+
+
+def _escape_like(text):
+    """Escape LIKE wildcards in user-supplied search text"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
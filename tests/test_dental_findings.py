@@ -0,0 +1,53 @@
+from dental_findings import RULE_COVERAGE_THRESHOLD, extract_findings
+
+
+def test_reads_chart_vocabulary():
+    extraction = extract_findings("Moderate calculus on 108 and 208, 6mm pocket on 409. 104 fractured.")
+    assert extraction.findings == {
+        '108': 'calculus_moderate', '208': 'calculus_moderate', '409': 'pocket_6mm', '104': 'fracture',
+    }
+    assert extraction.coverage == 1.0
+
+
+def test_teeth_only_clause_continues_previous_condition():
+    extraction = extract_findings("Mild gingivitis on 101, 201; 301.")
+    assert extraction.findings == {'101': 'gingivitis_mild', '201': 'gingivitis_mild', '301': 'gingivitis_mild'}
+
+
+def test_literal_condition_keys():
+    extraction = extract_findings("108 calculus_moderate, 409 pocket_5mm, 204 fracture")
+    assert extraction.findings == {'108': 'calculus_moderate', '409': 'pocket_5mm', '204': 'fracture'}
+    assert extraction.coverage == 1.0
+
+
+def test_unknown_key_does_not_inherit_previous_condition():
+    extraction = extract_findings("108 calculus_moderate, 409 pocket_8mm")
+    assert extraction.findings == {'108': 'calculus_moderate'}
+    assert extraction.coverage < RULE_COVERAGE_THRESHOLD
+
+
+def test_uncharted_finding_does_not_inherit_previous_condition():
+    extraction = extract_findings("Heavy tartar on 108, resorption on 409")
+    assert extraction.findings == {'108': 'calculus_heavy'}
+    assert extraction.coverage < RULE_COVERAGE_THRESHOLD
+
+
+def test_nothing_read_has_no_coverage():
+    extraction = extract_findings(
+        "Tooth resorption on the left mandibular canine; grade 2 mobility of the right maxillary fourth premolar"
+    )
+    assert extraction.findings == {}
+    assert extraction.coverage == 0.0
+    assert extract_findings("").coverage == 0.0
+
+
+def test_negated_mentions_are_ignored():
+    extraction = extract_findings("No fractures and no resorption. Mild calculus on 108.")
+    assert extraction.findings == {'108': 'calculus_light'}
+    assert extraction.coverage == 1.0
+
+
+def test_shallow_pockets_are_normal():
+    extraction = extract_findings("Probing depth 2mm on 204.")
+    assert extraction.findings == {}
+    assert extraction.coverage == 1.0
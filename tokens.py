@@ -0,0 +1,116 @@
+"""Token counting and splitting of long notes for chat models.
+
+Hour-long consultations transcribe to more text than fits in a model's
+context next to the prompt template and the response. ``fits_context``
+checks a request before it is sent, and ``split_sections`` cuts oversized
+notes into overlapping sections on sentence boundaries so each can be
+processed separately. Tokens are counted with tiktoken when it is installed
+and estimated conservatively from the character count otherwise.
+"""
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+# Without tiktoken; English averages about 4 characters a token
+ESTIMATED_CHARS_PER_TOKEN = 3
+# Per-message framing added by the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+# Kept free in case the estimate or the framing is off
+CONTEXT_MARGIN_TOKENS = 100
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def context_tokens(model):
+    """Context window of a model, in tokens"""
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model="gpt-4"):
+    """Number of tokens in text for model (an upper estimate without tiktoken)"""
+    if tiktoken is None:
+        return -(-len(text) // ESTIMATED_CHARS_PER_TOKEN)
+    return len(_encoding(model).encode(text))
+
+
+def request_tokens(request):
+    """Prompt tokens of a chat completion request"""
+    model = request['model']
+    return sum(count_tokens(message['content'], model) + MESSAGE_OVERHEAD_TOKENS
+               for message in request['messages'])
+
+
+def fits_context(request):
+    """Whether a chat request's prompt and response both fit in the model context"""
+    needed = request_tokens(request) + request.get('max_tokens', 0) + CONTEXT_MARGIN_TOKENS
+    return needed <= context_tokens(request['model'])
+
+
+def _units(text, max_tokens, model):
+    """(text, tokens) per sentence, with over-long sentences cut at words"""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence, model)
+        if tokens <= max_tokens:
+            yield sentence, tokens
+            continue
+        words, size = [], 0
+        for word in sentence.split():
+            word_tokens = count_tokens(word, model) + 1
+            if words and size + word_tokens > max_tokens:
+                yield " ".join(words), size
+                words, size = [], 0
+            words.append(word)
+            size += word_tokens
+        if words:
+            yield " ".join(words), size
+
+
+def split_sections(text, max_tokens, overlap_tokens=0, model="gpt-4"):
+    """Split text into sections of at most max_tokens, in order
+
+    Sections break between sentences. Each section after the first repeats
+    up to overlap_tokens of trailing sentences from the previous one, so a
+    fact spanning a break is seen whole at least once.
+    """
+    sections = []
+    current, size = [], 0
+    for unit, tokens in _units(text, max_tokens, model):
+        if current and size + tokens > max_tokens:
+            sections.append(" ".join(sentence for sentence, _ in current))
+            carried, carried_size = [], 0
+            for sentence, sentence_tokens in reversed(current):
+                if (carried_size + sentence_tokens > overlap_tokens
+                        or carried_size + sentence_tokens + tokens > max_tokens):
+                    break
+                carried.insert(0, (sentence, sentence_tokens))
+                carried_size += sentence_tokens
+            current, size = carried, carried_size
+        current.append((unit, tokens))
+        size += tokens
+    if current:
+        sections.append(" ".join(sentence for sentence, _ in current))
+    return sections
@@ -0,0 +1,153 @@
+"""Timing spans for the stages a clinician waits on, and a log of them.
+
+A span is a small dict: the ``stage`` name, when it started (``at``, epoch
+seconds), how long it took (``ms``), whether it failed (``error``) and any
+stage-specific attributes. Spans are stored on the appointment they belong to
+and appended to a ``LatencyLog``: a JSON-lines file that doubles as the
+structured log export and feeds the rolling per-stage percentiles on the
+dashboard. The log is rotated once it passes ``max_bytes``, keeping one old
+file; rotation is serialized across processes by a lock file, and recent
+reads reach back into the old file until they have a full window of spans.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from locks import FileLock
+
+# Stage -> label, in pipeline order
+STAGES = {
+    "audio_ingest": "Audio ingest",
+    "audio_preprocess": "Audio preprocessing",
+    "transcription": "Transcription",
+    "generate_combined": "Combined generation",
+    "generate_soap": "SOAP note generation",
+    "generate_client_summary": "Client summary generation",
+    "generate_client_email": "Client email generation",
+    "dental_extraction": "Dental findings extraction",
+    "save_appointment": "Save appointment",
+    "pims_export": "PIMS export",
+}
+
+LATENCY_LOG_MAX_BYTES = 8 * 1024 * 1024
+# Spans per stage the rolling percentiles cover
+ROLLING_WINDOW = 200
+# How much of the end of the log is read for them
+ROLLING_TAIL_BYTES = 1024 * 1024
+
+
+@contextmanager
+def span(stage, spans, **attributes):
+    """Time the block as one span appended to spans
+
+    Yields the span dict so the block can add attributes, or set ``error``
+    for failures reported without raising.
+    """
+    record = {"stage": stage, "at": round(time.time(), 3), **attributes}
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record["error"] = True
+        raise
+    finally:
+        record["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        spans.append(record)
+
+
+def timing_spans(timings, at=None, **attributes):
+    """Spans from a {stage: seconds} dict of stages that ran back to back"""
+    at = time.time() - sum(timings.values()) if at is None else at
+    spans = []
+    for stage, seconds in timings.items():
+        spans.append({"stage": stage, "at": round(at, 3), "ms": round(seconds * 1000, 2), **attributes})
+        at += seconds
+    return spans
+
+
+def _tail_spans(path, tail_bytes):
+    """Spans in the last tail_bytes of a JSON-lines file, oldest first"""
+    try:
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - tail_bytes))
+            data = f.read()
+    except OSError:
+        return []
+    lines = data.split(b"\n")
+    if size > tail_bytes:
+        # The first line is cut off
+        lines = lines[1:]
+    spans = []
+    for line in lines:
+        try:
+            spans.append(json.loads(line))
+        except ValueError:
+            continue
+    return spans
+
+
+class LatencyLog:
+    """Append-only JSON-lines log of spans, with rolling percentiles per stage"""
+
+    def __init__(self, path, max_bytes=LATENCY_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path + ".lock")
+
+    def record(self, spans, appointment_id=None):
+        """Append spans, tagged with the appointment they belong to"""
+        if not spans:
+            return
+        lines = "".join(json.dumps({**s, "appointment_id": appointment_id}) + "\n" for s in spans)
+        with self._lock:
+            if self._size() > self.max_bytes:
+                with self._file_lock:
+                    # Checked again under the lock: another process may have just rotated
+                    if self._size() > self.max_bytes:
+                        os.replace(self.path, self.path + ".1")
+            # One write per batch, so concurrent appenders do not interleave lines
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def recent(self, tail_bytes=ROLLING_TAIL_BYTES, min_spans=ROLLING_WINDOW):
+        """Spans from the last tail_bytes of the log, oldest first
+
+        Just after a rotation the current file holds fewer than min_spans
+        spans, so the end of the rotated file is read before them.
+        """
+        spans = _tail_spans(self.path, tail_bytes)
+        if len(spans) < min_spans:
+            spans = _tail_spans(self.path + ".1", tail_bytes) + spans
+        return spans
+
+    def stage_stats(self, window=ROLLING_WINDOW):
+        """{stage: {'runs', 'errors', 'p50_ms', 'p95_ms'}} over each stage's last window spans"""
+        durations, errors = {}, {}
+        for s in self.recent(min_spans=window):
+            stage = s.get("stage")
+            if stage is None or "ms" not in s:
+                continue
+            durations.setdefault(stage, []).append(s["ms"])
+            errors.setdefault(stage, []).append(bool(s.get("error")))
+        stats = {}
+        for stage in sorted(durations, key=lambda name: list(STAGES).index(name) if name in STAGES else len(STAGES)):
+            ms = np.array(durations[stage][-window:])
+            stats[stage] = {
+                "runs": len(ms),
+                "errors": sum(errors[stage][-window:]),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+            }
+        return stats